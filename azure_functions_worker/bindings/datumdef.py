@@ -23,6 +23,24 @@ from .nullable_converters import (
 )
 
 
+SHARED_MEMORY_PROTO_DATUM_TYPES = (
+    'collection_bytes', 'collection_string', 'collection_double',
+    'collection_sint64', 'http'
+)
+"""
+Datum types that are transferred over shared memory as their serialized
+protobuf message.
+"""
+
+_SHARED_MEMORY_PROTO_DATA_TYPES = {
+    protos.RpcDataType.collection_bytes: protos.CollectionBytes,
+    protos.RpcDataType.collection_string: protos.CollectionString,
+    protos.RpcDataType.collection_double: protos.CollectionDouble,
+    protos.RpcDataType.collection_sint64: protos.CollectionSInt64,
+    protos.RpcDataType.http: protos.RpcHttp,
+}
+
+
 class Datum:
     def __init__(self, value, type):
         self.value = value
@@ -98,6 +116,8 @@ class Datum:
             val = td.collection_bytes
         elif tt == 'collection_string':
             val = td.collection_string
+        elif tt == 'collection_double':
+            val = td.collection_double
         elif tt == 'collection_sint64':
             val = td.collection_sint64
         elif tt == 'model_binding_data':
@@ -139,6 +159,20 @@ class Datum:
             val = shmem_mgr.get_string(mem_map_name, offset, count)
             if val is not None:
                 ret_val = cls(val, 'string')
+        elif data_type == protos.RpcDataType.json:
+            val = shmem_mgr.get_string(mem_map_name, offset, count)
+            if val is not None:
+                ret_val = cls(val, 'json')
+        elif data_type in _SHARED_MEMORY_PROTO_DATA_TYPES:
+            type_name = protos.RpcDataType.Name(data_type)
+            # Collections and HTTP data are transferred as their serialized
+            # protobuf message
+            message = shmem_mgr.get_message(
+                mem_map_name, offset, count,
+                _SHARED_MEMORY_PROTO_DATA_TYPES[data_type])
+            if message is not None:
+                ret_val = cls.from_typed_data(
+                    protos.TypedData(**{type_name: message}))
 
         if ret_val is not None:
             logger.info(
@@ -151,11 +185,15 @@ class Datum:
     def to_rpc_shared_memory(
             cls,
             datum: 'Datum',
-            shmem_mgr) -> Optional[protos.RpcSharedMemory]:
+            shmem_mgr,
+            typed_data: Optional[protos.TypedData] = None) \
+            -> Optional[protos.RpcSharedMemory]:
         """
         Writes the given value to shared memory and returns the corresponding
         RpcSharedMemory object which can be sent back to the functions host over
         RPC.
+        typed_data is the datum already converted by datum_as_proto, if any,
+        for collection and http values.
         """
         if datum.type == 'bytes':
             value = datum.value
@@ -165,6 +203,18 @@ class Datum:
             value = datum.value
             shared_mem_meta = shmem_mgr.put_string(value)
             data_type = protos.RpcDataType.string
+        elif datum.type == 'json':
+            value = datum.value
+            shared_mem_meta = shmem_mgr.put_string(value)
+            data_type = protos.RpcDataType.json
+        elif datum.type in SHARED_MEMORY_PROTO_DATUM_TYPES:
+            # Collections and HTTP data are transferred as their serialized
+            # protobuf message
+            if typed_data is None:
+                typed_data = datum_as_proto(datum)
+            value = getattr(typed_data, datum.type)
+            shared_mem_meta = shmem_mgr.put_bytes(value.SerializeToString())
+            data_type = protos.RpcDataType.Value(datum.type)
         else:
             raise NotImplementedError(
                 f'Unsupported datum type ({datum.type}) for shared memory'
@@ -195,6 +245,9 @@ def datum_as_proto(datum: Datum) -> protos.TypedData:
         return protos.TypedData(bytes=datum.value)
     elif datum.type == 'json':
         return protos.TypedData(json=datum.value)
+    elif datum.type in ('collection_bytes', 'collection_string',
+                        'collection_double', 'collection_sint64'):
+        return protos.TypedData(**{datum.type: datum.value})
     elif datum.type == 'http':
         return protos.TypedData(http=protos.RpcHttp(
             status_code=datum.value['status_code'].value,
@@ -2,6 +2,7 @@
 # Licensed under the MIT License.
 import os
 import sys
+import time
 import typing
 
 from .. import protos
@@ -13,6 +14,7 @@ from ..constants import (
 )
 from ..http_v2 import HttpV2Registry
 from ..logging import logger
+from ..utils import invocation_metrics
 from . import datumdef, generic
 from .shared_memory_data_transfer import SharedMemoryManager
 
@@ -173,8 +175,11 @@ def from_incoming_proto(
         datum = datumdef.Datum.from_typed_data(val)
     elif pb_type == PB_TYPE_RPC_SHARED_MEMORY:
         # Data was sent over shared memory, attempt to read
+        start = time.perf_counter()
         datum = datumdef.Datum.from_rpc_shared_memory(pb.rpc_shared_memory,
                                                       shmem_mgr)
+        invocation_metrics.add_to_current_timer(
+            invocation_metrics.SHARED_MEMORY, time.perf_counter() - start)
     else:
         raise TypeError(f'Unknown ParameterBindingType: {pb_type}')
 
@@ -221,7 +226,8 @@ def _does_datatype_support_caching(datum: datumdef.Datum):
 
 def _can_transfer_over_shmem(shmem_mgr: SharedMemoryManager,
                              is_function_data_cache_enabled: bool,
-                             datum: datumdef.Datum):
+                             datum: datumdef.Datum,
+                             typed_data: typing.Optional[protos.TypedData]):
     """
     If shared memory is enabled and supported for the given datum, try to
     transfer to host over shared memory as a default.
@@ -233,7 +239,7 @@ def _can_transfer_over_shmem(shmem_mgr: SharedMemoryManager,
     if not shmem_mgr.is_enabled():
         # If shared memory usage is not enabled, no further checks required
         return False
-    if shmem_mgr.is_supported(datum):
+    if shmem_mgr.is_supported(datum, typed_data):
         # If transferring this object over shared memory is supported, do so.
         return True
     if is_function_data_cache_enabled and _does_datatype_support_caching(datum):
@@ -260,10 +266,20 @@ def to_outgoing_param_binding(binding: str, obj: typing.Any, *,
                               is_function_data_cache_enabled: bool) \
         -> protos.ParameterBinding:
     datum = get_datum(binding, obj, pytype)
+    # Collections and http data are sized, written to shared memory or sent
+    # over RPC from the same converted message
+    rpc_val = None
+    if datum is not None \
+            and datum.type in datumdef.SHARED_MEMORY_PROTO_DATUM_TYPES:
+        rpc_val = datumdef.datum_as_proto(datum)
     shared_mem_value = None
     if _can_transfer_over_shmem(shmem_mgr, is_function_data_cache_enabled,
-                                datum):
-        shared_mem_value = datumdef.Datum.to_rpc_shared_memory(datum, shmem_mgr)
+                                datum, rpc_val):
+        start = time.perf_counter()
+        shared_mem_value = datumdef.Datum.to_rpc_shared_memory(
+            datum, shmem_mgr, rpc_val)
+        invocation_metrics.add_to_current_timer(
+            invocation_metrics.SHARED_MEMORY, time.perf_counter() - start)
     # Check if data was written into shared memory
     if shared_mem_value is not None:
         # If it was, then use the rpc_shared_memory field in response message
@@ -273,7 +289,8 @@ def to_outgoing_param_binding(binding: str, obj: typing.Any, *,
     else:
         # If not, send it as part of the response message over RPC
         # rpc_val can be None here as we now support a None return type
-        rpc_val = datumdef.datum_as_proto(datum)
+        if rpc_val is None:
+            rpc_val = datumdef.datum_as_proto(datum)
         return protos.ParameterBinding(
             name=out_name,
             data=rpc_val)
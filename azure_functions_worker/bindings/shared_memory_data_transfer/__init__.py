@@ -14,6 +14,7 @@ https://github.com/Azure/azure-functions-host/issues/6791
 
 from .file_accessor import FileAccessor
 from .file_accessor_factory import FileAccessorFactory
+from .shared_memory_cache import SharedMemoryCache
 from .shared_memory_constants import SharedMemoryConstants
 from .shared_memory_exception import SharedMemoryException
 from .shared_memory_manager import SharedMemoryManager
@@ -21,5 +22,6 @@ from .shared_memory_map import SharedMemoryMap
 
 __all__ = (
     'FileAccessorFactory', 'FileAccessor', 'SharedMemoryConstants',
-    'SharedMemoryException', 'SharedMemoryMap', 'SharedMemoryManager'
+    'SharedMemoryException', 'SharedMemoryMap', 'SharedMemoryManager',
+    'SharedMemoryCache'
 )
@@ -75,8 +75,7 @@ class FileAccessorUnix(FileAccessor):
             raise SharedMemoryException(
                 f'Cannot delete memory map. Invalid name {mem_map_name}')
         try:
-            fd = self._open_mem_map_file(mem_map_name)
-            os.remove(fd.name)
+            os.remove(self._get_mem_map_file_path(mem_map_name))
         except Exception as e:
             # In this case, we don't want to fail right away but log that
             # deletion was unsuccessful.
@@ -165,6 +164,19 @@ class FileAccessorUnix(FileAccessor):
             mem_map_name, self.valid_dirs)
         return None
 
+    def _get_mem_map_file_path(self, mem_map_name: str) -> str:
+        """
+        Get the path of the file backing an existing memory map, without
+        opening it.
+        """
+        for temp_dir in self.valid_dirs:
+            file_path = os.path.join(temp_dir, mem_map_name)
+            if os.path.exists(file_path):
+                return file_path
+        raise SharedMemoryException(
+            f'Cannot find memory map {mem_map_name} in any of the following '
+            f'directories: {self.valid_dirs}')
+
     def _create_mem_map_file(self, mem_map_name: str, mem_map_size: int) \
             -> Optional[BufferedRandom]:
         """
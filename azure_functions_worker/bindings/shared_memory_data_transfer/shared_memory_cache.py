@@ -0,0 +1,150 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from ...logging import logger
+from .shared_memory_constants import SharedMemoryConstants as consts
+from .shared_memory_map import SharedMemoryMap
+
+
+class SharedMemoryCache:
+    """
+    Keeps memory maps written by the functions host open after they have been
+    read so that the same content arriving again through the same memory map
+    can be served without reopening and remapping it.
+    This is used when the host has the FunctionDataCache capability enabled, in
+    which case the host reuses the memory map of a cached object (e.g. a blob
+    of a given version) for every invocation that reads it.
+    Entries are evicted in least recently used order once the total number of
+    bytes of content held exceeds the capacity, and invalidated when the host
+    frees their memory map (so that a new memory map reusing the name is
+    opened again).
+    Entries are looked up from the event loop and invalidated from the default
+    executor, hence the lock.
+    """
+    def __init__(self, max_bytes: int = consts.WORKER_CACHE_MAX_BYTES,
+                 stats_interval: float =
+                 consts.WORKER_CACHE_STATS_INTERVAL_SECONDS):
+        self.max_bytes = max_bytes
+        self.used_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        # key: mem_map_name, val: (SharedMemoryMap, content_length)
+        self._entries: 'OrderedDict[str, Tuple[SharedMemoryMap, int]]' = \
+            OrderedDict()
+        self._lock = threading.Lock()
+        self._stats_interval = stats_interval
+        self._stats_logged_at = time.monotonic()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, mem_map_name: str) -> bool:
+        return mem_map_name in self._entries
+
+    def get(self, mem_map_name: str, content_length: int) \
+            -> Optional[memoryview]:
+        """
+        Returns a read-only view over the content of the cached memory map
+        with the given name and content length, without copying it.
+        Returns None if it is not cached. A cached memory map of another
+        content length is stale and is dropped.
+        """
+        with self._lock:
+            entry = self._entries.get(mem_map_name)
+            if entry is not None and entry[1] != content_length:
+                self._remove(mem_map_name)
+                entry = None
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._entries.move_to_end(mem_map_name)
+            self._log_stats()
+        if entry is None:
+            return None
+        return entry[0].get_view(content_length)
+
+    def put(self, shared_mem_map: SharedMemoryMap, content_length: int) \
+            -> Optional[memoryview]:
+        """
+        Takes ownership of the given SharedMemoryMap, which is disposed (without
+        deleting its backing resources) once evicted.
+        Returns a read-only view over its content, or None if the content does
+        not fit in the cache in which case the SharedMemoryMap is not owned by
+        the cache.
+        """
+        if content_length > self.max_bytes:
+            return None
+        mem_map_name = shared_mem_map.mem_map_name
+        with self._lock:
+            self._remove(mem_map_name)
+            self._entries[mem_map_name] = (shared_mem_map, content_length)
+            self.used_bytes += content_length
+            while self.used_bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+        return shared_mem_map.get_view(content_length)
+
+    def invalidate(self, mem_map_name: str) -> bool:
+        """
+        Disposes the cached memory map with the given name, if any.
+        Returns True if it was cached, False otherwise.
+        """
+        with self._lock:
+            if not self._remove(mem_map_name):
+                return False
+            self.invalidations += 1
+            return True
+
+    @property
+    def hit_ratio(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def get_stats(self) -> Dict[str, float]:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hit_ratio,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations,
+            'entries': len(self._entries),
+            'used_bytes': self.used_bytes
+        }
+
+    def clear(self):
+        """
+        Disposes all the cached memory maps.
+        """
+        with self._lock:
+            for mem_map_name in list(self._entries):
+                self._remove(mem_map_name)
+
+    def _log_stats(self):
+        now = time.monotonic()
+        if now - self._stats_logged_at < self._stats_interval:
+            return
+        self._stats_logged_at = now
+        logger.info('Shared memory cache statistics: %s', self.get_stats())
+
+    def _remove(self, mem_map_name: str) -> bool:
+        entry = self._entries.pop(mem_map_name, None)
+        if entry is None:
+            return False
+        shared_mem_map, content_length = entry
+        self.used_bytes -= content_length
+        try:
+            shared_mem_map.dispose(is_delete_file=False)
+        except BufferError as e:
+            # A view handed out is still being referenced; the memory map is
+            # closed when the last reference to it goes away.
+            logger.debug('Cannot close cached memory map %s - %s',
+                         mem_map_name, e)
+        return True
@@ -65,6 +65,26 @@ class SharedMemoryConstants:
     Corresponding logic in the host can be found in SharedMemoryManager.cs
     """
 
+    STRING_ENCODE_CHUNK_NUM_CHARS = 1024 * 1024  # 1 M characters
+    """
+    Number of characters of a string that are encoded to UTF-8 at a time when
+    writing the string into shared memory.
+    Encoding is done in chunks of this size directly into the memory map so
+    that a full encoded copy of large strings is never materialized.
+    """
+
+    WORKER_CACHE_MAX_BYTES = 256 * 1024 * 1024  # 256 MB
+    """
+    Maximum number of bytes of content the worker keeps mapped for memory maps
+    cached by the functions host (when FunctionDataCache is enabled).
+    """
+
+    WORKER_CACHE_STATS_INTERVAL_SECONDS = 60
+    """
+    Minimum interval between two logs of the statistics of the worker's cache
+    of memory maps.
+    """
+
     UNIX_TEMP_DIRS = ["/dev/shm"]
     """
     Default directories in Unix where the memory maps can be found.
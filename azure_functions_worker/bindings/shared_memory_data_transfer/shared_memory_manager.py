@@ -2,17 +2,20 @@
 # Licensed under the MIT License.
 
 import uuid
-from typing import Dict, Optional
+from typing import Callable, Dict, Iterable, Iterator, Optional, Type, TypeVar
 
-from ...constants import FUNCTIONS_WORKER_SHARED_MEMORY_DATA_TRANSFER_ENABLED
+from ... import protos
 from ...logging import logger
-from ...utils.common import is_envvar_true
-from ..datumdef import Datum
+from ...utils.app_setting_manager import get_app_settings
+from ..datumdef import SHARED_MEMORY_PROTO_DATUM_TYPES, Datum, datum_as_proto
 from .file_accessor_factory import FileAccessorFactory
+from .shared_memory_cache import SharedMemoryCache
 from .shared_memory_constants import SharedMemoryConstants as consts
 from .shared_memory_map import SharedMemoryMap
 from .shared_memory_metadata import SharedMemoryMetadata
 
+T = TypeVar('T')
+
 
 class SharedMemoryManager:
     """
@@ -31,8 +34,19 @@ class SharedMemoryManager:
         # key: mem_map_name, val: SharedMemoryMap
         self._allocated_mem_maps: Dict[str, SharedMemoryMap] = {}
         self._file_accessor = FileAccessorFactory.create_file_accessor()
+        # Whether the functions host can read types other than bytes and
+        # string (json, collections and http) from shared memory. This is
+        # negotiated with the host through the
+        # SharedMemoryDataTransferExtendedTypes capability.
+        self._extended_types_enabled = False
+        # Memory maps read from the functions host which are kept open to be
+        # reused, if the host has enabled its FunctionDataCache.
+        self._cache: Optional[SharedMemoryCache] = None
 
     def __del__(self):
+        if self._cache is not None:
+            self._cache.clear()
+        del self._cache
         del self._file_accessor
         del self._allocated_mem_maps
 
@@ -50,32 +64,70 @@ class SharedMemoryManager:
         """
         return self._file_accessor
 
+    @property
+    def cache(self) -> Optional[SharedMemoryCache]:
+        """
+        Cache of memory maps read from the functions host, if enabled.
+        """
+        return self._cache
+
+    def enable_cache(self, max_bytes: int = consts.WORKER_CACHE_MAX_BYTES):
+        """
+        Keeps memory maps read from the functions host open so that the same
+        content read again from the same memory map is served from the
+        existing mapping.
+        This must only be enabled when the host has FunctionDataCache enabled
+        as otherwise memory maps are not reused by the host.
+        """
+        if self._cache is None:
+            self._cache = SharedMemoryCache(max_bytes)
+
+    @property
+    def extended_types_enabled(self) -> bool:
+        """
+        Whether json, collection and http data can be transferred to the
+        functions host using shared memory.
+        """
+        return self._extended_types_enabled
+
+    @extended_types_enabled.setter
+    def extended_types_enabled(self, value: bool):
+        self._extended_types_enabled = value
+
     def is_enabled(self) -> bool:
         """
         Whether supported types should be transferred between functions host and
         the worker using shared memory.
         """
-        return is_envvar_true(
-            FUNCTIONS_WORKER_SHARED_MEMORY_DATA_TRANSFER_ENABLED)
+        return get_app_settings().shared_memory_data_transfer_enabled
 
-    def is_supported(self, datum: Datum) -> bool:
+    def is_supported(self, datum: Datum,
+                     typed_data: Optional[protos.TypedData] = None) -> bool:
         """
         Whether the given Datum object can be transferred to the functions host
         using shared memory.
         This logic is kept consistent with the host's which can be found in
         SharedMemoryManager.cs
+        typed_data is the datum already converted by datum_as_proto, if any,
+        for collection and http values. Their size is computed from the
+        message without serializing it.
         """
         if datum.type == 'bytes':
             num_bytes = len(datum.value)
-            if num_bytes >= consts.MIN_BYTES_FOR_SHARED_MEM_TRANSFER and \
-                    num_bytes <= consts.MAX_BYTES_FOR_SHARED_MEM_TRANSFER:
-                return True
         elif datum.type == 'string':
             num_bytes = len(datum.value) * consts.SIZE_OF_CHAR_BYTES
-            if num_bytes >= consts.MIN_BYTES_FOR_SHARED_MEM_TRANSFER and \
-                    num_bytes <= consts.MAX_BYTES_FOR_SHARED_MEM_TRANSFER:
-                return True
-        return False
+        elif not self.extended_types_enabled:
+            return False
+        elif datum.type == 'json':
+            num_bytes = len(datum.value) * consts.SIZE_OF_CHAR_BYTES
+        elif datum.type in SHARED_MEMORY_PROTO_DATUM_TYPES:
+            if typed_data is None:
+                typed_data = datum_as_proto(datum)
+            num_bytes = getattr(typed_data, datum.type).ByteSize()
+        else:
+            return False
+        return consts.MIN_BYTES_FOR_SHARED_MEM_TRANSFER <= num_bytes <= \
+            consts.MAX_BYTES_FOR_SHARED_MEM_TRANSFER
 
     def put_bytes(self, content: bytes) -> Optional[SharedMemoryMetadata]:
         """
@@ -85,39 +137,24 @@ class SharedMemoryManager:
         """
         if content is None:
             return None
-        mem_map_name = str(uuid.uuid4())
-        content_length = len(content)
-        shared_mem_map = self._create(mem_map_name, content_length)
-        if shared_mem_map is None:
-            return None
-        try:
-            num_bytes_written = shared_mem_map.put_bytes(content)
-        except Exception as e:
-            logger.warning('Cannot write %s bytes into shared memory %s - %s',
-                           content_length, mem_map_name, e)
-            shared_mem_map.dispose()
-            return None
-        if num_bytes_written != content_length:
-            logger.error(
-                'Cannot write data into shared memory %s (%s != %s)',
-                mem_map_name, num_bytes_written, content_length)
-            shared_mem_map.dispose()
-            return None
-        self.allocated_mem_maps[mem_map_name] = shared_mem_map
-        return SharedMemoryMetadata(mem_map_name, content_length)
+        return self._put_chunks((content,), len(content))
 
     def put_string(self, content: str) -> Optional[SharedMemoryMetadata]:
         """
         Writes the given string into shared memory.
         Returns the name of the memory map into which the data was written if
         succesful, None otherwise.
+        The string is encoded in chunks directly into a memory map of the exact
+        encoded size, so a full encoded copy of the string is never held in
+        memory alongside it.
         Note: The encoding used here must be consistent with what is used by the
               host in SharedMemoryManager.cs (GetStringAsync/PutStringAsync).
         """
         if content is None:
             return None
-        content_bytes = content.encode('utf-8')
-        return self.put_bytes(content_bytes)
+        content_length = self._get_utf8_length(content)
+        return self._put_chunks(self._iter_utf8_chunks(content),
+                                content_length)
 
     def get_bytes(self, mem_map_name: str, offset: int, count: int) \
             -> Optional[bytes]:
@@ -127,20 +164,7 @@ class SharedMemoryManager:
         Returns the data read from shared memory as bytes if successful, None
         otherwise.
         """
-        if offset != 0:
-            logger.error(
-                'Cannot read bytes. Non-zero offset (%s) not supported.',
-                offset)
-            return None
-        shared_mem_map = self._open(mem_map_name, count)
-        if shared_mem_map is None:
-            return None
-        try:
-            content = shared_mem_map.get_bytes(content_offset=0,
-                                               bytes_to_read=count)
-        finally:
-            shared_mem_map.dispose(is_delete_file=False)
-        return content
+        return self._read(mem_map_name, offset, count, bytes)
 
     def get_string(self, mem_map_name: str, offset: int, count: int) \
             -> Optional[str]:
@@ -149,14 +173,25 @@ class SharedMemoryManager:
         the provided offset and reading a total of count bytes.
         Returns the data read from shared memory as a string if successful, None
         otherwise.
+        The string is decoded straight from the memory map, without copying
+        its bytes first.
         Note: The encoding used here must be consistent with what is used by the
               host in SharedMemoryManager.cs (GetStringAsync/PutStringAsync).
         """
-        content_bytes = self.get_bytes(mem_map_name, offset, count)
-        if content_bytes is None:
-            return None
-        content_str = content_bytes.decode('utf-8')
-        return content_str
+        return self._read(mem_map_name, offset, count,
+                          lambda content: str(content, 'utf-8'))
+
+    def get_message(self, mem_map_name: str, offset: int, count: int,
+                    message_type: Type[T]) -> Optional[T]:
+        """
+        Reads data from the given memory map with the provided name, starting at
+        the provided offset and reading a total of count bytes.
+        Returns the protobuf message of the given type parsed from the data if
+        successful, None otherwise.
+        The message is parsed straight from the memory map, without copying
+        its bytes first.
+        """
+        return self._read(mem_map_name, offset, count, message_type.FromString)
 
     def free_mem_map(self, mem_map_name: str,
                      to_delete_backing_resources: bool = True) -> bool:
@@ -165,17 +200,131 @@ class SharedMemoryManager:
         file in the case of Unix) associated with it.
         If there is no memory map with the given name being tracked, then no
         action is performed.
+        A memory map of the host kept open by the cache is closed, leaving its
+        backing resources to the host.
         Returns True if the memory map was freed successfully, False otherwise.
         """
-        if mem_map_name not in self.allocated_mem_maps:
+        # The host may recreate a memory map with the same name, which must
+        # not be read from the stale cached mapping
+        is_cached = self._cache is not None \
+            and self._cache.invalidate(mem_map_name)
+        shared_mem_map = self.allocated_mem_maps.pop(mem_map_name, None)
+        if shared_mem_map is None:
+            if is_cached:
+                return True
             logger.error(
                 'Cannot find memory map in list of allocations %s',
                 mem_map_name)
             return False
-        shared_mem_map = self.allocated_mem_maps[mem_map_name]
-        success = shared_mem_map.dispose(to_delete_backing_resources)
-        del self.allocated_mem_maps[mem_map_name]
-        return success
+        return shared_mem_map.dispose(to_delete_backing_resources)
+
+    def free_mem_maps(self, mem_map_names: Iterable[str],
+                      to_delete_backing_resources: bool = True) \
+            -> Dict[str, bool]:
+        """
+        Frees the memory maps with the given names, as in free_mem_map.
+        This may be called from a thread other than the one allocating memory
+        maps so the (blocking) file system operations of a whole batch can be
+        performed off the event loop.
+        Returns the result of freeing each memory map, by name.
+        """
+        results = {}
+        for mem_map_name in mem_map_names:
+            try:
+                results[mem_map_name] = self.free_mem_map(
+                    mem_map_name, to_delete_backing_resources)
+            except Exception as e:
+                logger.error('Cannot free memory map %s - %s', mem_map_name,
+                             e, exc_info=True)
+                results[mem_map_name] = False
+        return results
+
+    def _put_chunks(self, chunks: Iterable[bytes], content_length: int) \
+            -> Optional[SharedMemoryMetadata]:
+        """
+        Creates a new memory map for content_length bytes and writes the given
+        chunks of content into it.
+        Returns metadata about the shared memory region to which the content was
+        written if successful, None otherwise.
+        """
+        mem_map_name = str(uuid.uuid4())
+        shared_mem_map = self._create(mem_map_name, content_length)
+        if shared_mem_map is None:
+            return None
+        try:
+            num_bytes_written = shared_mem_map.put_chunks(chunks,
+                                                          content_length)
+        except Exception as e:
+            logger.warning('Cannot write %s bytes into shared memory %s - %s',
+                           content_length, mem_map_name, e)
+            shared_mem_map.dispose()
+            return None
+        if num_bytes_written != content_length:
+            logger.error(
+                'Cannot write data into shared memory %s (%s != %s)',
+                mem_map_name, num_bytes_written, content_length)
+            shared_mem_map.dispose()
+            return None
+        self.allocated_mem_maps[mem_map_name] = shared_mem_map
+        return SharedMemoryMetadata(mem_map_name, content_length)
+
+    @staticmethod
+    def _iter_utf8_chunks(content: str) -> Iterator[bytes]:
+        """
+        Yields the UTF-8 encoding of the given string, one chunk of
+        SharedMemoryConstants.STRING_ENCODE_CHUNK_NUM_CHARS characters at a
+        time.
+        Splitting on character (code point) boundaries always produces valid
+        UTF-8 so the chunks can simply be concatenated.
+        """
+        chunk_num_chars = consts.STRING_ENCODE_CHUNK_NUM_CHARS
+        for start in range(0, len(content), chunk_num_chars):
+            yield content[start:start + chunk_num_chars].encode('utf-8')
+
+    @classmethod
+    def _get_utf8_length(cls, content: str) -> int:
+        """
+        Returns the number of bytes in the UTF-8 encoding of the given string
+        without encoding it all at once.
+        """
+        if content.isascii():
+            # Every ASCII character is encoded as exactly one byte
+            return len(content)
+        return sum(len(chunk) for chunk in cls._iter_utf8_chunks(content))
+
+    def _read(self, mem_map_name: str, offset: int, count: int,
+              convert: Callable[[memoryview], T]) -> Optional[T]:
+        """
+        Passes a view over count bytes of content of the memory map with the
+        given name to convert, and returns its result, or None if the memory
+        map cannot be read. The memory map is kept open if the cache is
+        enabled, closed (leaving its backing resources in place) otherwise.
+        """
+        if offset != 0:
+            logger.error(
+                'Cannot read bytes. Non-zero offset (%s) not supported.',
+                offset)
+            return None
+        content_view = None
+        if self._cache is not None:
+            content_view = self._cache.get(mem_map_name, count)
+        if content_view is not None:
+            with content_view:
+                return convert(content_view)
+        shared_mem_map = self._open(mem_map_name, count)
+        if shared_mem_map is None:
+            return None
+        if self._cache is not None:
+            content_view = self._cache.put(shared_mem_map, count)
+            if content_view is not None:
+                with content_view:
+                    return convert(content_view)
+            # Too large to be cached
+        try:
+            with shared_mem_map.get_view(count) as content_view:
+                return convert(content_view)
+        finally:
+            shared_mem_map.dispose(is_delete_file=False)
 
     def _create(self, mem_map_name: str, content_length: int) \
             -> Optional[SharedMemoryMap]:
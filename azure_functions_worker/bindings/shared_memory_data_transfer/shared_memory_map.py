@@ -5,7 +5,7 @@ import mmap
 import os
 import struct
 import sys
-from typing import Optional
+from typing import Iterable, Optional
 
 from ...logging import logger
 from .file_accessor import FileAccessor
@@ -43,7 +43,21 @@ class SharedMemoryMap:
         """
         if content is None:
             return None
-        content_length = len(content)
+        return self.put_chunks((content,), len(content))
+
+    def put_chunks(self, chunks: Iterable[bytes],
+                   content_length: int) -> Optional[int]:
+        """
+        Writes the given chunks of content, one after the other, into this
+        SharedMemoryMap.
+        content_length is the total number of bytes across all the chunks and
+        is written into the header before any of the content.
+        This allows writing content that is produced incrementally (e.g. a
+        string being encoded) without first joining it into a single object.
+        Returns the number of bytes of content written.
+        """
+        if chunks is None:
+            return None
         # Seek past the MemoryMapInitialized flag section of the header
         self.mem_map.seek(consts.MEM_MAP_INITIALIZED_FLAG_NUM_BYTES)
         # Write the content length into the header
@@ -59,7 +73,9 @@ class SharedMemoryMap:
                 num_content_length_bytes)
             return 0
         # Write the content
-        num_content_bytes_written = self.mem_map.write(content)
+        num_content_bytes_written = 0
+        for chunk in chunks:
+            num_content_bytes_written += self.mem_map.write(chunk)
         self.mem_map.flush()
         return num_content_bytes_written
 
@@ -87,6 +103,20 @@ class SharedMemoryMap:
             content = self.mem_map.read()
         return content
 
+    def get_view(self, content_length: Optional[int] = None) -> memoryview:
+        """
+        Returns a memoryview over the content of this SharedMemoryMap, without
+        copying it.
+        content_length = None means the content length is read from the
+        header.
+        Note: The memory map cannot be closed while views over it are still
+              referenced.
+        """
+        if content_length is None:
+            content_length = self._get_content_length()
+        start = consts.CONTENT_HEADER_TOTAL_BYTES
+        return memoryview(self.mem_map)[start:start + content_length]
+
     def dispose(self, is_delete_file: bool = True) -> bool:
         """
         Close the underlying memory map.
@@ -9,6 +9,8 @@ RPC_HTTP_BODY_ONLY = "RpcHttpBodyOnly"
 RPC_HTTP_TRIGGER_METADATA_REMOVED = "RpcHttpTriggerMetadataRemoved"
 WORKER_STATUS = "WorkerStatus"
 SHARED_MEMORY_DATA_TRANSFER = "SharedMemoryDataTransfer"
+SHARED_MEMORY_DATA_TRANSFER_EXTENDED_TYPES = \
+    "SharedMemoryDataTransferExtendedTypes"
 FUNCTION_DATA_CACHE = "FunctionDataCache"
 HTTP_URI = "HttpUri"
 REQUIRES_ROUTE_PARAMETERS = "RequiresRouteParameters"
@@ -28,6 +30,11 @@ PYTHON_THREADPOOL_THREAD_COUNT = "PYTHON_THREADPOOL_THREAD_COUNT"
 PYTHON_ISOLATE_WORKER_DEPENDENCIES = "PYTHON_ISOLATE_WORKER_DEPENDENCIES"
 PYTHON_ENABLE_WORKER_EXTENSIONS = "PYTHON_ENABLE_WORKER_EXTENSIONS"
 PYTHON_ENABLE_DEBUG_LOGGING = "PYTHON_ENABLE_DEBUG_LOGGING"
+# Comma-separated list of functions whose concurrent invocations with identical
+# input data are coalesced: only one of them runs, the others get its result.
+# Only for functions whose result depends on nothing but their inputs and which
+# have no side effects.
+PYTHON_COALESCED_FUNCTIONS = "PYTHON_COALESCED_FUNCTIONS"
 FUNCTIONS_WORKER_SHARED_MEMORY_DATA_TRANSFER_ENABLED = \
     "FUNCTIONS_WORKER_SHARED_MEMORY_DATA_TRANSFER_ENABLED"
 """
@@ -63,15 +70,88 @@ RETRY_POLICY = "retry_policy"
 # Paths
 CUSTOMER_PACKAGES_PATH = "/home/site/wwwroot/.python_packages/lib/site" \
                          "-packages"
+# Import bundle of the customer's packages, next to their site-packages
+# directory (i.e. site-packages.zip)
+CUSTOMER_PACKAGES_BUNDLE_SUFFIX = ".zip"
 
 # Flag to index functions in handle init request
 PYTHON_ENABLE_INIT_INDEXING = "PYTHON_ENABLE_INIT_INDEXING"
 
+# Appsetting for a directory in which the function metadata of the indexed
+# function app is cached across worker starts. The metadata is then served
+# from the cache and the function app is imported in the background. Only
+# for apps whose indexing does not depend on anything else than their code
+# and installed packages (e.g. not on environment variables).
+PYTHON_FUNCTION_METADATA_CACHE_DIR = "PYTHON_FUNCTION_METADATA_CACHE_DIR"
+
+# Number of worker processes started by the host for the function app
+FUNCTIONS_WORKER_PROCESS_COUNT = "FUNCTIONS_WORKER_PROCESS_COUNT"
+
+# Flag to fork the worker processes from a zygote which imports the worker and
+# the function app once, when the host starts several of them (Linux only).
+# The function app must not start threads or open connections on import.
+PYTHON_ENABLE_WORKER_ZYGOTE = "PYTHON_ENABLE_WORKER_ZYGOTE"
+
+# Flag to move the objects allocated while loading the functions out of reach
+# of the garbage collector (gc.freeze), once function loads are over
+PYTHON_GC_FREEZE_AFTER_LOAD = "PYTHON_GC_FREEZE_AFTER_LOAD"
+# Garbage collection thresholds set once function loads are over, as
+# comma-separated values for gc.set_threshold (e.g. "50000,20,100")
+PYTHON_GC_THRESHOLDS = "PYTHON_GC_THRESHOLDS"
+# Delay after the last function load request after which they are applied;
+# the freeze is postponed by as much while invocations are running, up to
+# PYTHON_GC_FREEZE_MAX_DELAY_SECONDS
+PYTHON_GC_TUNING_DELAY_SECONDS = 1.0
+PYTHON_GC_FREEZE_MAX_DELAY_SECONDS = 60.0
+# Flag to log the count and durations of the garbage collections per
+# generation at regular intervals
+PYTHON_ENABLE_GC_METRICS = "PYTHON_ENABLE_GC_METRICS"
+PYTHON_GC_METRICS_INTERVAL_SECONDS = 60.0
+# Flag to report histograms of the time spent by the invocations of each
+# function in each of their phases (decoding, user code, ...) at regular
+# intervals, as custom metrics
+PYTHON_ENABLE_INVOCATION_METRICS = "PYTHON_ENABLE_INVOCATION_METRICS"
+PYTHON_INVOCATION_METRICS_INTERVAL_SECONDS = 60.0
+
+# Appsetting for a directory in which a sampling profiler started on worker
+# init and environment reload writes the stacks of the worker threads (in
+# collapsed stack format), sampled at PYTHON_PROFILER_SAMPLING_RATE per
+# second for PYTHON_PROFILER_DURATION_SECONDS, both capped
+PYTHON_PROFILER_OUTPUT_DIR = "PYTHON_PROFILER_OUTPUT_DIR"
+PYTHON_PROFILER_SAMPLING_RATE = "PYTHON_PROFILER_SAMPLING_RATE"
+PYTHON_PROFILER_SAMPLING_RATE_DEFAULT = 100
+PYTHON_PROFILER_SAMPLING_RATE_MAX = 1000
+PYTHON_PROFILER_DURATION_SECONDS = "PYTHON_PROFILER_DURATION_SECONDS"
+PYTHON_PROFILER_DURATION_SECONDS_DEFAULT = 60
+PYTHON_PROFILER_DURATION_SECONDS_MAX = 3600
+
 METADATA_PROPERTIES_WORKER_INDEXED = "worker_indexed"
 
 # Header names
 X_MS_INVOCATION_ID = "x-ms-invocation-id"
 
+# Appsetting to cache the responses of HTTP v2 functions to GET requests, as
+# a comma-separated list of function names, each optionally followed by
+# :<ttl seconds> (e.g. "get_products:30,get_product"). Only for functions
+# whose response depends on nothing but the request and which have no side
+# effects, as cache hits are served without running the function.
+PYTHON_HTTP_V2_RESPONSE_CACHE_FUNCTIONS = \
+    "PYTHON_HTTP_V2_RESPONSE_CACHE_FUNCTIONS"
+PYTHON_HTTP_V2_RESPONSE_CACHE_TTL_SECONDS_DEFAULT = 60
+# Appsetting for the maximum number of bytes of response bodies cached
+PYTHON_HTTP_V2_RESPONSE_CACHE_MAX_BYTES = \
+    "PYTHON_HTTP_V2_RESPONSE_CACHE_MAX_BYTES"
+PYTHON_HTTP_V2_RESPONSE_CACHE_MAX_BYTES_DEFAULT = 64 * 1024 * 1024
+# Appsetting for the comma-separated request headers whose values are part of
+# the cache key in addition to the method, path and query
+PYTHON_HTTP_V2_RESPONSE_CACHE_VARY_HEADERS = \
+    "PYTHON_HTTP_V2_RESPONSE_CACHE_VARY_HEADERS"
+PYTHON_HTTP_V2_RESPONSE_CACHE_VARY_HEADERS_DEFAULT = "accept"
+
+# Seconds after which HTTP v2 requests and invocations that have not been
+# matched with each other are considered orphaned
+HTTP_V2_CONTEXT_TIMEOUT_SECONDS = 240
+
 # Trigger Names
 HTTP_TRIGGER = "httpTrigger"
 
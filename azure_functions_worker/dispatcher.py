@@ -7,20 +7,30 @@ Implements loading and execution of Python workers.
 
 import asyncio
 import concurrent.futures
+import hashlib
 import logging
 import os
 import platform
 import queue
 import sys
 import threading
+import time
 from asyncio import BaseEventLoop
 from datetime import datetime
 from logging import LogRecord
-from typing import List, Optional
+from typing import Dict, List, Optional, Tuple
 
 import grpc
 
-from . import bindings, constants, functions, loader, protos
+from . import (
+    bindings,
+    constants,
+    functions,
+    loader,
+    metadata_cache,
+    protos,
+    zygote,
+)
 from .bindings.shared_memory_data_transfer import SharedMemoryManager
 from .constants import (
     APPLICATIONINSIGHTS_CONNECTION_STRING,
@@ -28,14 +38,14 @@ from .constants import (
     METADATA_PROPERTIES_WORKER_INDEXED,
     PYTHON_AZURE_MONITOR_LOGGER_NAME,
     PYTHON_AZURE_MONITOR_LOGGER_NAME_DEFAULT,
-    PYTHON_ENABLE_DEBUG_LOGGING,
-    PYTHON_ENABLE_INIT_INDEXING,
     PYTHON_ENABLE_OPENTELEMETRY,
     PYTHON_ENABLE_OPENTELEMETRY_DEFAULT,
+    PYTHON_GC_FREEZE_MAX_DELAY_SECONDS,
+    PYTHON_GC_METRICS_INTERVAL_SECONDS,
+    PYTHON_GC_TUNING_DELAY_SECONDS,
+    PYTHON_INVOCATION_METRICS_INTERVAL_SECONDS,
     PYTHON_LANGUAGE_RUNTIME,
     PYTHON_ROLLBACK_CWD_PATH,
-    PYTHON_SCRIPT_FILE_NAME,
-    PYTHON_SCRIPT_FILE_NAME_DEFAULT,
     PYTHON_THREADPOOL_THREAD_COUNT,
     PYTHON_THREADPOOL_THREAD_COUNT_DEFAULT,
     PYTHON_THREADPOOL_THREAD_COUNT_MAX_37,
@@ -46,7 +56,9 @@ from .extension import ExtensionManager
 from .http_v2 import (
     HttpServerInitError,
     HttpV2Registry,
+    get_http_route_params,
     http_coordinator,
+    http_response_cache,
     initialize_http_server,
     sync_http_request,
 )
@@ -59,9 +71,16 @@ from .logging import (
     is_system_log_category,
     logger,
 )
-from .utils.app_setting_manager import get_python_appsetting_state
-from .utils.common import get_app_setting, is_envvar_true, validate_script_file_name
+from .utils import gc_tuning, invocation_metrics, sampling_profiler
+from .utils.app_setting_manager import (
+    get_app_settings,
+    get_python_appsetting_state,
+    reload_app_settings,
+)
+from .utils.coalescing import InvocationCoalescer
+from .utils.common import validate_script_file_name
 from .utils.dependency import DependencyManager
+from .utils.timeline import StepTimeline
 from .utils.tracing import marshall_exception_trace
 from .utils.wrappers import disable_feature_by
 from .version import VERSION
@@ -89,12 +108,15 @@ class Dispatcher(metaclass=DispatcherMeta):
                  worker_id: str, request_id: str,
                  grpc_connect_timeout: float,
                  grpc_max_msg_len: int = -1) -> None:
+        reload_app_settings()
         self._loop = loop
         self._host = host
         self._port = port
         self._request_id = request_id
         self._worker_id = worker_id
         self._function_data_cache_enabled = False
+        self._coalesced_functions = get_app_settings().coalesced_functions
+        self._invocation_coalescer = InvocationCoalescer()
         self._functions = functions.Registry()
         self._shmem_mgr = SharedMemoryManager()
         self._old_task_factory = None
@@ -102,6 +124,17 @@ class Dispatcher(metaclass=DispatcherMeta):
         # Used to store metadata returns
         self._function_metadata_result = None
         self._function_metadata_exception = None
+        # Indexing of the function app running in the background when its
+        # metadata was served from the cache
+        self._deferred_indexing: Optional[asyncio.Future] = None
+
+        self._gc_pause_metrics = gc_tuning.GcPauseMetrics()
+        self._gc_tuning_handle: Optional[asyncio.TimerHandle] = None
+        # Number of invocation requests being handled
+        self._active_invocations = 0
+        self._invocation_metrics = invocation_metrics.InvocationMetrics()
+        self._sampling_profiler: \
+            Optional[sampling_profiler.SamplingProfiler] = None
 
         # Used for checking if open telemetry is enabled
         self._azure_monitor_available = False
@@ -188,14 +221,17 @@ class Dispatcher(metaclass=DispatcherMeta):
             logging_handler = AsyncLoggingHandler()
             root_logger = logging.getLogger()
 
-            log_level = logging.INFO if not is_envvar_true(
-                PYTHON_ENABLE_DEBUG_LOGGING) else logging.DEBUG
+            log_level = logging.INFO \
+                if not get_app_settings().enable_debug_logging \
+                else logging.DEBUG
 
             root_logger.setLevel(log_level)
             root_logger.addHandler(logging_handler)
             logger.info('Switched to gRPC logging.')
             logging_handler.flush()
 
+            self._start_metrics()
+
             try:
                 await forever
             finally:
@@ -209,6 +245,11 @@ class Dispatcher(metaclass=DispatcherMeta):
         finally:
             DispatcherMeta.__current_dispatcher__ = None
 
+            self._gc_pause_metrics.stop()
+            self._invocation_metrics.stop()
+            if self._gc_tuning_handle is not None:
+                self._gc_tuning_handle.cancel()
+
             loader.uninstall()
 
             self._loop.set_task_factory(self._old_task_factory)
@@ -220,6 +261,9 @@ class Dispatcher(metaclass=DispatcherMeta):
             self._grpc_thread.join()
             self._grpc_thread = None
 
+        if self._sampling_profiler is not None:
+            self._sampling_profiler.stop()
+
         self._stop_sync_call_tp()
 
     def on_logging(self, record: logging.LogRecord,
@@ -282,7 +326,93 @@ class Dispatcher(metaclass=DispatcherMeta):
 
         return protos.RpcException(message=message, stack_trace=stack_trace)
 
-    async def _dispatch_grpc_request(self, request):
+    def _emit_custom_metric(self, name: str, value: float, message: str,
+                            properties: Dict[str, protos.TypedData]):
+        """Sends a custom metric to the host, named by the Name property and
+        valued by the Value one, along with the given properties.
+        """
+        properties = {
+            'Name': protos.TypedData(string=name),
+            'Value': protos.TypedData(double=value),
+            **properties
+        }
+        self._grpc_resp_queue.put_nowait(
+            protos.StreamingMessage(
+                request_id=self.request_id,
+                rpc_log=protos.RpcLog(
+                    level=protos.RpcLog.Information,
+                    message=message,
+                    category=f'{logger.name}.metrics',
+                    log_category=protos.RpcLog.RpcLogCategory.Value(
+                        'CustomMetric'),
+                    propertiesMap=properties)))
+
+    def _emit_invocation_metrics(self, summary):
+        """Sends the summary of the invocation metrics to the host as custom
+        metrics, one per function and phase, valued by the mean duration in
+        milliseconds.
+        """
+        for function_name, phases in summary.items():
+            for phase, stats in phases.items():
+                self._emit_custom_metric(
+                    f'PythonInvocation_{phase}_ms', stats['mean_ms'],
+                    f'Invocation {phase} of function {function_name}: '
+                    f'{stats["count"]} invocations, '
+                    f'mean {stats["mean_ms"]:.2f} ms, '
+                    f'p99 {stats["p99_ms"]:.2f} ms',
+                    {
+                        'FunctionName': protos.TypedData(string=function_name),
+                        'Count': protos.TypedData(int=stats['count']),
+                        'P50': protos.TypedData(double=stats['p50_ms']),
+                        'P99': protos.TypedData(double=stats['p99_ms']),
+                        'Max': protos.TypedData(double=stats['max_ms'])
+                    })
+
+    def _emit_hook_timings(self, hook_timings):
+        """Sends the durations of the extension hooks to the host as custom
+        metrics, one per hook, valued by the mean duration in milliseconds.
+        """
+        for hook_name, stats in hook_timings.items():
+            mean_ms = stats['total_ms'] / stats['count']
+            self._emit_custom_metric(
+                'PythonExtensionHook_ms', mean_ms,
+                f'Extension hook {hook_name}: {stats["count"]} calls, '
+                f'mean {mean_ms:.2f} ms, max {stats["max_ms"]:.2f} ms',
+                {
+                    'HookName': protos.TypedData(string=hook_name),
+                    'Count': protos.TypedData(int=stats['count']),
+                    'Max': protos.TypedData(double=stats['max_ms'])
+                })
+
+    def _report_invocation_metrics(self, summary):
+        """Sends the invocation metrics, along with the durations of the
+        extension hooks run by these invocations.
+        """
+        self._emit_invocation_metrics(summary)
+        self._emit_hook_timings(ExtensionManager.get_hook_timings())
+
+    def _emit_gc_pause_metrics(self, summary):
+        """Sends the summary of the garbage collection pauses to the host as
+        custom metrics, one per generation, valued by the total duration in
+        milliseconds.
+        """
+        for generation, stats in summary.items():
+            self._emit_custom_metric(
+                f'PythonGcPause_gen{generation}_ms', stats['total_ms'],
+                f'Garbage collection pauses of generation {generation}: '
+                f'{stats["count"]} collections, '
+                f'total {stats["total_ms"]:.1f} ms, '
+                f'max {stats["max_ms"]:.1f} ms, '
+                f'p99 {stats["p99_ms"]:.1f} ms',
+                {
+                    'Generation': protos.TypedData(int=generation),
+                    'Count': protos.TypedData(int=stats['count']),
+                    'P99': protos.TypedData(double=stats['p99_ms']),
+                    'Max': protos.TypedData(double=stats['max_ms'])
+                })
+
+    async def _dispatch_grpc_request(self, request,
+                                     received_at: Optional[float] = None):
         content_type = request.WhichOneof('content')
         request_handler = getattr(self, f'_handle__{content_type}', None)
         if request_handler is None:
@@ -293,8 +423,26 @@ class Dispatcher(metaclass=DispatcherMeta):
                          content_type)
             return
 
-        resp = await request_handler(request)
-        self._grpc_resp_queue.put_nowait(resp)
+        if content_type != 'invocation_request':
+            resp = await request_handler(request)
+            self._grpc_resp_queue.put_nowait(resp)
+            return
+
+        self._active_invocations += 1
+        try:
+            if self._invocation_metrics.enabled and received_at is not None:
+                timer = self._invocation_metrics.start_timer(received_at)
+                resp = await request_handler(request)
+                timer.mark()
+                # Recorded by the gRPC thread once written to the stream
+                self._grpc_resp_queue.put_nowait(
+                    invocation_metrics.TimedMessage(resp, timer))
+                return
+
+            resp = await request_handler(request)
+            self._grpc_resp_queue.put_nowait(resp)
+        finally:
+            self._active_invocations -= 1
 
     def initialize_azure_monitor(self):
         """Initializes OpenTelemetry and Azure monitor distro
@@ -314,10 +462,10 @@ class Dispatcher(metaclass=DispatcherMeta):
                 # Connection string can be explicitly specified in Appsetting
                 # If not set, defaults to env var
                 # APPLICATIONINSIGHTS_CONNECTION_STRING
-                connection_string=get_app_setting(
+                connection_string=get_app_settings().get(
                     setting=APPLICATIONINSIGHTS_CONNECTION_STRING
                 ),
-                logger_name=get_app_setting(
+                logger_name=get_app_settings().get(
                     setting=PYTHON_AZURE_MONITOR_LOGGER_NAME,
                     default_value=PYTHON_AZURE_MONITOR_LOGGER_NAME_DEFAULT
                 ),
@@ -354,6 +502,7 @@ class Dispatcher(metaclass=DispatcherMeta):
             )
 
     async def _handle__worker_init_request(self, request):
+        reload_app_settings()
         logger.info('Received WorkerInitRequest, '
                     'python version %s, '
                     'worker version %s, '
@@ -366,12 +515,20 @@ class Dispatcher(metaclass=DispatcherMeta):
                     self.request_id,
                     get_python_appsetting_state()
                     )
+        self._start_sampling_profiler()
 
         worker_init_request = request.worker_init_request
         host_capabilities = worker_init_request.capabilities
         if constants.FUNCTION_DATA_CACHE in host_capabilities:
             val = host_capabilities[constants.FUNCTION_DATA_CACHE]
             self._function_data_cache_enabled = val == _TRUE
+            if self._function_data_cache_enabled:
+                self._shmem_mgr.enable_cache()
+        if constants.SHARED_MEMORY_DATA_TRANSFER_EXTENDED_TYPES in \
+                host_capabilities:
+            val = host_capabilities[
+                constants.SHARED_MEMORY_DATA_TRANSFER_EXTENDED_TYPES]
+            self._shmem_mgr.extended_types_enabled = val == _TRUE
 
         capabilities = {
             constants.RAW_HTTP_BODY_BYTES: _TRUE,
@@ -380,15 +537,19 @@ class Dispatcher(metaclass=DispatcherMeta):
             constants.WORKER_STATUS: _TRUE,
             constants.RPC_HTTP_TRIGGER_METADATA_REMOVED: _TRUE,
             constants.SHARED_MEMORY_DATA_TRANSFER: _TRUE,
+            constants.SHARED_MEMORY_DATA_TRANSFER_EXTENDED_TYPES: _TRUE,
         }
-        if get_app_setting(setting=PYTHON_ENABLE_OPENTELEMETRY,
-                           default_value=PYTHON_ENABLE_OPENTELEMETRY_DEFAULT):
+        if get_app_settings().get(
+                setting=PYTHON_ENABLE_OPENTELEMETRY,
+                default_value=PYTHON_ENABLE_OPENTELEMETRY_DEFAULT):
             self.initialize_azure_monitor()
 
             if self._azure_monitor_available:
                 capabilities[constants.WORKER_OPEN_TELEMETRY_ENABLED] = _TRUE
 
-        if DependencyManager.should_load_cx_dependencies():
+        # Already done by the zygote the worker was forked from
+        if DependencyManager.should_load_cx_dependencies() \
+                and not zygote.is_customer_dependencies_prioritized():
             DependencyManager.prioritize_customer_dependencies()
 
         if DependencyManager.is_in_linux_consumption():
@@ -398,7 +559,7 @@ class Dispatcher(metaclass=DispatcherMeta):
         # dictionary which will be later used in the invocation request
         bindings.load_binding_registry()
 
-        if is_envvar_true(PYTHON_ENABLE_INIT_INDEXING):
+        if get_app_settings().enable_init_indexing:
             try:
                 self.load_function_metadata(
                     worker_init_request.function_app_directory,
@@ -436,9 +597,17 @@ class Dispatcher(metaclass=DispatcherMeta):
         directory and save the results in function_metadata_result or
         function_metadata_exception in case of an exception.
         """
-        script_file_name = get_app_setting(
-            setting=PYTHON_SCRIPT_FILE_NAME,
-            default_value=f'{PYTHON_SCRIPT_FILE_NAME_DEFAULT}')
+        function_path = self._get_function_path(function_app_directory,
+                                                caller_info)
+
+        # For V1, the function path will not exist and
+        # return None.
+        self._function_metadata_result = (
+            self.index_functions(function_path, function_app_directory)) \
+            if os.path.exists(function_path) else None
+
+    def _get_function_path(self, function_app_directory, caller_info):
+        script_file_name = get_app_settings().script_file_name
 
         logger.debug(
             'Received load metadata request from %s, request ID %s, '
@@ -446,22 +615,13 @@ class Dispatcher(metaclass=DispatcherMeta):
             caller_info, self.request_id, script_file_name)
 
         validate_script_file_name(script_file_name)
-        function_path = os.path.join(function_app_directory,
-                                     script_file_name)
-
-        # For V1, the function path will not exist and
-        # return None.
-        self._function_metadata_result = (
-            self.index_functions(function_path, function_app_directory)) \
-            if os.path.exists(function_path) else None
+        return os.path.join(function_app_directory, script_file_name)
 
     async def _handle__functions_metadata_request(self, request):
         metadata_request = request.functions_metadata_request
         function_app_directory = metadata_request.function_app_directory
 
-        script_file_name = get_app_setting(
-            setting=PYTHON_SCRIPT_FILE_NAME,
-            default_value=f'{PYTHON_SCRIPT_FILE_NAME_DEFAULT}')
+        script_file_name = get_app_settings().script_file_name
         function_path = os.path.join(function_app_directory,
                                      script_file_name)
 
@@ -470,11 +630,10 @@ class Dispatcher(metaclass=DispatcherMeta):
             'function_path: %s',
             self.request_id, function_path)
 
-        if not is_envvar_true(PYTHON_ENABLE_INIT_INDEXING):
+        if not get_app_settings().enable_init_indexing:
             try:
-                self.load_function_metadata(
-                    function_app_directory,
-                    caller_info="functions_metadata_request")
+                self._load_function_metadata_cached(
+                    function_app_directory, function_path)
             except Exception as ex:
                 self._function_metadata_exception = ex
 
@@ -498,6 +657,77 @@ class Dispatcher(metaclass=DispatcherMeta):
                     result=protos.StatusResult(
                         status=protos.StatusResult.Success)))
 
+    def _load_function_metadata_cached(self, function_app_directory,
+                                       function_path):
+        """
+        Same as load_function_metadata, using the function metadata cache
+        when PYTHON_FUNCTION_METADATA_CACHE_DIR is set. On a cache hit the
+        function app is indexed on the event loop right after the metadata
+        response is sent (the customer's code is always imported on the main
+        thread); function load requests wait for it to complete.
+        """
+        cache_dir = get_app_settings().function_metadata_cache_dir
+        cache_key = None
+        if cache_dir and os.path.exists(function_path):
+            cache_key = metadata_cache.get_cache_key(
+                function_app_directory, os.path.basename(function_path))
+        if cache_key is not None:
+            cached_metadata = metadata_cache.load(cache_dir, cache_key)
+            if cached_metadata is not None:
+                logger.info('Loaded metadata of %s functions from cache %s',
+                            len(cached_metadata), cache_dir)
+                self._function_metadata_result = cached_metadata
+                self._deferred_indexing = self._loop.create_future()
+                self._loop.call_soon(self._run_deferred_indexing,
+                                     self._deferred_indexing,
+                                     function_app_directory, cache_dir,
+                                     cache_key, cached_metadata)
+                return
+
+        self.load_function_metadata(function_app_directory,
+                                    caller_info="functions_metadata_request")
+        if cache_key is not None and self._function_metadata_result:
+            metadata_cache.save(cache_dir, cache_key,
+                                self._function_metadata_result)
+
+    def _run_deferred_indexing(self, deferred_indexing: asyncio.Future,
+                               function_app_directory, cache_dir, cache_key,
+                               cached_metadata):
+        """
+        Indexes the function app after its metadata was served from the
+        cache. If the registrations no longer match the cached metadata the
+        host received, the cache entry is replaced (or removed when indexing
+        failed) so that the next start is correct.
+        """
+        try:
+            self.load_function_metadata(function_app_directory,
+                                        caller_info="deferred_indexing")
+        except Exception as ex:
+            self._function_metadata_exception = ex
+            metadata_cache.remove(cache_dir, cache_key)
+        else:
+            if self._function_metadata_result != cached_metadata:
+                logger.error('Function metadata cached in %s does not match '
+                             'the functions of %s, the cache is updated for '
+                             'the next start', cache_dir,
+                             function_app_directory)
+                if self._function_metadata_result:
+                    metadata_cache.save(cache_dir, cache_key,
+                                        self._function_metadata_result)
+                else:
+                    metadata_cache.remove(cache_dir, cache_key)
+        finally:
+            deferred_indexing.set_result(None)
+
+    async def _await_deferred_indexing(self):
+        deferred_indexing = self._deferred_indexing
+        if deferred_indexing is None:
+            return
+        try:
+            await deferred_indexing
+        finally:
+            self._deferred_indexing = None
+
     async def _handle__function_load_request(self, request):
         func_request = request.function_load_request
         function_id = func_request.function_id
@@ -513,6 +743,7 @@ class Dispatcher(metaclass=DispatcherMeta):
 
         programming_model = "V2"
         try:
+            await self._await_deferred_indexing()
             if not self._functions.get_function(function_id):
 
                 if function_metadata.properties.get(
@@ -566,6 +797,8 @@ class Dispatcher(metaclass=DispatcherMeta):
                         function_name,
                         programming_model)
 
+            self._schedule_gc_tuning()
+
             return protos.StreamingMessage(
                 request_id=self.request_id,
                 function_load_response=protos.FunctionLoadResponse(
@@ -594,6 +827,7 @@ class Dispatcher(metaclass=DispatcherMeta):
         current_task = asyncio.current_task(self._loop)
         assert isinstance(current_task, ContextEnabledTask)
         current_task.set_azure_invocation_id(invocation_id)
+        timer = invocation_metrics.get_current_timer()
 
         try:
             fi: functions.FunctionInfo = self._functions.get_function(
@@ -622,9 +856,20 @@ class Dispatcher(metaclass=DispatcherMeta):
                                   .is_http_func and \
                 HttpV2Registry.http_v2_enabled()
 
+            if timer is not None:
+                timer.function_name = fi.name
+                timer.mark()
+
+            http_route_params = None
             for pb in invoc_request.input_data:
                 pb_type_info = fi.input_types[pb.name]
                 if bindings.is_trigger_binding(pb_type_info.binding_name):
+                    if http_v2_enabled:
+                        # The function receives the request of the web
+                        # framework, only the route params are needed
+                        http_route_params = get_http_route_params(pb)
+                        if http_route_params is not None:
+                            continue
                     trigger_metadata = invoc_request.trigger_metadata
                 else:
                     trigger_metadata = None
@@ -638,14 +883,27 @@ class Dispatcher(metaclass=DispatcherMeta):
                     function_name=self._functions.get_function(
                         function_id).name,
                     is_deferred_binding=pb_type_info.deferred_bindings_enabled)
+            if timer is not None:
+                timer.lap(invocation_metrics.INPUT_DECODE)
 
             if http_v2_enabled:
                 http_request = await http_coordinator.get_http_request_async(
                     invocation_id)
+                if http_coordinator.pop_served_from_cache(invocation_id):
+                    logger.info('HTTP response of invocation %s served from '
+                                'cache, function %s not run',
+                                invocation_id, fi.name)
+                    return protos.StreamingMessage(
+                        request_id=self.request_id,
+                        invocation_response=protos.InvocationResponse(
+                            invocation_id=invocation_id,
+                            result=protos.StatusResult(
+                                status=protos.StatusResult.Success)))
 
                 trigger_arg_name = fi.trigger_metadata.get('param_name')
-                func_http_request = args[trigger_arg_name]
-                await sync_http_request(http_request, func_http_request)
+                if http_route_params is None:
+                    http_route_params = args[trigger_arg_name].route_params
+                await sync_http_request(http_request, http_route_params)
                 args[trigger_arg_name] = http_request
 
             fi_context = self._get_context(invoc_request, fi.name,
@@ -661,31 +919,45 @@ class Dispatcher(metaclass=DispatcherMeta):
                 for name in fi.output_types:
                     args[name] = bindings.Out()
 
-            if fi.is_async:
-                if self._azure_monitor_available:
-                    self.configure_opentelemetry(fi_context)
-
-                call_result = \
-                    await self._run_async_func(fi_context, fi.func, args)
+            if timer is not None:
+                timer.mark()
+            if fi.name in self._coalesced_functions and not http_v2_enabled:
+                coalesce_key = self._get_coalesce_key(invoc_request)
+                if self._invocation_coalescer.is_in_flight(coalesce_key):
+                    logger.info('Invocation %s waits for the result of an '
+                                'in-flight invocation of function %s with '
+                                'the same input data. Coalesce ratio: %.3f',
+                                invocation_id, fi.name,
+                                self._invocation_coalescer.coalesce_ratio)
+                    if timer is not None:
+                        timer.coalesced = True
+                call_result, output_values = \
+                    await self._invocation_coalescer.run(
+                        coalesce_key,
+                        lambda: self._run_func(invocation_id, fi, fi_context,
+                                               args))
             else:
-                call_result = await self._loop.run_in_executor(
-                    self._sync_call_tp,
-                    self._run_sync_func,
-                    invocation_id, fi_context, fi.func, args)
+                call_result, output_values = await self._run_func(
+                    invocation_id, fi, fi_context, args)
 
             if call_result is not None and not fi.has_return:
                 raise RuntimeError(
                     f'function {fi.name!r} without a $return binding'
                     'returned a non-None value')
 
+            if timer is not None:
+                # Excludes the wait of coalesced invocations for the result
+                timer.mark()
+
             if http_v2_enabled:
+                http_response_cache.put(fi.name, http_request, call_result)
                 http_coordinator.set_http_response(invocation_id, call_result)
 
             output_data = []
             cache_enabled = self._function_data_cache_enabled
             if fi.output_types:
                 for out_name, out_type_info in fi.output_types.items():
-                    val = args[out_name].get()
+                    val = output_values[out_name]
                     if val is None:
                         # TODO: is the "Out" parameter optional?
                         # Can "None" be marshaled into protos.TypedData?
@@ -705,6 +977,8 @@ class Dispatcher(metaclass=DispatcherMeta):
                     call_result,
                     pytype=fi.return_type.pytype,
                 )
+            if timer is not None:
+                timer.lap(invocation_metrics.OUTPUT_ENCODE)
 
             # Actively flush customer print() function to console
             sys.stdout.flush()
@@ -720,7 +994,13 @@ class Dispatcher(metaclass=DispatcherMeta):
 
         except Exception as ex:
             if http_v2_enabled:
-                http_coordinator.set_http_response(invocation_id, ex)
+                try:
+                    http_coordinator.set_http_response(invocation_id, ex)
+                except KeyError:
+                    # The HTTP context was evicted after a timeout or never
+                    # created, no request is waiting for this response
+                    logger.debug('No HTTP context left for the failure of '
+                                 'invocation %s', invocation_id)
 
             return protos.StreamingMessage(
                 request_id=self.request_id,
@@ -744,64 +1024,70 @@ class Dispatcher(metaclass=DispatcherMeta):
                         self.request_id,
                         get_python_appsetting_state())
 
+            timeline = StepTimeline('Specialization')
             func_env_reload_request = \
                 request.function_environment_reload_request
             directory = func_env_reload_request.function_app_directory
 
-            # Append function project root to module finding sys.path
-            if func_env_reload_request.function_app_directory:
-                sys.path.append(func_env_reload_request.function_app_directory)
-
-            # Clear sys.path import cache, reload all module from new sys.path
-            sys.path_importer_cache.clear()
-
-            # Reload environment variables
-            os.environ.clear()
-            env_vars = func_env_reload_request.environment_variables
-            for var in env_vars:
-                os.environ[var] = env_vars[var]
-
-            # Apply PYTHON_THREADPOOL_THREAD_COUNT
-            self._stop_sync_call_tp()
-            self._sync_call_tp = (
-                self._create_sync_call_tp(self._get_sync_tp_max_workers())
-            )
-
-            if is_envvar_true(PYTHON_ENABLE_DEBUG_LOGGING):
-                root_logger = logging.getLogger()
-                root_logger.setLevel(logging.DEBUG)
-
-            # Reload azure google namespaces
-            DependencyManager.reload_customer_libraries(directory)
-
-            # calling load_binding_registry again since the
-            # reload_customer_libraries call clears the registry
-            bindings.load_binding_registry()
+            with timeline.step('environment'):
+                # Append function project root to module finding sys.path
+                if func_env_reload_request.function_app_directory:
+                    sys.path.append(
+                        func_env_reload_request.function_app_directory)
+
+                # Clear sys.path import cache, reload all module from new
+                # sys.path
+                sys.path_importer_cache.clear()
+
+                # Reload environment variables
+                os.environ.clear()
+                env_vars = func_env_reload_request.environment_variables
+                for var in env_vars:
+                    os.environ[var] = env_vars[var]
+                reload_app_settings()
+                # The function app preloaded by the zygote, if any, does not
+                # match the new settings
+                zygote.stop_forking()
+
+                # Apply PYTHON_COALESCED_FUNCTIONS
+                self._coalesced_functions = get_app_settings().coalesced_functions
+                # Apply PYTHON_PROFILER_OUTPUT_DIR
+                self._start_sampling_profiler()
+                # Apply PYTHON_ENABLE_GC_METRICS and
+                # PYTHON_ENABLE_INVOCATION_METRICS
+                self._start_metrics()
+
+                if get_app_settings().enable_debug_logging:
+                    root_logger = logging.getLogger()
+                    root_logger.setLevel(logging.DEBUG)
+
+            with timeline.step('thread_pool'):
+                # Apply PYTHON_THREADPOOL_THREAD_COUNT
+                self._swap_sync_call_tp()
+
+            with timeline.step('customer_libraries'):
+                # Reload azure google namespaces
+                DependencyManager.reload_customer_libraries(directory)
+
+            with timeline.step('binding_registry'):
+                # calling load_binding_registry again since the
+                # reload_customer_libraries call clears the registry
+                bindings.load_binding_registry()
 
             capabilities = {}
-            if get_app_setting(
+            if get_app_settings().get(
                     setting=PYTHON_ENABLE_OPENTELEMETRY,
                     default_value=PYTHON_ENABLE_OPENTELEMETRY_DEFAULT):
-                self.initialize_azure_monitor()
+                with timeline.step('azure_monitor'):
+                    self.initialize_azure_monitor()
 
                 if self._azure_monitor_available:
                     capabilities[constants.WORKER_OPEN_TELEMETRY_ENABLED] = (
                         _TRUE)
 
-            if is_envvar_true(PYTHON_ENABLE_INIT_INDEXING):
-                try:
-                    self.load_function_metadata(
-                        directory,
-                        caller_info="environment_reload_request")
-
-                    if HttpV2Registry.http_v2_enabled():
-                        capabilities[HTTP_URI] = \
-                            initialize_http_server(self._host)
-                        capabilities[REQUIRES_ROUTE_PARAMETERS] = _TRUE
-                except HttpServerInitError:
-                    raise
-                except Exception as ex:
-                    self._function_metadata_exception = ex
+            if get_app_settings().enable_init_indexing:
+                self._reload_function_metadata(directory, capabilities,
+                                               timeline)
 
             # Change function app directory
             if getattr(func_env_reload_request,
@@ -809,6 +1095,7 @@ class Dispatcher(metaclass=DispatcherMeta):
                 self._change_cwd(
                     func_env_reload_request.function_app_directory)
 
+            timeline.log()
             success_response = protos.FunctionEnvironmentReloadResponse(
                 capabilities=capabilities,
                 worker_metadata=self.get_worker_metadata(),
@@ -829,13 +1116,84 @@ class Dispatcher(metaclass=DispatcherMeta):
                 request_id=self.request_id,
                 function_environment_reload_response=failure_response)
 
+    def _reload_function_metadata(self, directory: str, capabilities: dict,
+                                  timeline: StepTimeline):
+        """Indexes the function app on placeholder specialization, recording
+        its import and the processing of the indexed functions as separate
+        steps of the timeline. As on worker init, the HTTP server is only
+        started once the functions are indexed, so that it is never left
+        running without being reported to the host.
+        """
+        try:
+            with timeline.step('function_app_import'):
+                function_path = self._get_function_path(
+                    directory, caller_info="environment_reload_request")
+                # For V1, the function path will not exist
+                indexed_functions = \
+                    self._import_function_app(function_path) \
+                    if os.path.exists(function_path) else None
+
+            with timeline.step('function_metadata'):
+                self._function_metadata_result = \
+                    self._process_indexed_functions(indexed_functions,
+                                                    directory)
+
+            if HttpV2Registry.http_v2_enabled():
+                with timeline.step('http_server'):
+                    capabilities[HTTP_URI] = initialize_http_server(
+                        self._host)
+                capabilities[REQUIRES_ROUTE_PARAMETERS] = _TRUE
+        except HttpServerInitError:
+            raise
+        except Exception as ex:
+            self._function_metadata_exception = ex
+
+    def _schedule_gc_tuning(self):
+        """
+        Tunes the garbage collector (see gc_tuning) once there has been no
+        function load request for a while, i.e. when the functions are
+        loaded. The freeze waits for no invocation to be running, as the
+        full collection it starts with blocks the event loop, but for
+        PYTHON_GC_FREEZE_MAX_DELAY_SECONDS at most.
+        """
+        if not gc_tuning.is_tuning_enabled():
+            return
+        if self._gc_tuning_handle is not None:
+            self._gc_tuning_handle.cancel()
+        self._gc_tuning_handle = self._loop.call_later(
+            PYTHON_GC_TUNING_DELAY_SECONDS, self._apply_gc_tuning)
+
+    def _apply_gc_tuning(self):
+        self._gc_tuning_handle = None
+        gc_tuning.apply_thresholds()
+        self._freeze_gc(
+            self._loop.time() + PYTHON_GC_FREEZE_MAX_DELAY_SECONDS)
+
+    def _freeze_gc(self, deadline: float):
+        if self._active_invocations and self._loop.time() < deadline:
+            # Postponed until the worker is idle, or it has been for too long
+            self._gc_tuning_handle = self._loop.call_later(
+                PYTHON_GC_TUNING_DELAY_SECONDS, self._freeze_gc, deadline)
+            return
+        self._gc_tuning_handle = None
+        gc_tuning.freeze()
+
     def index_functions(self, function_path: str, function_dir: str):
+        indexed_functions = self._import_function_app(function_path)
+        return self._process_indexed_functions(indexed_functions,
+                                               function_dir)
+
+    @staticmethod
+    def _import_function_app(function_path: str):
         indexed_functions = loader.index_function_app(function_path)
         logger.info(
             "Indexed function app and found %s functions",
             len(indexed_functions)
         )
+        return indexed_functions
 
+    def _process_indexed_functions(self, indexed_functions,
+                                   function_dir: str):
         if indexed_functions:
             fx_metadata_results, fx_bindings_logs = (
                 loader.process_indexed_function(
@@ -843,26 +1201,19 @@ class Dispatcher(metaclass=DispatcherMeta):
                     indexed_functions,
                     function_dir))
 
-            indexed_function_logs: List[str] = []
-            indexed_function_bindings_logs = []
             for func in indexed_functions:
                 func_binding_logs = fx_bindings_logs.get(func)
-                for binding in func.get_bindings():
-                    deferred_binding_info = func_binding_logs.get(
-                        binding.name)\
-                        if func_binding_logs.get(binding.name) else ""
-                    indexed_function_bindings_logs.append((
-                        binding.type, binding.name, deferred_binding_info))
-
-                function_log = "Function Name: {}, Function Binding: {}" \
-                    .format(func.get_function_name(),
-                            indexed_function_bindings_logs)
-                indexed_function_logs.append(function_log)
+                function_bindings = [
+                    (binding.type, binding.name,
+                     func_binding_logs.get(binding.name, ""))
+                    for binding in func.get_bindings()]
+                logger.info('Function Name: %s, Function Binding: %s',
+                            func.get_function_name(), function_bindings)
 
             logger.info(
                 'Successfully processed FunctionMetadataRequest for '
-                'functions: %s. Deferred bindings enabled: %s.', " ".join(
-                    indexed_function_logs),
+                '%s functions. Deferred bindings enabled: %s.',
+                len(fx_metadata_results),
                 self._functions.deferred_bindings_enabled())
 
             return fx_metadata_results
@@ -886,15 +1237,16 @@ class Dispatcher(metaclass=DispatcherMeta):
         results = {mem_map_name: False for mem_map_name in map_names}
 
         try:
-            for map_name in map_names:
-                try:
-                    to_delete_resources = not self._function_data_cache_enabled
-                    success = self._shmem_mgr.free_mem_map(map_name,
-                                                           to_delete_resources)
-                    results[map_name] = success
-                except Exception as e:
-                    logger.error('Cannot free memory map %s - %s', map_name, e,
-                                 exc_info=True)
+            # Freeing memory maps (and deleting their backing files) requires
+            # blocking syscalls for each map, so the whole batch is done in the
+            # default executor to keep other invocations running meanwhile.
+            to_delete_resources = not self._function_data_cache_enabled
+            results.update(await self._loop.run_in_executor(
+                None, self._shmem_mgr.free_mem_maps, list(map_names),
+                to_delete_resources))
+        except Exception as e:
+            logger.error('Cannot free memory maps %s - %s', list(map_names), e,
+                         exc_info=True)
         finally:
             response = protos.CloseSharedMemoryResourcesResponse(
                 close_map_results=results)
@@ -945,6 +1297,59 @@ class Dispatcher(metaclass=DispatcherMeta):
             self._sync_call_tp.shutdown()
             self._sync_call_tp = None
 
+    def _swap_sync_call_tp(self):
+        """Replace the synchronous thread pool with a new one, sized by the
+        current app settings, without waiting for the old one. New calls go
+        to the new thread pool right away, while the calls still running or
+        queued in the old one complete in the background.
+        """
+        start = time.perf_counter()
+        old_tp = getattr(self, '_sync_call_tp', None)
+        self._sync_call_tp = (
+            self._create_sync_call_tp(self._get_sync_tp_max_workers()))
+        logger.info('Swapped synchronous thread pool in %.1f ms',
+                    (time.perf_counter() - start) * 1000)
+
+        if old_tp is not None:
+            threading.Thread(target=self._drain_sync_call_tp,
+                             args=(old_tp,),
+                             name='sync_call_tp_drain',
+                             daemon=True).start()
+
+    @staticmethod
+    def _drain_sync_call_tp(sync_call_tp: concurrent.futures.Executor):
+        start = time.perf_counter()
+        sync_call_tp.shutdown()
+        logger.info('Drained previous synchronous thread pool in %.1f ms',
+                    (time.perf_counter() - start) * 1000)
+
+    def _start_sampling_profiler(self):
+        """Starts the sampling profiler if PYTHON_PROFILER_OUTPUT_DIR is set,
+        unless it is already running.
+        """
+        if self._sampling_profiler is None \
+                or not self._sampling_profiler.is_running():
+            self._sampling_profiler = \
+                sampling_profiler.start_from_app_settings()
+
+    def _start_metrics(self):
+        """Starts reporting the garbage collection pauses and the invocation
+        metrics if PYTHON_ENABLE_GC_METRICS and PYTHON_ENABLE_INVOCATION_METRICS
+        are set, unless already started, and stops them otherwise.
+        """
+        if get_app_settings().enable_gc_metrics:
+            self._gc_pause_metrics.start(
+                self._loop, PYTHON_GC_METRICS_INTERVAL_SECONDS,
+                self._emit_gc_pause_metrics)
+        else:
+            self._gc_pause_metrics.stop()
+        if get_app_settings().enable_invocation_metrics:
+            self._invocation_metrics.start(
+                self._loop, PYTHON_INVOCATION_METRICS_INTERVAL_SECONDS,
+                self._report_invocation_metrics)
+        else:
+            self._invocation_metrics.stop()
+
     @staticmethod
     def _get_sync_tp_max_workers() -> Optional[int]:
         def tp_max_workers_validator(value: str) -> bool:
@@ -969,9 +1374,10 @@ class Dispatcher(metaclass=DispatcherMeta):
         default_value = None if sys.version_info.minor >= 9 \
             else f'{PYTHON_THREADPOOL_THREAD_COUNT_DEFAULT}'
 
-        max_workers = get_app_setting(setting=PYTHON_THREADPOOL_THREAD_COUNT,
-                                      default_value=default_value,
-                                      validator=tp_max_workers_validator)
+        max_workers = get_app_settings().get(
+            setting=PYTHON_THREADPOOL_THREAD_COUNT,
+            default_value=default_value,
+            validator=tp_max_workers_validator)
 
         if sys.version_info.minor <= 7:
             max_workers = min(int(max_workers),
@@ -984,26 +1390,72 @@ class Dispatcher(metaclass=DispatcherMeta):
             self, max_worker: Optional[int]) -> concurrent.futures.Executor:
         """Create a thread pool executor with max_worker. This is a wrapper
         over ThreadPoolExecutor constructor. Consider calling this method after
-        _stop_sync_call_tp() to ensure only 1 synchronous thread pool is
-        running.
+        _stop_sync_call_tp(), or through _swap_sync_call_tp(), to ensure only
+        1 synchronous thread pool receives calls.
         """
         return concurrent.futures.ThreadPoolExecutor(
             max_workers=max_worker
         )
 
-    def _run_sync_func(self, invocation_id, context, func, params):
+    @staticmethod
+    def _get_coalesce_key(invoc_request) -> Tuple[str, bytes]:
+        """Invocations of the same function whose input data serialize
+        identically are coalesced. Trigger metadata is left out as it carries
+        per invocation values (e.g. ids, timestamps).
+        """
+        input_data_hash = hashlib.sha256()
+        for pb in invoc_request.input_data:
+            data = pb.SerializeToString(deterministic=True)
+            input_data_hash.update(len(data).to_bytes(8, 'little'))
+            input_data_hash.update(data)
+        return invoc_request.function_id, input_data_hash.digest()
+
+    async def _run_func(self, invocation_id, fi, fi_context, args):
+        """Runs the function and returns its result along with the values set
+        on its output bindings.
+        """
+        timer = invocation_metrics.get_current_timer()
+        if fi.is_async:
+            if self._azure_monitor_available:
+                self.configure_opentelemetry(fi_context)
+
+            call_result = \
+                await self._run_async_func(fi_context, fi.func, args)
+            if timer is not None:
+                timer.lap(invocation_metrics.USER_CODE)
+        else:
+            call_result = await self._loop.run_in_executor(
+                self._sync_call_tp,
+                self._run_sync_func,
+                invocation_id, fi_context, fi.func, args, timer)
+
+        output_values = {name: args[name].get() for name in fi.output_types}
+        return call_result, output_values
+
+    def _run_sync_func(self, invocation_id, context, func, params,
+                       timer=None):
         # This helper exists because we need to access the current
         # invocation_id from ThreadPoolExecutor's threads.
         context.thread_local_storage.invocation_id = invocation_id
+        if timer is not None:
+            timer.lap(invocation_metrics.THREAD_POOL_WAIT)
         try:
             if self._azure_monitor_available:
                 self.configure_opentelemetry(context)
-            return ExtensionManager.get_sync_invocation_wrapper(context,
-                                                                func)(params)
+            if ExtensionManager.get_invocation_hooks(
+                    context.function_name) is None:
+                return func(**params)
+            return ExtensionManager.get_sync_invocation_wrapper(
+                context, func, self._loop)(params)
         finally:
             context.thread_local_storage.invocation_id = None
+            if timer is not None:
+                timer.lap(invocation_metrics.USER_CODE)
 
     async def _run_async_func(self, context, func, params):
+        if ExtensionManager.get_invocation_hooks(
+                context.function_name) is None:
+            return await func(**params)
         return await ExtensionManager.get_async_invocation_wrapper(
             context, func, params
         )
@@ -1038,13 +1490,20 @@ class Dispatcher(metaclass=DispatcherMeta):
                 if msg is self._GRPC_STOP_RESPONSE:
                     grpc_req_stream.cancel()
                     return
+                if type(msg) is invocation_metrics.TimedMessage:
+                    yield msg.message
+                    # Resumed once the message is written
+                    msg.timer.lap(invocation_metrics.RESPONSE_WRITE)
+                    self._invocation_metrics.record(msg.timer)
+                    continue
                 yield msg
 
         grpc_req_stream = stub.EventStream(gen(self._grpc_resp_queue))
         try:
             for req in grpc_req_stream:
                 self._loop.call_soon_threadsafe(
-                    self._loop.create_task, self._dispatch_grpc_request(req))
+                    self._loop.create_task,
+                    self._dispatch_grpc_request(req, time.perf_counter()))
         except Exception as ex:
             if ex is grpc_req_stream:
                 # Yes, this is how grpc_req_stream iterator exits.
@@ -1,20 +1,24 @@
 # Copyright (c) Microsoft Corporation. All rights reserved.
 # Licensed under the MIT License.
 
+import asyncio
+import concurrent.futures
 import functools
+import inspect
 import logging
+import threading
+import time
 from types import ModuleType
-from typing import Any, Callable, List, Optional
+from typing import Any, Awaitable, Callable, Dict, List, NamedTuple, Optional, \
+    Tuple
 
 from .constants import (
     PYTHON_ENABLE_WORKER_EXTENSIONS,
-    PYTHON_ENABLE_WORKER_EXTENSIONS_DEFAULT,
-    PYTHON_ENABLE_WORKER_EXTENSIONS_DEFAULT_39,
     PYTHON_ISOLATE_WORKER_DEPENDENCIES,
 )
 from .logging import SYSTEM_LOG_PREFIX, logger
-from .utils.common import get_sdk_from_sys_path, get_sdk_version, is_python_version
-from .utils.wrappers import enable_feature_by
+from .utils.app_setting_manager import get_app_settings
+from .utils.common import get_sdk_from_sys_path, get_sdk_version
 
 # Extension Hooks
 FUNC_EXT_POST_FUNCTION_LOAD = "post_function_load"
@@ -24,6 +28,54 @@ APP_EXT_POST_FUNCTION_LOAD = "post_function_load_app_level"
 APP_EXT_PRE_INVOCATION = "pre_invocation_app_level"
 APP_EXT_POST_INVOCATION = "post_invocation_app_level"
 
+# Attribute of an invocation hook (e.g. pre_invocation.blocking = True) marking
+# it as blocking: around async functions, it is then run in an executor instead
+# of on the event loop. Hooks defined with async def are awaited instead.
+EXT_HOOK_BLOCKING_ATTR = "blocking"
+# Duration of an invocation hook over which a warning is logged, when it is
+# the longest one for this hook since its timings were last reported
+EXT_HOOK_SLOW_WARNING_SECONDS = 0.1
+# Time the thread of a synchronous function waits for an async invocation hook
+# run on the event loop, after which the hook is cancelled
+EXT_HOOK_AWAIT_TIMEOUT_SECONDS = 60.0
+
+
+class InvocationHook(NamedTuple):
+    # <extension name>.<hook name>, e.g. MyExtension.pre_invocation
+    name: str
+    ext_impl: Callable
+    ext_logger: logging.Logger
+    is_blocking: bool
+
+
+class InvocationHooks(NamedTuple):
+    """The invocation hooks of a function, in the order they are called."""
+    # Application level pre_invocation hooks, then function level ones
+    pre: Tuple[InvocationHook, ...]
+    # Function level post_invocation hooks, then application level ones
+    post: Tuple[InvocationHook, ...]
+
+
+class HookTiming:
+    """Count, total and maximum duration of the calls of an invocation hook,
+    which may run in several threads at once.
+    """
+    def __init__(self):
+        self.count = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, duration: float) -> bool:
+        """Records a call, returns whether it is the slowest one so far."""
+        with self._lock:
+            self.count += 1
+            self.total_seconds += duration
+            if duration <= self.max_seconds:
+                return False
+            self.max_seconds = duration
+            return True
+
 
 class ExtensionManager:
     _is_sdk_detected: bool = False
@@ -36,15 +88,18 @@ class ExtensionManager:
     interfaces. If this is None, that mean the sdk does not support extension.
     """
 
+    _invocation_hooks: Dict[str, Optional[InvocationHooks]] = {}
+    """This is a cache of the invocation hooks of the functions, resolved on
+    their first invocation. None when a function has no invocation hooks.
+    """
+
+    _hook_timings: Dict[str, HookTiming] = {}
+    """This records how long the invocation hooks take, by hook name
+    (e.g. MyExtension.pre_invocation), so that slow extensions stand out.
+    Reported with the invocation metrics, see get_hook_timings.
+    """
+
     @classmethod
-    @enable_feature_by(
-        flag=PYTHON_ENABLE_WORKER_EXTENSIONS,
-        flag_default=(
-            PYTHON_ENABLE_WORKER_EXTENSIONS_DEFAULT_39 if
-            is_python_version('3.9') else
-            PYTHON_ENABLE_WORKER_EXTENSIONS_DEFAULT
-        )
-    )
     def function_load_extension(cls, func_name, func_directory):
         """Helper to execute function load extensions. If one of the extension
         fails in the extension chain, the rest of them will continue, emitting
@@ -58,6 +113,13 @@ class ExtensionManager:
             The folder path of the trigger
             (e.g. /home/site/wwwroot/HttpTrigger).
         """
+        # The function may register extensions when it is loaded, which
+        # apply to other functions too in the case of application extensions
+        cls._invocation_hooks.clear()
+
+        if not cls._is_enabled():
+            return
+
         sdk = cls._try_get_sdk_with_extension_enabled()
         if sdk is None:
             return
@@ -84,67 +146,71 @@ class ExtensionManager:
         )
 
     @classmethod
-    @enable_feature_by(
-        flag=PYTHON_ENABLE_WORKER_EXTENSIONS,
-        flag_default=(
-            PYTHON_ENABLE_WORKER_EXTENSIONS_DEFAULT_39 if
-            is_python_version('3.9') else
-            PYTHON_ENABLE_WORKER_EXTENSIONS_DEFAULT
-        )
-    )
-    def _invocation_extension(cls, ctx, hook_name, func_args, func_ret=None):
-        """Helper to execute extensions. If one of the extension fails in the
-        extension chain, the rest of them will continue, emitting an error log
-        of an exception trace for failed extension.
-
-        Parameters
-        ----------
-        ctx: azure.functions.Context
-            Azure Functions context to be passed onto extension
-        hook_name: str
-            The exetension name to be executed (e.g. pre_invocations).
-            These are defined in azure.functions.FuncExtensionHooks.
+    def get_invocation_hooks(cls, function_name: str
+                             ) -> Optional[InvocationHooks]:
+        """Get the invocation hooks of a function, or None if it has none
+        (e.g. extensions are disabled). They are resolved once per function
+        load, so that invocations of functions without any hook can call them
+        directly.
         """
-        sdk = cls._try_get_sdk_with_extension_enabled()
-        if sdk is None:
-            return
+        try:
+            return cls._invocation_hooks[function_name]
+        except KeyError:
+            hooks = cls._resolve_invocation_hooks(function_name)
+            cls._invocation_hooks[function_name] = hooks
+            return hooks
 
-        # Get function hooks from azure.functions.extension.ExtensionMeta
-        # The return type is FuncExtensionHooks
-        funcs = sdk.ExtensionMeta.get_function_hooks(ctx.function_name)
-
-        # Invoke function hooks
-        cls._safe_execute_invocation_hooks(
-            funcs, hook_name, ctx, func_args, func_ret
-        )
-
-        # Get application hooks from azure.functions.extension.ExtensionMeta
-        # The reutnr type is AppExtensionHooks
-        apps = sdk.ExtensionMeta.get_application_hooks()
-
-        # Invoke application hook
-        cls._safe_execute_invocation_hooks(
-            apps, hook_name, ctx, func_args, func_ret
-        )
+    @classmethod
+    def get_hook_timings(cls) -> Dict[str, Dict[str, float]]:
+        """Get the count, total and maximum duration (in milliseconds) of
+        the calls of each invocation hook since the previous call, which
+        starts new timings.
+        """
+        hook_timings, cls._hook_timings = cls._hook_timings, {}
+        return {
+            name: {
+                'count': timing.count,
+                'total_ms': timing.total_seconds * 1000,
+                'max_ms': timing.max_seconds * 1000
+            }
+            for name, timing in list(hook_timings.items())
+        }
 
     @classmethod
-    def get_sync_invocation_wrapper(cls, ctx, func) -> Callable[[List], Any]:
+    def get_sync_invocation_wrapper(
+            cls, ctx, func,
+            loop: Optional[asyncio.AbstractEventLoop] = None
+    ) -> Callable[[List], Any]:
         """Get a synchronous lambda of extension wrapped function which takes
-        function parameters
+        function parameters. Async hooks are run on the loop if given, as
+        the lambda is called from a thread of the synchronous thread pool.
         """
-        return functools.partial(cls._raw_invocation_wrapper, ctx, func)
+        return functools.partial(cls._raw_invocation_wrapper, ctx, func,
+                                 loop=loop)
 
     @classmethod
     async def get_async_invocation_wrapper(cls, ctx, function, args) -> Any:
-        """An asynchronous coroutine for executing function with extensions
+        """An asynchronous coroutine for executing function with extensions.
+        Async hooks are awaited and blocking hooks are run in the default
+        executor, so that neither blocks the event loop.
         """
-        cls._invocation_extension(ctx, APP_EXT_PRE_INVOCATION, args)
-        cls._invocation_extension(ctx, FUNC_EXT_PRE_INVOCATION, args)
+        hooks = cls.get_invocation_hooks(ctx.function_name)
+        if hooks is None:
+            return await function(**args)
+
+        await cls._execute_invocation_hooks_async(hooks.pre, ctx, args)
         result = await function(**args)
-        cls._invocation_extension(ctx, FUNC_EXT_POST_INVOCATION, args, result)
-        cls._invocation_extension(ctx, APP_EXT_POST_INVOCATION, args, result)
+        await cls._execute_invocation_hooks_async(hooks.post, ctx, args,
+                                                  result)
         return result
 
+    @staticmethod
+    def _is_enabled() -> bool:
+        """Whether PYTHON_ENABLE_WORKER_EXTENSIONS is turned on, read from the
+        app settings snapshot as it is checked around every invocation.
+        """
+        return get_app_settings().enable_worker_extensions
+
     @staticmethod
     def _is_extension_enabled_in_sdk(module: ModuleType) -> bool:
         """Check if the extension feature is enabled in particular
@@ -162,33 +228,6 @@ class ExtensionManager:
         """
         return getattr(module, 'ExtensionMeta', None) is not None
 
-    @classmethod
-    def _is_pre_invocation_hook(cls, name) -> bool:
-        return name in (FUNC_EXT_PRE_INVOCATION, APP_EXT_PRE_INVOCATION)
-
-    @classmethod
-    def _is_post_invocation_hook(cls, name) -> bool:
-        return name in (FUNC_EXT_POST_INVOCATION, APP_EXT_POST_INVOCATION)
-
-    @classmethod
-    def _safe_execute_invocation_hooks(cls, hooks, hook_name, ctx, fargs, fret):
-        # hooks from azure.functions.ExtensionMeta.get_function_hooks() or
-        #            azure.functions.ExtensionMeta.get_application_hooks()
-        if hooks:
-            # Invoke extension implementation from .<hook_name>.ext_impl
-            for hook_meta in getattr(hooks, hook_name, []):
-                # Register a system logger with prefix azure_functions_worker
-                ext_logger = logging.getLogger(
-                    f'{SYSTEM_LOG_PREFIX}.extension.{hook_meta.ext_name}'
-                )
-                try:
-                    if cls._is_pre_invocation_hook(hook_name):
-                        hook_meta.ext_impl(ext_logger, ctx, fargs)
-                    elif cls._is_post_invocation_hook(hook_name):
-                        hook_meta.ext_impl(ext_logger, ctx, fargs, fret)
-                except Exception as e:
-                    ext_logger.error(e, exc_info=True)
-
     @classmethod
     def _safe_execute_function_load_hooks(cls, hooks, hook_name, fname, fdir):
         # hooks from azure.functions.ExtensionMeta.get_function_hooks() or
@@ -202,17 +241,120 @@ class ExtensionManager:
                     logger.error(e, exc_info=True)
 
     @classmethod
-    def _raw_invocation_wrapper(cls, ctx, function, args) -> Any:
+    def _raw_invocation_wrapper(
+            cls, ctx, function, args,
+            loop: Optional[asyncio.AbstractEventLoop] = None) -> Any:
         """Calls pre_invocation and post_invocation extensions additional
         to function invocation
         """
-        cls._invocation_extension(ctx, APP_EXT_PRE_INVOCATION, args)
-        cls._invocation_extension(ctx, FUNC_EXT_PRE_INVOCATION, args)
+        hooks = cls.get_invocation_hooks(ctx.function_name)
+        if hooks is None:
+            return function(**args)
+
+        cls._execute_invocation_hooks(hooks.pre, loop, ctx, args)
         result = function(**args)
-        cls._invocation_extension(ctx, FUNC_EXT_POST_INVOCATION, args, result)
-        cls._invocation_extension(ctx, APP_EXT_POST_INVOCATION, args, result)
+        cls._execute_invocation_hooks(hooks.post, loop, ctx, args, result)
         return result
 
+    @classmethod
+    def _resolve_invocation_hooks(cls, function_name: str
+                                  ) -> Optional[InvocationHooks]:
+        if not cls._is_enabled():
+            return None
+
+        sdk = cls._try_get_sdk_with_extension_enabled()
+        if sdk is None:
+            return None
+
+        funcs = sdk.ExtensionMeta.get_function_hooks(function_name)
+        apps = sdk.ExtensionMeta.get_application_hooks()
+        pre = cls._get_hook_chain(apps, APP_EXT_PRE_INVOCATION) \
+            + cls._get_hook_chain(funcs, FUNC_EXT_PRE_INVOCATION)
+        post = cls._get_hook_chain(funcs, FUNC_EXT_POST_INVOCATION) \
+            + cls._get_hook_chain(apps, APP_EXT_POST_INVOCATION)
+        if not pre and not post:
+            return None
+        return InvocationHooks(pre=pre, post=post)
+
+    @staticmethod
+    def _get_hook_chain(hooks, hook_name) -> Tuple[InvocationHook, ...]:
+        # hooks from azure.functions.ExtensionMeta.get_function_hooks() or
+        #            azure.functions.ExtensionMeta.get_application_hooks()
+        if not hooks:
+            return ()
+        return tuple(
+            InvocationHook(
+                name=f'{hook_meta.ext_name}.{hook_name}',
+                ext_impl=hook_meta.ext_impl,
+                ext_logger=logging.getLogger(
+                    f'{SYSTEM_LOG_PREFIX}.extension.{hook_meta.ext_name}'),
+                is_blocking=bool(getattr(hook_meta.ext_impl,
+                                         EXT_HOOK_BLOCKING_ATTR, False))
+                and not asyncio.iscoroutinefunction(hook_meta.ext_impl))
+            for hook_meta in getattr(hooks, hook_name, []))
+
+    @classmethod
+    def _execute_invocation_hooks(cls, hook_chain, loop, ctx, fargs, *fret):
+        # fret (the function result) is only passed to post_invocation hooks
+        for hook in hook_chain:
+            start = time.perf_counter()
+            try:
+                result = hook.ext_impl(hook.ext_logger, ctx, fargs, *fret)
+                if inspect.isawaitable(result):
+                    cls._run_awaitable(result, loop)
+            except Exception as e:
+                hook.ext_logger.error(e, exc_info=True)
+            cls._record_hook_timing(hook, time.perf_counter() - start)
+
+    @classmethod
+    async def _execute_invocation_hooks_async(cls, hook_chain, ctx, fargs,
+                                              *fret):
+        for hook in hook_chain:
+            start = time.perf_counter()
+            try:
+                if hook.is_blocking:
+                    await asyncio.get_running_loop().run_in_executor(
+                        None, functools.partial(hook.ext_impl,
+                                                hook.ext_logger, ctx, fargs,
+                                                *fret))
+                else:
+                    result = hook.ext_impl(hook.ext_logger, ctx, fargs, *fret)
+                    if inspect.isawaitable(result):
+                        await result
+            except Exception as e:
+                hook.ext_logger.error(e, exc_info=True)
+            cls._record_hook_timing(hook, time.perf_counter() - start)
+
+    @staticmethod
+    def _run_awaitable(awaitable: Awaitable,
+                       loop: Optional[asyncio.AbstractEventLoop]):
+        async def await_hook():
+            return await awaitable
+
+        # The hooks may use resources bound to the worker's event loop, run
+        # them there unless it is not available (e.g. outside of the worker)
+        if loop is not None and loop.is_running():
+            future = asyncio.run_coroutine_threadsafe(await_hook(), loop)
+            try:
+                future.result(EXT_HOOK_AWAIT_TIMEOUT_SECONDS)
+            except concurrent.futures.TimeoutError:
+                future.cancel()
+                raise TimeoutError(
+                    'Extension hook did not complete in '
+                    f'{EXT_HOOK_AWAIT_TIMEOUT_SECONDS} s') from None
+        else:
+            asyncio.run(await_hook())
+
+    @classmethod
+    def _record_hook_timing(cls, hook: InvocationHook, duration: float):
+        timing = cls._hook_timings.get(hook.name)
+        if timing is None:
+            timing = cls._hook_timings.setdefault(hook.name, HookTiming())
+        if timing.record(duration) \
+                and duration > EXT_HOOK_SLOW_WARNING_SECONDS:
+            hook.ext_logger.warning('Extension hook %s took %.1f ms',
+                                    hook.name, duration * 1000)
+
     @classmethod
     def _try_get_sdk_with_extension_enabled(cls) -> Optional[ModuleType]:
         if cls._is_sdk_detected:
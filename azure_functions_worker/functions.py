@@ -1,5 +1,6 @@
 # Copyright (c) Microsoft Corporation. All rights reserved.
 # Licensed under the MIT License.
+import functools
 import inspect
 import operator
 import pathlib
@@ -45,12 +46,69 @@ class FunctionLoadError(RuntimeError):
             f'cannot load the {function_name} function: {msg}')
 
 
+class _AnnotationInfo(typing.NamedTuple):
+    # Whether the annotation is azure.functions.Out
+    is_out: bool
+    # T for Out[T], None for Out annotations without exactly one type
+    # argument, the annotation itself otherwise
+    py_type: typing.Any
+    # Whether py_type is a type or a generic type
+    is_type: bool
+
+
+_NO_ANNOTATION_INFO = _AnnotationInfo(is_out=False, py_type=None,
+                                      is_type=False)
+
+
+def _get_annotation_info(annotation: typing.Any) -> _AnnotationInfo:
+    if typing_inspect.is_generic_type(annotation):
+        annotation_origin = typing_inspect.get_origin(annotation)
+        if annotation_origin is not None:
+            is_out = (isinstance(annotation_origin, type)
+                      and annotation_origin.__name__ == 'Out')
+        else:
+            is_out = (isinstance(annotation, type)
+                      and annotation.__name__ == 'Out')
+    else:
+        is_out = isinstance(annotation, type) and annotation.__name__ == 'Out'
+
+    py_type = annotation
+    if is_out:
+        annotation_args = typing_inspect.get_args(annotation)
+        if len(annotation_args) != 1:
+            py_type = None
+        else:
+            py_type = annotation_args[0]
+            # typing_inspect.get_args() returns a flat list,
+            # so if the annotation was func.Out[typing.List[foo]],
+            # we need to reconstruct it.
+            if (isinstance(py_type, tuple)
+                    and typing_inspect.is_generic_type(py_type[0])):
+                py_type = operator.getitem(py_type[0], *py_type[1:])
+
+    is_type = py_type is not None and (
+        isinstance(py_type, type) or typing_inspect.is_generic_type(py_type))
+
+    return _AnnotationInfo(is_out=is_out, py_type=py_type, is_type=is_type)
+
+
+@functools.lru_cache(maxsize=None)
+def _get_function_directory(file_name: str) -> str:
+    return str(pathlib.Path(file_name).parent)
+
+
 class Registry:
     _functions: typing.MutableMapping[str, FunctionInfo]
     _deferred_bindings_enabled: bool = False
 
     def __init__(self) -> None:
         self._functions = {}
+        # key: id of a parameter annotation, val: the annotation and its
+        # info. The same annotation objects (func.HttpRequest, func.Out[str],
+        # ...) recur across the functions of an app, which makes
+        # typing_inspect calls add up.
+        self._annotation_infos: typing.Dict[
+            int, typing.Tuple[typing.Any, _AnnotationInfo]] = {}
 
     def get_function(self, function_id: str) -> FunctionInfo:
         if function_id in self._functions:
@@ -61,6 +119,15 @@ class Registry:
     def deferred_bindings_enabled(self) -> bool:
         return self._deferred_bindings_enabled
 
+    def _get_annotation_info(self, annotation: typing.Any) -> _AnnotationInfo:
+        cached = self._annotation_infos.get(id(annotation))
+        if cached is not None:
+            return cached[1]
+        info = _get_annotation_info(annotation)
+        # Keeps the annotation alive, so that its id is not reused
+        self._annotation_infos[id(annotation)] = (annotation, info)
+        return info
+
     @staticmethod
     def get_explicit_and_implicit_return(binding_name: str,
                                          binding: BindingInfo,
@@ -130,8 +197,7 @@ class Registry:
                         f'{ctx_anno!r}')
         return requires_context
 
-    @staticmethod
-    def validate_function_params(params: dict, bound_params: dict,
+    def validate_function_params(self, params: dict, bound_params: dict,
                                  annotations: dict, func_name: str):
         if set(params) - set(bound_params):
             raise FunctionLoadError(
@@ -161,50 +227,20 @@ class Registry:
                     param_anno,
                     fx_deferred_bindings_enabled))
 
-            if param_has_anno:
-                if typing_inspect.is_generic_type(param_anno):
-                    param_anno_origin = typing_inspect.get_origin(param_anno)
-                    if param_anno_origin is not None:
-                        is_param_out = (
-                            isinstance(param_anno_origin, type)
-                            and param_anno_origin.__name__ == 'Out'
-                        )
-                    else:
-                        is_param_out = (
-                            isinstance(param_anno, type)
-                            and param_anno.__name__ == 'Out'
-                        )
-                else:
-                    is_param_out = (
-                        isinstance(param_anno, type)
-                        and param_anno.__name__ == 'Out'
-                    )
-            else:
-                is_param_out = False
+            anno_info = self._get_annotation_info(param_anno) \
+                if param_has_anno else _NO_ANNOTATION_INFO
+            is_param_out = anno_info.is_out
+            param_py_type = anno_info.py_type
 
             is_binding_out = binding.direction == protos.BindingInfo.out
 
-            if is_param_out:
-                param_anno_args = typing_inspect.get_args(param_anno)
-                if len(param_anno_args) != 1:
-                    raise FunctionLoadError(
-                        func_name,
-                        f'binding {param.name} has invalid Out annotation '
-                        f'{param_anno!r}')
-                param_py_type = param_anno_args[0]
-
-                # typing_inspect.get_args() returns a flat list,
-                # so if the annotation was func.Out[typing.List[foo]],
-                # we need to reconstruct it.
-                if (isinstance(param_py_type, tuple)
-                        and typing_inspect.is_generic_type(param_py_type[0])):
-                    param_py_type = operator.getitem(
-                        param_py_type[0], *param_py_type[1:])
-            else:
-                param_py_type = param_anno
+            if is_param_out and param_py_type is None:
+                raise FunctionLoadError(
+                    func_name,
+                    f'binding {param.name} has invalid Out annotation '
+                    f'{param_anno!r}')
 
-            if (param_has_anno and not isinstance(param_py_type, type)
-                    and not typing_inspect.is_generic_type(param_py_type)):
+            if param_has_anno and not anno_info.is_type:
                 raise FunctionLoadError(
                     func_name,
                     f'binding {param.name} has invalid non-type annotation '
@@ -423,7 +459,7 @@ class Registry:
         sig = inspect.signature(func)
         params = dict(sig.parameters)
         annotations = typing.get_type_hints(func)
-        func_dir = str(pathlib.Path(inspect.getfile(func)).parent)
+        func_dir = _get_function_directory(inspect.getfile(func))
 
         bound_params = {}
         for binding in function.get_bindings():
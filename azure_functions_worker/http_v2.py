@@ -3,18 +3,32 @@
 
 import abc
 import asyncio
+import hashlib
 import importlib
+import inspect
 import socket
 import sys
-from typing import Dict
+import time
+from collections import OrderedDict
+from typing import Dict, NamedTuple, Optional, Tuple
 
 from azure_functions_worker.constants import (
     BASE_EXT_SUPPORTED_PY_MINOR_VERSION,
+    HTTP_V2_CONTEXT_TIMEOUT_SECONDS,
     PYTHON_ENABLE_INIT_INDEXING,
+    PYTHON_HTTP_V2_RESPONSE_CACHE_FUNCTIONS,
+    PYTHON_HTTP_V2_RESPONSE_CACHE_MAX_BYTES,
+    PYTHON_HTTP_V2_RESPONSE_CACHE_MAX_BYTES_DEFAULT,
+    PYTHON_HTTP_V2_RESPONSE_CACHE_TTL_SECONDS_DEFAULT,
+    PYTHON_HTTP_V2_RESPONSE_CACHE_VARY_HEADERS,
+    PYTHON_HTTP_V2_RESPONSE_CACHE_VARY_HEADERS_DEFAULT,
     X_MS_INVOCATION_ID,
 )
 from azure_functions_worker.logging import logger
-from azure_functions_worker.utils.common import is_envvar_false
+from azure_functions_worker.utils.common import (
+    get_app_setting,
+    is_envvar_false,
+)
 
 
 # Http V2 Exceptions
@@ -43,6 +57,10 @@ class BaseContextReference(abc.ABC):
         self._http_trigger_param_name = http_trigger_param_name
         self._http_request_available_event = event_class()
         self._http_response_available_event = event_class()
+        self._http_request_consumed = False
+        self._served_from_cache = False
+        self._created_at = time.monotonic()
+        self._http_response_set_at: Optional[float] = None
 
     @property
     def http_request(self):
@@ -60,6 +78,7 @@ class BaseContextReference(abc.ABC):
     @http_response.setter
     def http_response(self, value):
         self._http_response = value
+        self._http_response_set_at = time.monotonic()
         self._http_response_available_event.set()
 
     @property
@@ -94,6 +113,30 @@ class BaseContextReference(abc.ABC):
     def args(self, value):
         self._args = value
 
+    @property
+    def http_request_consumed(self):
+        return self._http_request_consumed
+
+    @http_request_consumed.setter
+    def http_request_consumed(self, value):
+        self._http_request_consumed = value
+
+    @property
+    def served_from_cache(self):
+        return self._served_from_cache
+
+    @served_from_cache.setter
+    def served_from_cache(self, value):
+        self._served_from_cache = value
+
+    @property
+    def created_at(self):
+        return self._created_at
+
+    @property
+    def http_response_set_at(self):
+        return self._http_response_set_at
+
     @property
     def http_request_available_event(self):
         return self._http_request_available_event
@@ -130,16 +173,46 @@ class SingletonMeta(type):
 class HttpCoordinator(metaclass=SingletonMeta):
     """
     HTTP coordinator class for managing HTTP v2 requests and responses.
+    A context reference is kept per invocation from the moment either its
+    HTTP request or its invocation request arrives until its HTTP response
+    has been delivered.
+    Context references that are orphaned (the HTTP request or the invocation
+    request never arrives, or the response is never picked up) are evicted
+    once they are older than the context timeout.
     """
-    def __init__(self):
+    def __init__(self, timeout: float = HTTP_V2_CONTEXT_TIMEOUT_SECONDS):
         self._context_references: Dict[str, BaseContextReference] = {}
+        self._timeout = timeout
+        self._last_eviction = time.monotonic()
 
-    def set_http_request(self, invoc_id, http_request):
+    @property
+    def live_contexts(self) -> int:
+        """
+        Number of invocations currently tracked by the coordinator.
+        """
+        return len(self._context_references)
+
+    def set_http_request(self, invoc_id, http_request,
+                         served_from_cache=False):
+        self._evict_expired_contexts()
         if invoc_id not in self._context_references:
             self._context_references[invoc_id] = AsyncContextReference()
         context_ref = self._context_references.get(invoc_id)
+        context_ref.served_from_cache = served_from_cache
         context_ref.http_request = http_request
 
+    def pop_served_from_cache(self, invoc_id) -> bool:
+        """
+        Returns whether the HTTP response of the invocation has already been
+        served from the response cache, in which case the function must not
+        be run and the context reference is removed.
+        """
+        context_ref = self._context_references.get(invoc_id)
+        if context_ref is None or not context_ref.served_from_cache:
+            return False
+        del self._context_references[invoc_id]
+        return True
+
     def set_http_response(self, invoc_id, http_response):
         if invoc_id not in self._context_references:
             raise KeyError("No context reference found for invocation %s"
@@ -151,8 +224,16 @@ class HttpCoordinator(metaclass=SingletonMeta):
         if invoc_id not in self._context_references:
             self._context_references[invoc_id] = AsyncContextReference()
 
-        await self._context_references.get(
-            invoc_id).http_request_available_event.wait()
+        event = self._context_references.get(
+            invoc_id).http_request_available_event
+        if not event.is_set():
+            try:
+                await asyncio.wait_for(event.wait(), timeout=self._timeout)
+            except asyncio.TimeoutError:
+                # The context reference is left in place so that the failure
+                # can still be set as the response; it is evicted later.
+                raise TimeoutError("No http request received for invocation "
+                                   "%s" % invoc_id)
         return self._pop_http_request(invoc_id)
 
     async def await_http_response_async(self, invoc_id):
@@ -160,28 +241,262 @@ class HttpCoordinator(metaclass=SingletonMeta):
             raise KeyError("No context reference found for invocation %s"
                            % invoc_id)
 
-        await self._context_references.get(
-            invoc_id).http_response_available_event.wait()
+        context_ref = self._context_references.get(invoc_id)
+        while not context_ref.http_response_available_event.is_set():
+            try:
+                await asyncio.wait_for(
+                    context_ref.http_response_available_event.wait(),
+                    timeout=self._timeout)
+            except asyncio.TimeoutError:
+                # Keep waiting on functions that are still executing, but
+                # give up on requests no invocation has picked up.
+                if not context_ref.http_request_consumed:
+                    self._context_references.pop(invoc_id, None)
+                    raise TimeoutError("No invocation received for http "
+                                       "request %s" % invoc_id)
         return self._pop_http_response(invoc_id)
 
     def _pop_http_request(self, invoc_id):
         context_ref = self._context_references.get(invoc_id)
-        request = context_ref.http_request
+        request = context_ref.http_request if context_ref else None
         if request is not None:
             context_ref.http_request = None
+            context_ref.http_request_consumed = True
             return request
 
         raise ValueError("No http request found for invocation %s" % invoc_id)
 
     def _pop_http_response(self, invoc_id):
         context_ref = self._context_references.get(invoc_id)
-        response = context_ref.http_response
+        response = context_ref.http_response if context_ref else None
         if response is not None:
-            context_ref.http_response = None
+            # The response has been delivered, nothing else will refer to
+            # this invocation.
+            del self._context_references[invoc_id]
             return response
 
         raise ValueError("No http response found for invocation %s" % invoc_id)
 
+    def _evict_expired_contexts(self):
+        """
+        Removes the context references which are not waiting on a function
+        that is still executing, i.e. older than the timeout with their HTTP
+        request never picked up by an invocation, or with their HTTP response
+        set more than the timeout ago and never delivered.
+        This is checked at most once per timeout period.
+        """
+        now = time.monotonic()
+        if now - self._last_eviction < self._timeout:
+            return
+        self._last_eviction = now
+        expired_invoc_ids = [
+            invoc_id for invoc_id, context_ref
+            in self._context_references.items()
+            if (not context_ref.http_request_consumed
+                and now - context_ref.created_at > self._timeout)
+            or (context_ref.http_response_set_at is not None
+                and now - context_ref.http_response_set_at > self._timeout)]
+        for invoc_id in expired_invoc_ids:
+            del self._context_references[invoc_id]
+        if expired_invoc_ids:
+            logger.warning('Evicted %s expired HTTP contexts. Live HTTP '
+                           'contexts: %s', len(expired_invoc_ids),
+                           self.live_contexts)
+
+
+class _CachedHttpResponse(NamedTuple):
+    status_code: int
+    headers: Tuple[Tuple[str, str], ...]
+    body: bytes
+    etag: str
+    expires_at: float
+
+
+class HttpResponseCache:
+    """
+    Opt-in cache of the responses of HTTP v2 functions to GET requests, for
+    the functions listed in PYTHON_HTTP_V2_RESPONSE_CACHE_FUNCTIONS.
+    Responses are keyed on the url of the request and the values of its vary
+    headers, kept for the TTL of the function that returned them, and evicted
+    in least recently used order once the total size of the cached bodies
+    exceeds the capacity.
+    Only web framework responses with status 200 and a bytes body are cached.
+    Their status, headers and body are kept, and a new response of the
+    standard response type of the web framework is built from them for each
+    hit, since responses are not meant to be served more than once.
+    Requests carrying credentials which are not part of the key are never
+    served from the cache, nor are their responses cached.
+    """
+    _CREDENTIAL_HEADERS = ('authorization', 'cookie')
+    # Identity and tokens of the caller set by App Service Authentication
+    # (e.g. x-ms-client-principal-id, x-ms-token-aad-access-token)
+    _CREDENTIAL_HEADER_PREFIXES = ('x-ms-client-principal', 'x-ms-token-')
+
+    def __init__(self):
+        self.function_ttls: Dict[str, float] = {}
+        self.max_bytes = PYTHON_HTTP_V2_RESPONSE_CACHE_MAX_BYTES_DEFAULT
+        self.vary_headers: Tuple[str, ...] = \
+            (PYTHON_HTTP_V2_RESPONSE_CACHE_VARY_HEADERS_DEFAULT,)
+        self.used_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._response_type = None
+        self._entries: 'OrderedDict[tuple, _CachedHttpResponse]' = \
+            OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.function_ttls)
+
+    @property
+    def hit_ratio(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def load_settings(self, response_type=None):
+        """
+        (Re)loads the cache settings from the app settings, dropping all the
+        cached responses.
+        response_type is the standard response type of the web framework,
+        used to serve the cached responses and to answer conditional requests
+        (If-None-Match) with 304 Not Modified. Nothing is cached without it.
+        """
+        self.clear()
+        self._response_type = response_type
+        self.function_ttls = {}
+        functions_setting = get_app_setting(
+            PYTHON_HTTP_V2_RESPONSE_CACHE_FUNCTIONS, default_value='')
+        for function_setting in functions_setting.split(','):
+            function_name, _, ttl = function_setting.strip().partition(':')
+            if not function_name:
+                continue
+            try:
+                self.function_ttls[function_name] = float(ttl) if ttl \
+                    else PYTHON_HTTP_V2_RESPONSE_CACHE_TTL_SECONDS_DEFAULT
+            except ValueError:
+                logger.warning('Invalid HTTP response cache TTL %s for '
+                               'function %s', ttl, function_name)
+        self.max_bytes = int(get_app_setting(
+            PYTHON_HTTP_V2_RESPONSE_CACHE_MAX_BYTES,
+            default_value=str(PYTHON_HTTP_V2_RESPONSE_CACHE_MAX_BYTES_DEFAULT),
+            validator=str.isdigit))
+        vary_headers_setting = get_app_setting(
+            PYTHON_HTTP_V2_RESPONSE_CACHE_VARY_HEADERS,
+            default_value=PYTHON_HTTP_V2_RESPONSE_CACHE_VARY_HEADERS_DEFAULT)
+        self.vary_headers = tuple(
+            header.strip().lower() for header in vary_headers_setting.split(',')
+            if header.strip())
+        if self.enabled:
+            logger.info('HTTP response cache enabled for functions %s',
+                        self.function_ttls)
+
+    def get(self, http_request):
+        """
+        Returns the response to serve for the given request from the cache,
+        or None if there is none.
+        """
+        key = self._get_key(http_request)
+        if key is None:
+            return None
+        entry = self._entries.get(key)
+        if entry is not None and entry.expires_at <= time.monotonic():
+            self._remove(key)
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        if self._is_not_modified(http_request, entry.etag):
+            return self._response_type(
+                status_code=304, headers={'etag': entry.etag})
+        return self._response_type(content=entry.body,
+                                   status_code=entry.status_code,
+                                   headers=dict(entry.headers))
+
+    def put(self, function_name, http_request, http_response):
+        """
+        Caches the response the given function returned for the given
+        request, if the function is cached and the response cacheable.
+        """
+        ttl = self.function_ttls.get(function_name)
+        if ttl is None or self._response_type is None:
+            return
+        key = self._get_key(http_request)
+        if key is None or not self._is_cacheable(http_response):
+            return
+        size = len(http_response.body)
+        if size > self.max_bytes:
+            return
+        etag = http_response.headers.get('etag')
+        if etag is None:
+            etag = '"%s"' % hashlib.sha1(http_response.body).hexdigest()
+            # Only set on the response of this invocation, which is not
+            # served again
+            http_response.headers['etag'] = etag
+        self._remove(key)
+        self._entries[key] = _CachedHttpResponse(
+            http_response.status_code, tuple(http_response.headers.items()),
+            http_response.body, etag, time.monotonic() + ttl)
+        self.used_bytes += size
+        while self.used_bytes > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+            logger.debug('Evicted HTTP response from cache. Hits: %s, '
+                         'misses: %s, evictions: %s, used bytes: %s',
+                         self.hits, self.misses, self.evictions,
+                         self.used_bytes)
+
+    def clear(self):
+        self._entries.clear()
+        self.used_bytes = 0
+
+    def _get_key(self, http_request) -> Optional[tuple]:
+        if not self.enabled or http_request.method != 'GET':
+            return None
+        headers = http_request.headers
+        for header in headers.keys():
+            header = header.lower()
+            if (header in self._CREDENTIAL_HEADERS
+                    or header.startswith(self._CREDENTIAL_HEADER_PREFIXES)) \
+                    and header not in self.vary_headers:
+                return None
+        return (str(http_request.url),
+                tuple(headers.get(header) for header in self.vary_headers))
+
+    @staticmethod
+    def _is_cacheable(http_response) -> bool:
+        if getattr(http_response, 'status_code', None) != 200 or \
+                not isinstance(getattr(http_response, 'body', None), bytes) \
+                or getattr(http_response, 'background', None) is not None:
+            return False
+        headers = http_response.headers
+        header_names = [name.lower() for name, _ in headers.items()]
+        if len(set(header_names)) != len(header_names):
+            # Repeated headers would be merged when the response is rebuilt
+            return False
+        cache_control = headers.get('cache-control', '').lower()
+        return 'set-cookie' not in headers and \
+            'no-store' not in cache_control and \
+            'private' not in cache_control
+
+    @staticmethod
+    def _is_not_modified(http_request, etag: str) -> bool:
+        if_none_match = http_request.headers.get('if-none-match')
+        if if_none_match is None:
+            return False
+        return if_none_match.strip() == '*' or etag in (
+            tag.strip() for tag in if_none_match.split(','))
+
+    def _remove(self, key: tuple):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.used_bytes -= len(entry.body)
+
 
 def get_unused_tcp_port():
     # Create a TCP socket
@@ -196,6 +511,19 @@ def get_unused_tcp_port():
     return port
 
 
+def _as_http_response(http_resp, streaming_response_type):
+    """
+    Generators and async iterables returned by a function are not responses
+    the web framework can serve as is; they are wrapped in its streaming
+    response type so that each chunk is written to the client as soon as it
+    is produced, without buffering the whole body.
+    """
+    if streaming_response_type is not None and \
+            (inspect.isgenerator(http_resp) or hasattr(http_resp, '__aiter__')):
+        return streaming_response_type(http_resp)
+    return http_resp
+
+
 def initialize_http_server(host_addr, **kwargs):
     """
     Initialize HTTP v2 server for handling HTTP requests.
@@ -207,10 +535,13 @@ def initialize_http_server(host_addr, **kwargs):
         web_app_class = extension_module.WebApp
         web_server_class = extension_module.WebServer
 
-        unused_port = get_unused_tcp_port()
-
         app = web_app_class()
         request_type = ext_base.RequestTrackerMeta.get_request_type()
+        streaming_response_type = \
+            ext_base.ResponseTrackerMeta.get_response_type(
+                ext_base.ResponseLabels.STREAMING)
+        http_response_cache.load_settings(
+            ext_base.ResponseTrackerMeta.get_standard_response_type())
 
         @app.route
         async def catch_all(request: request_type):  # type: ignore
@@ -219,6 +550,14 @@ def initialize_http_server(host_addr, **kwargs):
                 raise MissingHeaderError("Header %s not found" %
                                          X_MS_INVOCATION_ID)
             logger.info('Received HTTP request for invocation %s', invoc_id)
+            cached_resp = http_response_cache.get(request)
+            if cached_resp is not None:
+                logger.info('Sending cached HTTP response for invocation %s',
+                            invoc_id)
+                http_coordinator.set_http_request(invoc_id, request,
+                                                  served_from_cache=True)
+                return cached_resp
+
             http_coordinator.set_http_request(invoc_id, request)
             http_resp = \
                 await http_coordinator.await_http_response_async(invoc_id)
@@ -228,15 +567,16 @@ def initialize_http_server(host_addr, **kwargs):
             if isinstance(http_resp, Exception):
                 raise http_resp
 
-            return http_resp
+            return _as_http_response(http_resp, streaming_response_type)
 
-        web_server = web_server_class(host_addr, unused_port, app)
+        port = get_unused_tcp_port()
+        web_server = web_server_class(host_addr, port, app)
         web_server_run_task = web_server.serve()
 
         loop = asyncio.get_event_loop()
         loop.create_task(web_server_run_task)
 
-        web_server_address = f"http://{host_addr}:{unused_port}"
+        web_server_address = f"http://{host_addr}:{port}"
         logger.info('HTTP server starting on %s', web_server_address)
 
         return web_server_address
@@ -246,11 +586,26 @@ def initialize_http_server(host_addr, **kwargs):
             from e
 
 
-async def sync_http_request(http_request, func_http_request):
+def get_http_route_params(pb) -> Optional[Dict[str, str]]:
+    """
+    Returns the route params of the HTTP trigger ParameterBinding of an
+    invocation request, read directly from the protobuf without decoding the
+    rest of the RpcHttp, which is not needed since the function receives the
+    request of the web framework.
+    Returns None if the RpcHttp is not carried inline (e.g. it was transferred
+    over shared memory).
+    """
+    if pb.WhichOneof('rpc_data') != 'data' or \
+            pb.data.WhichOneof('data') != 'http':
+        return None
+    return dict(pb.data.http.params)
+
+
+async def sync_http_request(http_request, route_params):
     # Sync http request route params from invoc_request to http_request
     (HttpV2Registry.ext_base().RequestTrackerMeta
      .get_synchronizer()
-     .sync_route_params(http_request, func_http_request.route_params))
+     .sync_route_params(http_request, route_params))
 
 
 class HttpV2Registry:
@@ -290,3 +645,4 @@ class HttpV2Registry:
 
 
 http_coordinator = HttpCoordinator()
+http_response_cache = HttpResponseCache()
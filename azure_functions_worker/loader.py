@@ -21,12 +21,10 @@ from .constants import (
     METADATA_PROPERTIES_WORKER_INDEXED,
     MODULE_NOT_FOUND_TS_URL,
     PYTHON_LANGUAGE_RUNTIME,
-    PYTHON_SCRIPT_FILE_NAME,
-    PYTHON_SCRIPT_FILE_NAME_DEFAULT,
     RETRY_POLICY,
 )
 from .logging import logger
-from .utils.common import get_app_setting
+from .utils.app_setting_manager import get_app_settings
 from .utils.wrappers import attach_message_to_exception
 
 _AZURE_NAMESPACE = '__app__'
@@ -255,9 +253,7 @@ def index_function_app(function_path: str):
                     f"level function app instances are defined.")
 
     if not app:
-        script_file_name = get_app_setting(
-            setting=PYTHON_SCRIPT_FILE_NAME,
-            default_value=f'{PYTHON_SCRIPT_FILE_NAME_DEFAULT}')
+        script_file_name = get_app_settings().script_file_name
         raise ValueError("Could not find top level function app instances in "
                          f"{script_file_name}.")
 
@@ -3,6 +3,7 @@
 """Main entrypoint."""
 
 import argparse
+import sys
 
 
 def parse_args():
@@ -41,16 +42,27 @@ def parse_args():
 
 
 def main():
+    args = parse_args()
+
+    from . import zygote
+    if zygote.is_enabled():
+        exit_code = zygote.run_worker(args)
+        if exit_code is not None:
+            sys.exit(exit_code)
+
     from .utils.dependency import DependencyManager
     DependencyManager.initialize()
     DependencyManager.use_worker_dependencies()
 
+    return run(args)
+
+
+def run(args):
     import asyncio
 
     from . import logging
     from .logging import error_logger, format_exception, logger
 
-    args = parse_args()
     logging.setup(log_level=args.log_level, log_destination=args.log_to)
 
     logger.info('Starting Azure Functions Python Worker.')
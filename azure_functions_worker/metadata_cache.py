@@ -0,0 +1,127 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+"""On-disk cache of the function metadata of indexed function apps.
+
+Indexing a function app imports it and inspects every function it registers,
+which dominates the cold start of large apps. The resulting metadata is
+stored in the cache directory under a key derived from everything it depends
+on: the contents of the Python files of the app, the versions of the
+installed packages, the Python version and the worker version. Any change to
+one of them produces a different key, i.e. a cache miss.
+"""
+
+import hashlib
+import os
+import sys
+from typing import List, Optional
+
+from . import protos
+from .logging import logger
+from .version import VERSION
+
+_CACHE_FILE_EXTENSION = '.metadata'
+_EXCLUDED_DIR_NAMES = ('__pycache__', 'node_modules')
+_PACKAGE_INFO_SUFFIXES = ('.dist-info', '.egg-info')
+
+
+def get_cache_key(function_app_directory: str, script_file_name: str) -> str:
+    """Returns the cache key of the function app in the given directory.
+    """
+    key = hashlib.sha256()
+    key.update(f'{VERSION}\0{sys.version}\0{script_file_name}\0'.encode())
+
+    for root, dir_names, file_names in os.walk(function_app_directory):
+        # Hidden directories hold packages (.python_packages, .venv), which
+        # are accounted for by their versions, or tooling state.
+        dir_names[:] = sorted(
+            d for d in dir_names
+            if not d.startswith('.') and d not in _EXCLUDED_DIR_NAMES)
+        for file_name in sorted(file_names):
+            if not file_name.endswith('.py'):
+                continue
+            file_path = os.path.join(root, file_name)
+            rel_path = os.path.relpath(file_path, function_app_directory)
+            with open(file_path, 'rb') as f:
+                file_hash = hashlib.sha256(f.read()).hexdigest()
+            key.update(f'{rel_path}\0{file_hash}\0'.encode())
+
+    # The names of the metadata directories of the installed packages
+    # include their versions; reading the metadata itself is much slower.
+    for path in sys.path:
+        try:
+            entries = sorted(os.listdir(path or '.'))
+        except OSError:
+            continue
+        packages = [e for e in entries if e.endswith(_PACKAGE_INFO_SUFFIXES)]
+        key.update(f'{path}\0{":".join(packages)}\0'.encode())
+    return key.hexdigest()
+
+
+def load(cache_dir: str,
+         cache_key: str) -> Optional[List[protos.RpcFunctionMetadata]]:
+    """Returns the cached function metadata for the given key, or None if
+    there is none.
+    """
+    cache_path = _get_cache_path(cache_dir, cache_key)
+    try:
+        with open(cache_path, 'rb') as f:
+            content = f.read()
+    except FileNotFoundError:
+        return None
+    except OSError as e:
+        logger.warning('Cannot read function metadata cache %s - %s',
+                       cache_path, e)
+        return None
+
+    try:
+        response = protos.FunctionMetadataResponse.FromString(content)
+    except Exception as e:
+        logger.warning('Invalid function metadata cache %s - %s',
+                       cache_path, e)
+        _remove(cache_path)
+        return None
+    return list(response.function_metadata_results)
+
+
+def save(cache_dir: str, cache_key: str,
+         function_metadata: List[protos.RpcFunctionMetadata]):
+    """Stores the function metadata under the given key, replacing any
+    metadata cached under another key.
+    """
+    cache_path = _get_cache_path(cache_dir, cache_key)
+    content = protos.FunctionMetadataResponse(
+        function_metadata_results=function_metadata).SerializeToString()
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        # Write to a temporary file first so that concurrent workers never
+        # read a partially written cache
+        tmp_path = f'{cache_path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(content)
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        logger.warning('Cannot write function metadata cache %s - %s',
+                       cache_path, e)
+        return
+
+    for file_name in os.listdir(cache_dir):
+        file_path = os.path.join(cache_dir, file_name)
+        if file_name.endswith(_CACHE_FILE_EXTENSION) and \
+                file_path != cache_path:
+            _remove(file_path)
+
+
+def remove(cache_dir: str, cache_key: str):
+    """Removes the function metadata cached under the given key."""
+    _remove(_get_cache_path(cache_dir, cache_key))
+
+
+def _get_cache_path(cache_dir: str, cache_key: str) -> str:
+    return os.path.join(cache_dir, cache_key + _CACHE_FILE_EXTENSION)
+
+
+def _remove(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
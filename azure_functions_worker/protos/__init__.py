@@ -28,6 +28,10 @@ from .FunctionRpc_pb2 import (  # NoQA
     RpcLog,
     RpcSharedMemory,
     RpcDataType,
+    CollectionBytes,
+    CollectionString,
+    CollectionDouble,
+    CollectionSInt64,
     CloseSharedMemoryResourcesRequest,
     CloseSharedMemoryResourcesResponse,
     FunctionsMetadataRequest,
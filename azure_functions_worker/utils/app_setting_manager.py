@@ -2,20 +2,160 @@
 # Licensed under the MIT License.
 import os
 import sys
+from types import MappingProxyType
+from typing import (
+    Callable, FrozenSet, Mapping, NamedTuple, Optional, Tuple,
+)
 
 from ..constants import (
     FUNCTIONS_WORKER_SHARED_MEMORY_DATA_TRANSFER_ENABLED,
+    PYTHON_COALESCED_FUNCTIONS,
     PYTHON_ENABLE_DEBUG_LOGGING,
+    PYTHON_ENABLE_GC_METRICS,
     PYTHON_ENABLE_INIT_INDEXING,
+    PYTHON_ENABLE_INVOCATION_METRICS,
     PYTHON_ENABLE_OPENTELEMETRY,
     PYTHON_ENABLE_WORKER_EXTENSIONS,
     PYTHON_ENABLE_WORKER_EXTENSIONS_DEFAULT,
     PYTHON_ENABLE_WORKER_EXTENSIONS_DEFAULT_39,
+    PYTHON_FUNCTION_METADATA_CACHE_DIR,
+    PYTHON_GC_FREEZE_AFTER_LOAD,
+    PYTHON_GC_THRESHOLDS,
     PYTHON_ISOLATE_WORKER_DEPENDENCIES,
     PYTHON_ROLLBACK_CWD_PATH,
     PYTHON_SCRIPT_FILE_NAME,
+    PYTHON_SCRIPT_FILE_NAME_DEFAULT,
     PYTHON_THREADPOOL_THREAD_COUNT,
 )
+from .common import is_false_like, is_python_version, is_true_like
+
+
+class AppSettings(NamedTuple):
+    """
+    Immutable snapshot of the app settings, i.e. the environment variables
+    of the worker. The host only sets them when it starts the worker and on
+    placeholder specialization, so the worker takes a snapshot on init and
+    environment reload requests, instead of looking the environment up on
+    every request and invocation.
+
+    The settings the worker checks on its own are parsed once, when the
+    snapshot is taken, into the typed fields below; the others are read
+    with get, is_true and is_false.
+    """
+    settings: Mapping[str, str]
+    # Names of the settings whose value is true-like and false-like
+    true_settings: FrozenSet[str]
+    false_settings: FrozenSet[str]
+
+    # PYTHON_SCRIPT_FILE_NAME, not validated yet
+    script_file_name: str
+    enable_init_indexing: bool
+    enable_debug_logging: bool
+    enable_worker_extensions: bool
+    shared_memory_data_transfer_enabled: bool
+    # PYTHON_FUNCTION_METADATA_CACHE_DIR, None if unset or empty
+    function_metadata_cache_dir: Optional[str]
+    # Names of the functions set by PYTHON_COALESCED_FUNCTIONS
+    coalesced_functions: FrozenSet[str]
+    enable_gc_metrics: bool
+    enable_invocation_metrics: bool
+    gc_freeze_after_load: bool
+    # PYTHON_GC_THRESHOLDS, None if unset or invalid
+    gc_thresholds: Optional[Tuple[int, ...]]
+
+    @classmethod
+    def from_environ(cls) -> 'AppSettings':
+        settings = dict(os.environ)
+        true_settings = frozenset(
+            k for k, v in settings.items() if is_true_like(v))
+        false_settings = frozenset(
+            k for k, v in settings.items() if is_false_like(v))
+
+        worker_extensions_default = \
+            PYTHON_ENABLE_WORKER_EXTENSIONS_DEFAULT_39 \
+            if is_python_version('3.9') \
+            else PYTHON_ENABLE_WORKER_EXTENSIONS_DEFAULT
+        coalesced_functions = settings.get(PYTHON_COALESCED_FUNCTIONS, '')
+
+        return cls(
+            settings=MappingProxyType(settings),
+            true_settings=true_settings,
+            false_settings=false_settings,
+            script_file_name=settings.get(PYTHON_SCRIPT_FILE_NAME,
+                                          PYTHON_SCRIPT_FILE_NAME_DEFAULT),
+            enable_init_indexing=PYTHON_ENABLE_INIT_INDEXING in true_settings,
+            enable_debug_logging=PYTHON_ENABLE_DEBUG_LOGGING in true_settings,
+            enable_worker_extensions=(
+                PYTHON_ENABLE_WORKER_EXTENSIONS in true_settings
+                or (worker_extensions_default
+                    and PYTHON_ENABLE_WORKER_EXTENSIONS
+                    not in false_settings)),
+            shared_memory_data_transfer_enabled=(
+                FUNCTIONS_WORKER_SHARED_MEMORY_DATA_TRANSFER_ENABLED
+                in true_settings),
+            function_metadata_cache_dir=settings.get(
+                PYTHON_FUNCTION_METADATA_CACHE_DIR) or None,
+            coalesced_functions=frozenset(
+                name.strip() for name in coalesced_functions.split(',')
+                if name.strip()),
+            enable_gc_metrics=PYTHON_ENABLE_GC_METRICS in true_settings,
+            enable_invocation_metrics=(
+                PYTHON_ENABLE_INVOCATION_METRICS in true_settings),
+            gc_freeze_after_load=PYTHON_GC_FREEZE_AFTER_LOAD in true_settings,
+            gc_thresholds=_parse_gc_thresholds(
+                settings.get(PYTHON_GC_THRESHOLDS)))
+
+    def get(self, setting: str,
+            default_value: Optional[str] = None,
+            validator: Optional[Callable[[str], bool]] = None
+            ) -> Optional[str]:
+        """Same as utils.common.get_app_setting, from the snapshot."""
+        value = self.settings.get(setting)
+        if value is None:
+            return default_value
+        if validator is None or validator(value):
+            return value
+        return default_value
+
+    def is_true(self, setting: str) -> bool:
+        return setting in self.true_settings
+
+    def is_false(self, setting: str) -> bool:
+        return setting in self.false_settings
+
+
+def _parse_gc_thresholds(value: Optional[str]) -> Optional[Tuple[int, ...]]:
+    """Parses the generation thresholds of PYTHON_GC_THRESHOLDS (e.g.
+    "50000,20,100"), returns None if unset or invalid.
+    """
+    if value is None:
+        return None
+    thresholds = value.split(',')
+    if not 1 <= len(thresholds) <= 3 \
+            or not all(t.strip().isdigit() for t in thresholds):
+        return None
+    return tuple(int(t) for t in thresholds)
+
+
+_app_settings: Optional[AppSettings] = None
+
+
+def get_app_settings() -> AppSettings:
+    """Returns the current snapshot of the app settings, which is taken on
+    first use if the worker has not been initialized yet.
+    """
+    if _app_settings is None:
+        return reload_app_settings()
+    return _app_settings
+
+
+def reload_app_settings() -> AppSettings:
+    """Takes a new snapshot of the app settings, once the environment of the
+    worker is set (worker init and environment reload requests).
+    """
+    global _app_settings
+    _app_settings = AppSettings.from_environ()
+    return _app_settings
 
 
 def get_python_appsetting_state():
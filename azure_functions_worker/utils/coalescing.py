@@ -0,0 +1,61 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+
+class InvocationCoalescer:
+    """
+    Runs at most one invocation at a time for a given key: invocations
+    started with a key while another one with the same key is in flight wait
+    for the result (or exception) of that one instead of running themselves.
+    This is only correct for functions whose result depends on nothing but
+    their inputs, and which have no side effects.
+    """
+    def __init__(self):
+        self.leaders = 0
+        self.followers = 0
+        # key: coalescing key, val: result of the in-flight invocation
+        self._in_flight: Dict[Hashable, asyncio.Future] = {}
+
+    def __len__(self) -> int:
+        return len(self._in_flight)
+
+    @property
+    def coalesce_ratio(self) -> float:
+        """
+        Fraction of the invocations that reused the result of another one.
+        """
+        invocations = self.leaders + self.followers
+        return self.followers / invocations if invocations else 0.0
+
+    def is_in_flight(self, key: Hashable) -> bool:
+        return key in self._in_flight
+
+    async def run(self, key: Hashable,
+                  func: Callable[[], Awaitable[Any]]) -> Any:
+        future = self._in_flight.get(key)
+        if future is not None:
+            self.followers += 1
+            # A follower being cancelled must not cancel the leader
+            return await asyncio.shield(future)
+
+        self.leaders += 1
+        future = asyncio.get_event_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            result = await func()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # Mark the exception as retrieved in case there are no followers
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            del self._in_flight[key]
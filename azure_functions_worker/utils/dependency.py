@@ -1,12 +1,13 @@
 # Copyright (c) Microsoft Corporation. All rights reserved.
 # Licensed under the MIT License.
+import bisect
 import importlib.util
 import inspect
 import os
 import re
 import sys
 from types import ModuleType
-from typing import List, Optional
+from typing import Dict, List, Optional, Set, Tuple
 
 from azure_functions_worker.utils.common import is_envvar_true, is_true_like
 
@@ -20,6 +21,117 @@ from ..constants import (
 from ..logging import logger
 from ..utils.common import is_python_version
 from ..utils.wrappers import enable_feature_by
+from . import packages_bundle
+
+
+class ModuleLocationIndex:
+    """Index of the locations (__file__ and __path__ entries) of the modules
+    in sys.modules, sorted so that the modules imported from a given path
+    are found without going through every module.
+
+    The index is brought up to date with sys.modules on every lookup, which
+    only inspects the modules imported or removed since the previous one.
+    The locations of a regular module are read once, while those of a
+    namespace package, whose __path__ follows sys.path, are read on every
+    lookup.
+    """
+
+    def __init__(self):
+        self._builtin_module_names = frozenset(sys.builtin_module_names)
+        # key: module name, val: module object, including the ones which
+        # are not indexed (e.g. builtin modules)
+        self._modules: Dict[str, ModuleType] = {}
+        # Sorted (location, module name) of the regular modules
+        self._locations: List[Tuple[str, str]] = []
+        # Names of the namespace packages
+        self._dynamic_module_names: Set[str] = set()
+
+    def __len__(self) -> int:
+        return len(self._modules)
+
+    def get_module_names(self, path: str) -> Set[str]:
+        """Returns the names of the modules in sys.modules which have a
+        location starting with the given path.
+        """
+        self._update()
+        module_names = set()
+        i = bisect.bisect_left(self._locations, (path, ''))
+        while i < len(self._locations) and \
+                self._locations[i][0].startswith(path):
+            module_names.add(self._locations[i][1])
+            i += 1
+
+        for module_name in self._dynamic_module_names:
+            try:
+                module_paths = self._get_locations(self._modules[module_name])
+                if any(p.startswith(path) for p in module_paths):
+                    module_names.add(module_name)
+            except Exception as e:
+                logger.warning(
+                    'Attempt to remove module cache for %s but failed with '
+                    '%s. Using the original module cache.',
+                    module_name, e)
+        return module_names
+
+    def _update(self):
+        modules = sys.modules
+        try:
+            # Nothing imported or removed since the last update
+            if self._modules == modules:
+                return
+        except Exception:
+            # An object in sys.modules failed the comparison
+            pass
+
+        # Modules removed from sys.modules, or replaced by other objects
+        removed = {name for name, module in self._modules.items()
+                   if modules.get(name) is not module}
+        if removed:
+            for name in removed:
+                del self._modules[name]
+            self._dynamic_module_names -= removed
+            self._locations = [location for location in self._locations
+                               if location[1] not in removed]
+
+        added_locations: List[Tuple[str, str]] = []
+        for name in modules.keys() - self._modules.keys():
+            module = modules.get(name)
+            if module is not None:
+                self._add(name, module, added_locations)
+        if added_locations:
+            self._locations.extend(added_locations)
+            self._locations.sort()
+
+    def _add(self, name: str, module: ModuleType,
+             added_locations: List[Tuple[str, str]]):
+        self._modules[name] = module
+        # Don't reload azure_functions_worker
+        if not isinstance(module, ModuleType) \
+                or name in self._builtin_module_names \
+                or name.startswith('azure_functions_worker'):
+            return
+
+        # Module path can be actual file path or a pure namespace path.
+        # Both of these has the module path placed in __path__ property
+        # The property .__path__ can be None or does not exist in module
+        try:
+            if not isinstance(module.__dict__.get('__path__') or [], list):
+                raise TypeError('namespace package')
+            module_locations = self._get_locations(module)
+        except Exception:
+            self._dynamic_module_names.add(name)
+            return
+
+        added_locations.extend((location, name)
+                               for location in module_locations)
+
+    @staticmethod
+    def _get_locations(module: ModuleType) -> Set[str]:
+        module_dict = module.__dict__
+        module_paths = set(module_dict.get('__path__') or [])
+        if module_dict.get('__file__'):
+            module_paths.add(module_dict['__file__'])
+        return module_paths
 
 
 class DependencyManager:
@@ -64,6 +176,7 @@ class DependencyManager:
     cx_deps_path: str = ''
     cx_working_dir: str = ''
     worker_deps_path: str = ''
+    _module_location_index = ModuleLocationIndex()
 
     @classmethod
     def initialize(cls):
@@ -111,6 +224,7 @@ class DependencyManager:
                     ' working_directory: %s', cls.worker_deps_path,
                     cls.cx_deps_path, cls.cx_working_dir)
 
+        packages_bundle.remove_finders()
         cls._remove_from_sys_path(cls.cx_deps_path)
         cls._remove_from_sys_path(cls.cx_working_dir)
         cls._add_to_sys_path(cls.worker_deps_path, True)
@@ -163,6 +277,10 @@ class DependencyManager:
         cls._remove_from_sys_path(cls.worker_deps_path)
         cls._add_to_sys_path(cls.cx_deps_path, True)
 
+        # Import the pure Python packages of the customer's dependencies from
+        # their bundle if it was built (see packages_bundle)
+        packages_bundle.install_finder(cx_deps_path)
+
         # Deprioritize worker dependencies but don't completely remove it
         # Otherwise, it will break some really old function apps, those
         # don't have azure-functions module in .python_packages
@@ -368,8 +486,8 @@ class DependencyManager:
             os.path.join(os.path.dirname(__file__), '..', '..')
         )
 
-    @staticmethod
-    def _remove_module_cache(path: str):
+    @classmethod
+    def _remove_module_cache(cls, path: str):
         """Remove module cache if the module is imported from specific path.
         This will not impact builtin modules
 
@@ -381,31 +499,5 @@ class DependencyManager:
         if not path:
             return
 
-        not_builtin = set(sys.modules.keys()) - set(sys.builtin_module_names)
-
-        # Don't reload azure_functions_worker
-        to_be_cleared_from_cache = set([
-            module_name for module_name in not_builtin
-            if not module_name.startswith('azure_functions_worker')
-        ])
-
-        for module_name in to_be_cleared_from_cache:
-            module = sys.modules.get(module_name)
-            if not isinstance(module, ModuleType):
-                continue
-
-            # Module path can be actual file path or a pure namespace path.
-            # Both of these has the module path placed in __path__ property
-            # The property .__path__ can be None or does not exist in module
-            try:
-                module_paths = set(getattr(module, '__path__', None) or [])
-                if hasattr(module, '__file__') and module.__file__:
-                    module_paths.add(module.__file__)
-
-                if any([p for p in module_paths if p.startswith(path)]):
-                    sys.modules.pop(module_name)
-            except Exception as e:
-                logger.warning(
-                    'Attempt to remove module cache for %s but failed with '
-                    '%s. Using the original module cache.',
-                    module_name, e)
+        for module_name in cls._module_location_index.get_module_names(path):
+            sys.modules.pop(module_name, None)
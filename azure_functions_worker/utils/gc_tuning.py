@@ -0,0 +1,131 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+"""Tuning and instrumentation of the cyclic garbage collector.
+
+Once the function app is loaded, most objects of the worker live as long as
+the process (modules of the customer and of its packages, protobuf
+descriptors, ...), yet every full collection scans them again. Freezing them
+moves them to a permanent generation, which is never scanned.
+"""
+
+import asyncio
+import gc
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from ..logging import logger
+from .app_setting_manager import get_app_settings
+
+
+def is_tuning_enabled() -> bool:
+    return is_freeze_enabled() or get_thresholds() is not None
+
+
+def is_freeze_enabled() -> bool:
+    """Whether PYTHON_GC_FREEZE_AFTER_LOAD is set."""
+    return get_app_settings().gc_freeze_after_load
+
+
+def get_thresholds() -> Optional[Tuple[int, ...]]:
+    """Returns the generation thresholds set by PYTHON_GC_THRESHOLDS (e.g.
+    "50000,20,100"), or None if unset or invalid.
+    """
+    return get_app_settings().gc_thresholds
+
+
+def apply_tuning():
+    """Freezes the objects allocated so far and sets the generation
+    thresholds, as configured by the app settings.
+    """
+    freeze()
+    apply_thresholds()
+
+
+def freeze():
+    """Freezes the objects allocated so far if PYTHON_GC_FREEZE_AFTER_LOAD
+    is set. The full collection it starts with blocks the calling thread.
+    """
+    if not is_freeze_enabled():
+        return
+    start = time.perf_counter()
+    gc.collect()
+    gc.freeze()
+    logger.info('Froze %s objects in %.1f ms', gc.get_freeze_count(),
+                (time.perf_counter() - start) * 1000)
+
+
+def apply_thresholds():
+    """Sets the generation thresholds set by PYTHON_GC_THRESHOLDS, if any."""
+    thresholds = get_thresholds()
+    if thresholds is not None:
+        gc.set_threshold(*thresholds)
+        logger.info('Set garbage collection thresholds to %s',
+                    gc.get_threshold())
+
+
+class GcPauseMetrics:
+    """
+    Records the duration of the garbage collections (through gc.callbacks),
+    and passes the summary of their count and durations per generation to a
+    callback at regular intervals.
+    """
+    def __init__(self):
+        self._collection_start: Optional[float] = None
+        # key: generation, val: durations of its collections in seconds
+        self._pauses: Dict[int, List[float]] = {0: [], 1: [], 2: []}
+        self._report_handle: Optional[asyncio.TimerHandle] = None
+
+    def start(self, loop: asyncio.AbstractEventLoop, interval: float,
+              emit: Callable[[Dict[int, Dict[str, float]]], None]):
+        """Starts recording and reporting, unless already started."""
+        if self._report_handle is not None:
+            return
+        gc.callbacks.append(self._on_collection)
+        self._schedule_report(loop, interval, emit)
+
+    def stop(self):
+        if self._on_collection in gc.callbacks:
+            gc.callbacks.remove(self._on_collection)
+        if self._report_handle is not None:
+            self._report_handle.cancel()
+            self._report_handle = None
+
+    def get_summary(self) -> Dict[int, Dict[str, float]]:
+        """Returns the count, total, maximum and 99th percentile of the
+        durations (in milliseconds) of the collections of each generation
+        since the last report.
+        """
+        summary = {}
+        for generation, pauses in self._pauses.items():
+            pauses = sorted(pauses)
+            summary[generation] = {
+                'count': len(pauses),
+                'total_ms': sum(pauses) * 1000,
+                'max_ms': pauses[-1] * 1000 if pauses else 0.0,
+                'p99_ms': pauses[int(len(pauses) * 0.99)] * 1000
+                if pauses else 0.0
+            }
+        return summary
+
+    def report(self, emit: Callable[[Dict[int, Dict[str, float]]], None]):
+        summary = self.get_summary()
+        self._pauses = {generation: [] for generation in self._pauses}
+        if any(s['count'] for s in summary.values()):
+            emit(summary)
+
+    def _schedule_report(self, loop: asyncio.AbstractEventLoop,
+                         interval: float, emit: Callable):
+        def report_and_reschedule():
+            self.report(emit)
+            self._schedule_report(loop, interval, emit)
+
+        self._report_handle = loop.call_later(interval, report_and_reschedule)
+
+    def _on_collection(self, phase: str, info: Dict[str, int]):
+        # Collections do not overlap: they run while holding the GIL
+        if phase == 'start':
+            self._collection_start = time.perf_counter()
+        elif self._collection_start is not None:
+            self._pauses[info['generation']].append(
+                time.perf_counter() - self._collection_start)
+            self._collection_start = None
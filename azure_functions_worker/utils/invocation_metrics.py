@@ -0,0 +1,200 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+"""Breakdown of the latency of the invocations, per function.
+
+Each invocation dispatched from the gRPC stream gets an InvocationTimer,
+available to the code running in its task through get_current_timer(), which
+measures how long it spends in each of PHASES. Once its response is written
+to the stream, the durations are added to histograms with fixed buckets,
+reported at regular intervals.
+"""
+
+import asyncio
+import bisect
+import contextvars
+import threading
+import time
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+# Phases of an invocation, in order. SHARED_MEMORY is the part of INPUT_DECODE
+# and OUTPUT_ENCODE spent reading and writing shared memory maps.
+QUEUED = 0  # From its receipt by the gRPC thread until its task runs
+INPUT_DECODE = 1
+THREAD_POOL_WAIT = 2  # Sync functions only
+USER_CODE = 3  # Including the extension hooks
+OUTPUT_ENCODE = 4
+SHARED_MEMORY = 5
+RESPONSE_WRITE = 6  # From the end of the task until written to the stream
+PHASES = ('queued', 'input_decode', 'thread_pool_wait', 'user_code',
+          'output_encode', 'shared_memory', 'response_write')
+
+# Upper bounds of the buckets of the histograms, in milliseconds
+BUCKET_BOUNDS_MS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250,
+                    500, 1000, 2500, 5000, 10000, float('inf'))
+
+_current_timer: contextvars.ContextVar = contextvars.ContextVar(
+    'invocation_timer', default=None)
+
+
+def get_current_timer() -> Optional['InvocationTimer']:
+    """Returns the timer of the invocation run by the current task, or None
+    if invocation metrics are disabled.
+    """
+    return _current_timer.get()
+
+
+def add_to_current_timer(phase: int, seconds: float):
+    timer = _current_timer.get()
+    if timer is not None:
+        timer.durations[phase] += seconds
+
+
+class InvocationTimer:
+    """
+    Durations of the phases of an invocation. Only one thread at a time
+    touches it: the gRPC thread, the event loop, then a thread of the
+    synchronous thread pool, the event loop again and the gRPC thread.
+    """
+    __slots__ = ('function_name', 'coalesced', 'durations', '_mark')
+
+    def __init__(self, received_at: float):
+        self.function_name: Optional[str] = None
+        # Whether the invocation waited for the result of an identical one
+        # instead of running the function
+        self.coalesced = False
+        # Seconds spent in each of PHASES
+        self.durations: List[float] = [0.0] * len(PHASES)
+        self._mark = received_at
+
+    def mark(self):
+        """Starts the next phase now."""
+        self._mark = time.perf_counter()
+
+    def lap(self, phase: int):
+        """Ends the phase, which started at the previous mark or lap."""
+        now = time.perf_counter()
+        self.durations[phase] += now - self._mark
+        self._mark = now
+
+
+class TimedMessage(NamedTuple):
+    """A response to write to the gRPC stream along with the timer of its
+    invocation, to be recorded once it is written.
+    """
+    message: object
+    timer: InvocationTimer
+
+
+class Histogram:
+    __slots__ = ('counts', 'count', 'total_ms', 'max_ms')
+
+    def __init__(self):
+        self.counts = [0] * len(BUCKET_BOUNDS_MS)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def add(self, value_ms: float):
+        self.counts[bisect.bisect_left(BUCKET_BOUNDS_MS, value_ms)] += 1
+        self.count += 1
+        self.total_ms += value_ms
+        if value_ms > self.max_ms:
+            self.max_ms = value_ms
+
+    def get_percentile(self, percentile: float) -> float:
+        """Returns the upper bound of the bucket of the percentile, or the
+        maximum if lower.
+        """
+        rank = self.count * percentile
+        seen = 0
+        for bound, count in zip(BUCKET_BOUNDS_MS, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max_ms)
+        return self.max_ms
+
+
+class InvocationMetrics:
+    """
+    Aggregates the timers of the invocations into a histogram per function
+    and phase, and passes their summary to a callback at regular intervals.
+    """
+    def __init__(self):
+        self.enabled = False
+        # key: function name, val: histogram of each of PHASES
+        self._histograms: Dict[str, List[Histogram]] = {}
+        # Timers are recorded from the gRPC thread, reported from the loop
+        self._lock = threading.Lock()
+        self._report_handle: Optional[asyncio.TimerHandle] = None
+
+    def start(self, loop: asyncio.AbstractEventLoop, interval: float,
+              emit: Callable[[Dict[str, Dict[str, Dict[str, float]]]], None]):
+        """Starts reporting, unless already started."""
+        if self.enabled:
+            return
+        self.enabled = True
+        self._schedule_report(loop, interval, emit)
+
+    def stop(self):
+        self.enabled = False
+        if self._report_handle is not None:
+            self._report_handle.cancel()
+            self._report_handle = None
+
+    def start_timer(self, received_at: float) -> InvocationTimer:
+        """Creates the timer of the invocation run by the current task."""
+        timer = InvocationTimer(received_at)
+        timer.lap(QUEUED)
+        _current_timer.set(timer)
+        return timer
+
+    def record(self, timer: InvocationTimer):
+        if timer.function_name is None or timer.coalesced:
+            # The invocation failed before its function was found, or did not
+            # run it and would only lower its durations
+            return
+        with self._lock:
+            histograms = self._histograms.get(timer.function_name)
+            if histograms is None:
+                histograms = [Histogram() for _ in PHASES]
+                self._histograms[timer.function_name] = histograms
+            # Histogram.add inlined, this runs for every invocation
+            for histogram, duration in zip(histograms, timer.durations):
+                value_ms = duration * 1000
+                histogram.counts[bisect.bisect_left(BUCKET_BOUNDS_MS,
+                                                    value_ms)] += 1
+                histogram.count += 1
+                histogram.total_ms += value_ms
+                if value_ms > histogram.max_ms:
+                    histogram.max_ms = value_ms
+
+    def get_summary(self) -> Dict[str, Dict[str, Dict[str, float]]]:
+        """Returns the count, mean, 50th and 99th percentile and maximum of
+        the durations (in milliseconds) of each phase of the invocations of
+        each function since the last report, by function and phase name.
+        """
+        with self._lock:
+            histograms, self._histograms = self._histograms, {}
+        return {
+            function_name: {
+                phase: {
+                    'count': h.count,
+                    'mean_ms': h.total_ms / h.count,
+                    'p50_ms': h.get_percentile(0.5),
+                    'p99_ms': h.get_percentile(0.99),
+                    'max_ms': h.max_ms
+                }
+                for phase, h in zip(PHASES, function_histograms)
+            }
+            for function_name, function_histograms in histograms.items()
+        }
+
+    def _schedule_report(self, loop: asyncio.AbstractEventLoop,
+                         interval: float, emit: Callable):
+        def report_and_reschedule():
+            summary = self.get_summary()
+            if summary:
+                emit(summary)
+            self._schedule_report(loop, interval, emit)
+
+        self._report_handle = loop.call_later(interval, report_and_reschedule)
@@ -0,0 +1,236 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+"""Import bundle of the customer's site-packages.
+
+When the customer's site-packages directory sits on a network file share
+(e.g. /home/site/wwwroot on Linux Consumption and Premium), importing its
+packages takes thousands of stat and open calls, each of them a round trip.
+A bundle is a zip archive of the pure Python packages of site-packages with
+precompiled bytecode, built next to it (site-packages.zip). The archive is
+read into memory in one go, and its modules are loaded from there.
+
+Packages containing anything else than Python files (extension modules, data
+files) are left out of the bundle, as are namespace packages, and are still
+imported from site-packages. The directory also stays on sys.path for package
+metadata (.dist-info).
+
+The bundle records the entries of site-packages it was built from and is
+ignored once they change, e.g. when a package is added or upgraded.
+"""
+
+import importlib.abc
+import importlib.machinery
+import importlib.util
+import io
+import json
+import marshal
+import os
+import py_compile
+import sys
+import tempfile
+import zipfile
+from typing import FrozenSet, List, Optional
+
+from ..constants import CUSTOMER_PACKAGES_BUNDLE_SUFFIX
+from ..logging import logger
+
+_MANIFEST_NAME = '.bundle-manifest.json'
+_BUNDLED_FILE_SUFFIXES = ('.py', '.pyi', 'py.typed')
+# Header of the bytecode built for the bundle: magic number, flags (hash
+# based, unchecked) and source hash
+_PYC_HEADER_SIZE = 16
+_PYC_FLAGS_UNCHECKED_HASH = (1).to_bytes(4, 'little')
+
+
+class PackagesBundleFinder(importlib.abc.MetaPathFinder,
+                           importlib.abc.InspectLoader):
+    """Finds and loads the modules of a bundle, read into memory at once.
+    Modules not part of the bundle are left to the next finders.
+    """
+
+    def __init__(self, bundle_path: str, bundle: zipfile.ZipFile,
+                 top_level_names: FrozenSet[str]):
+        self.bundle_path = bundle_path
+        self.top_level_names = top_level_names
+        self._bundle = bundle
+        self._file_names = frozenset(self._bundle.namelist())
+
+    def find_spec(self, fullname, path=None, target=None):
+        if fullname.partition('.')[0] not in self.top_level_names:
+            return None
+        module_path = fullname.replace('.', '/')
+        if f'{module_path}/__init__.py' in self._file_names:
+            file_name = f'{module_path}/__init__.py'
+            is_package = True
+        elif f'{module_path}.py' in self._file_names:
+            file_name = f'{module_path}.py'
+            is_package = False
+        else:
+            return None
+
+        spec = importlib.machinery.ModuleSpec(
+            fullname, self, origin=self._get_path(file_name),
+            is_package=is_package)
+        spec.has_location = True
+        if is_package:
+            spec.submodule_search_locations = [self._get_path(module_path)]
+        return spec
+
+    def is_package(self, fullname):
+        return f'{fullname.replace(".", "/")}/__init__.py' in \
+            self._file_names
+
+    def get_source(self, fullname):
+        file_name = self._get_file_name(fullname)
+        return importlib.util.decode_source(self._bundle.read(file_name))
+
+    def get_code(self, fullname):
+        file_name = self._get_file_name(fullname)
+        pyc_name = file_name + 'c'
+        if pyc_name in self._file_names:
+            data = self._bundle.read(pyc_name)
+            # Bytecode of another Python version is ignored
+            if data[:4] == importlib.util.MAGIC_NUMBER and \
+                    data[4:8] == _PYC_FLAGS_UNCHECKED_HASH:
+                return marshal.loads(data[_PYC_HEADER_SIZE:])
+        return compile(self._bundle.read(file_name),
+                       self._get_path(file_name), 'exec', dont_inherit=True)
+
+    def _get_file_name(self, fullname: str) -> str:
+        module_path = fullname.replace('.', '/')
+        if self.is_package(fullname):
+            return f'{module_path}/__init__.py'
+        return f'{module_path}.py'
+
+    def _get_path(self, file_name: str) -> str:
+        return os.path.join(self.bundle_path, *file_name.split('/'))
+
+
+def get_bundle_path(site_packages_dir: str) -> str:
+    return os.path.normpath(site_packages_dir) + \
+        CUSTOMER_PACKAGES_BUNDLE_SUFFIX
+
+
+def install_finder(site_packages_dir: str) -> Optional[PackagesBundleFinder]:
+    """Installs a finder for the bundle of the given site-packages directory,
+    replacing any installed before. Returns None if there is no up to date
+    bundle.
+    """
+    remove_finders()
+    if not site_packages_dir:
+        return None
+    bundle_path = get_bundle_path(site_packages_dir)
+    if not os.path.isfile(bundle_path):
+        return None
+
+    try:
+        # A single read, instead of one per imported file
+        with open(bundle_path, 'rb') as f:
+            bundle = zipfile.ZipFile(io.BytesIO(f.read()))
+        manifest = json.loads(bundle.read(_MANIFEST_NAME))
+        entries = _list_entries(site_packages_dir)
+    except (OSError, KeyError, ValueError, zipfile.BadZipFile) as e:
+        logger.warning('Cannot read packages bundle %s - %s', bundle_path, e)
+        return None
+
+    if manifest['entries'] != entries:
+        logger.warning('Ignoring packages bundle %s: %s has changed since it '
+                       'was built', bundle_path, site_packages_dir)
+        return None
+
+    finder = PackagesBundleFinder(bundle_path, bundle,
+                                  frozenset(manifest['top_level_names']))
+    # Ahead of the path based finder, behind the built-in and frozen ones
+    sys.meta_path.insert(_get_path_finder_index(), finder)
+    logger.info('Importing %s packages from bundle %s',
+                len(finder.top_level_names), bundle_path)
+    return finder
+
+
+def remove_finders():
+    sys.meta_path[:] = [f for f in sys.meta_path
+                        if not isinstance(f, PackagesBundleFinder)]
+
+
+def build(site_packages_dir: str) -> List[str]:
+    """Builds the bundle of the given site-packages directory, and returns
+    the names of the top level modules and packages it contains.
+    """
+    entries = _list_entries(site_packages_dir)
+    top_level_names = []
+    bundle_path = get_bundle_path(site_packages_dir)
+    with tempfile.TemporaryDirectory() as tmp_dir, \
+            zipfile.ZipFile(bundle_path, 'w', zipfile.ZIP_DEFLATED) as bundle:
+        for entry in entries:
+            entry_path = os.path.join(site_packages_dir, entry)
+            if os.path.isdir(entry_path):
+                files = _get_package_files(entry_path)
+                if files is None:
+                    continue
+            elif entry.endswith('.py'):
+                files = [entry_path]
+            else:
+                continue
+            for file_path in files:
+                _add_file(bundle, bundle_path, tmp_dir, file_path,
+                          os.path.relpath(file_path, site_packages_dir))
+            top_level_names.append(os.path.splitext(entry)[0])
+
+        bundle.writestr(_MANIFEST_NAME, json.dumps({
+            'entries': entries,
+            'top_level_names': top_level_names}))
+    return top_level_names
+
+
+def _list_entries(site_packages_dir: str) -> List[str]:
+    return sorted(e for e in os.listdir(site_packages_dir)
+                  if e != '__pycache__')
+
+
+def _get_path_finder_index() -> int:
+    for i, finder in enumerate(sys.meta_path):
+        if finder is importlib.machinery.PathFinder:
+            return i
+    return len(sys.meta_path)
+
+
+def _get_package_files(package_dir: str) -> Optional[List[str]]:
+    """Returns the files of a regular package made of Python files only, or
+    None for any other directory.
+    """
+    if not os.path.isfile(os.path.join(package_dir, '__init__.py')):
+        return None
+    files = []
+    for root, dir_names, file_names in os.walk(package_dir):
+        dir_names[:] = sorted(d for d in dir_names if d != '__pycache__')
+        for file_name in sorted(file_names):
+            if not file_name.endswith(_BUNDLED_FILE_SUFFIXES):
+                return None
+            files.append(os.path.join(root, file_name))
+    return files
+
+
+def _add_file(bundle: zipfile.ZipFile, bundle_path: str, tmp_dir: str,
+              file_path: str, arc_name: str):
+    arc_name = arc_name.replace(os.sep, '/')
+    bundle.write(file_path, arc_name)
+    if not arc_name.endswith('.py'):
+        return
+    # Unchecked hash based bytecode, which does not depend on timestamps
+    pyc_path = os.path.join(tmp_dir, 'module.pyc')
+    try:
+        py_compile.compile(
+            file_path, cfile=pyc_path,
+            dfile=os.path.join(bundle_path, arc_name), doraise=True,
+            invalidation_mode=py_compile.PycInvalidationMode.UNCHECKED_HASH)
+    except py_compile.PyCompileError as e:
+        logger.warning('Cannot compile %s - %s', file_path, e.msg)
+        return
+    bundle.write(pyc_path, arc_name + 'c')
+
+
+if __name__ == '__main__':
+    for path in sys.argv[1:]:
+        names = build(path)
+        print(f'Bundled {len(names)} packages of {path} in '
+              f'{get_bundle_path(path)}')
@@ -0,0 +1,220 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+"""Sampling profiler of the worker, for diagnosing CPU hotspots in production.
+
+When PYTHON_PROFILER_OUTPUT_DIR is set, a thread samples the stacks of all the
+other threads (event loop, synchronous thread pool, gRPC thread, ...) at
+a fixed rate for a bounded duration, then writes them in the collapsed stack
+format (one "frame;frame;... count" line per stack), which flame graph tools
+and speedscope read. Nothing runs when it is not set.
+"""
+
+import math
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from types import CodeType, FrameType
+from typing import Dict, Optional
+
+from ..constants import (
+    PYTHON_PROFILER_DURATION_SECONDS,
+    PYTHON_PROFILER_DURATION_SECONDS_DEFAULT,
+    PYTHON_PROFILER_DURATION_SECONDS_MAX,
+    PYTHON_PROFILER_OUTPUT_DIR,
+    PYTHON_PROFILER_SAMPLING_RATE,
+    PYTHON_PROFILER_SAMPLING_RATE_DEFAULT,
+    PYTHON_PROFILER_SAMPLING_RATE_MAX,
+)
+from ..logging import logger
+from .app_setting_manager import get_app_settings
+
+# Root frame of the samples taken outside of any invocation
+NO_FUNCTION = 'function:-'
+
+# Interval at which the samples taken so far are written, so that they are
+# not lost when the worker is killed (e.g. SIGTERM on scale in)
+WRITE_INTERVAL_SECONDS = 10
+
+# Frames of the dispatcher running an invocation, with the local variable
+# from which the name of the invoked function is read
+_INVOCATION_FRAMES = {
+    '_handle__invocation_request': ('fi', 'name'),
+    '_run_sync_func': ('context', 'function_name'),
+    '_run_async_func': ('context', 'function_name'),
+}
+_DISPATCHER_FILE = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    'dispatcher.py')
+
+
+class SamplingProfiler:
+    """
+    Samples the stacks of all the threads of the worker, except its own, in
+    a daemon thread. Each stack is tagged with the function invoked by its
+    thread, if any, and the name of the thread, as its first two frames.
+    """
+    def __init__(self, output_dir: str, sampling_rate: float,
+                 duration: float):
+        self._output_dir = output_dir
+        self._interval = 1 / sampling_rate
+        self._duration = duration
+        # key: (function name, thread name, code objects of the stack from
+        # the innermost frame), val: sample count. Stacks are only formatted
+        # when written, to keep sampling cheap.
+        self._samples: Counter = Counter()
+        self._sample_count = 0
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(
+            name='sampling-profiler', target=self._run, daemon=True)
+        self.output_path: Optional[str] = None
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        """Stops sampling early, and waits for the samples to be written."""
+        self._stop_event.set()
+        if self._thread.is_alive():
+            self._thread.join()
+
+    def is_running(self) -> bool:
+        return self._thread.is_alive()
+
+    def sample(self):
+        thread_names = {t.ident: t.name for t in threading.enumerate()}
+        own_ident = threading.get_ident()
+        for ident, frame in sys._current_frames().items():
+            if ident == own_ident:
+                continue
+            codes = []
+            function_name = None
+            while frame is not None:
+                code = frame.f_code
+                codes.append(code)
+                if function_name is None \
+                        and code.co_name in _INVOCATION_FRAMES:
+                    function_name = self._get_function_name(frame)
+                frame = frame.f_back
+            self._samples[(function_name,
+                           thread_names.get(ident, str(ident)),
+                           tuple(codes))] += 1
+        self._sample_count += 1
+
+    def write(self) -> str:
+        """Writes the samples taken so far, replacing those written before."""
+        if self.output_path is None:
+            os.makedirs(self._output_dir, exist_ok=True)
+            self.output_path = os.path.join(
+                self._output_dir,
+                f'profile-{os.getpid()}-{time.strftime("%Y%m%d-%H%M%S")}'
+                '.collapsed')
+        # key: code object, val: its frame in the collapsed stacks
+        frame_names: Dict[CodeType, str] = {}
+        # Written aside then renamed, so that the file is never truncated
+        tmp_path = f'{self.output_path}.tmp'
+        with open(tmp_path, 'w') as f:
+            for (function_name, thread_name, codes), count in \
+                    self._samples.most_common():
+                stack = [NO_FUNCTION if function_name is None
+                         else f'function:{function_name}', thread_name]
+                for code in reversed(codes):
+                    name = frame_names.get(code)
+                    if name is None:
+                        name = frame_names[code] = self._get_frame_name(code)
+                    stack.append(name)
+                f.write(f'{";".join(stack)} {count}\n')
+        os.replace(tmp_path, self.output_path)
+        return self.output_path
+
+    def _run(self):
+        start = time.perf_counter()
+        deadline = start + self._duration
+        next_sample = start
+        next_write = start + WRITE_INTERVAL_SECONDS
+        while not self._stop_event.is_set():
+            now = time.perf_counter()
+            if now >= deadline:
+                break
+            if now >= next_write:
+                self._try_write()
+                next_write = time.perf_counter() + WRITE_INTERVAL_SECONDS
+                continue
+            if now >= next_sample:
+                self.sample()
+                next_sample += self._interval
+                # Skip the samples missed while the GIL was held elsewhere
+                if next_sample < now:
+                    next_sample = now + self._interval
+                continue
+            self._stop_event.wait(min(next_sample, next_write) - now)
+
+        if self._try_write():
+            logger.info('Sampling profiler took %s samples in %.1f s, '
+                        'written to %s', self._sample_count,
+                        time.perf_counter() - start, self.output_path)
+
+    def _try_write(self) -> bool:
+        try:
+            self.write()
+            return True
+        except Exception:
+            logger.exception('Failed to write the samples of the sampling '
+                             'profiler to %s', self._output_dir)
+            return False
+
+    @staticmethod
+    def _get_frame_name(code: CodeType) -> str:
+        # ';' separates the frames of collapsed stacks
+        return f'{code.co_name} ({code.co_filename}:' \
+               f'{code.co_firstlineno})'.replace(';', ':')
+
+    @staticmethod
+    def _get_function_name(frame: FrameType) -> Optional[str]:
+        code = frame.f_code
+        if code.co_filename != _DISPATCHER_FILE:
+            return None
+        local_name, attr = _INVOCATION_FRAMES[code.co_name]
+        return getattr(frame.f_locals.get(local_name), attr, None)
+
+
+def start_from_app_settings() -> Optional[SamplingProfiler]:
+    """Starts a sampling profiler if PYTHON_PROFILER_OUTPUT_DIR is set."""
+    app_settings = get_app_settings()
+    output_dir = app_settings.get(PYTHON_PROFILER_OUTPUT_DIR)
+    if not output_dir:
+        return None
+
+    def get_positive_number(setting: str, default_value: float,
+                            max_value: float) -> float:
+        def validator(value: str) -> bool:
+            try:
+                number = float(value)
+                if math.isfinite(number) and number > 0:
+                    return True
+            except ValueError:
+                pass
+            logger.warning('%s must be a positive number', setting)
+            return False
+
+        number = float(app_settings.get(setting=setting,
+                                        default_value=f'{default_value}',
+                                        validator=validator))
+        if number > max_value:
+            logger.warning('%s is capped at %s', setting, max_value)
+            return max_value
+        return number
+
+    sampling_rate = get_positive_number(PYTHON_PROFILER_SAMPLING_RATE,
+                                        PYTHON_PROFILER_SAMPLING_RATE_DEFAULT,
+                                        PYTHON_PROFILER_SAMPLING_RATE_MAX)
+    duration = get_positive_number(PYTHON_PROFILER_DURATION_SECONDS,
+                                   PYTHON_PROFILER_DURATION_SECONDS_DEFAULT,
+                                   PYTHON_PROFILER_DURATION_SECONDS_MAX)
+
+    profiler = SamplingProfiler(output_dir, sampling_rate, duration)
+    profiler.start()
+    logger.info('Started sampling profiler at %s Hz for %s s', sampling_rate,
+                duration)
+    return profiler
@@ -0,0 +1,44 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+import contextlib
+import time
+from typing import List, NamedTuple
+
+from ..logging import logger
+
+
+class Step(NamedTuple):
+    name: str
+    # Seconds since the start of the timeline
+    start: float
+    end: float
+
+
+class StepTimeline:
+    """
+    Records when the steps of a request (e.g. placeholder specialization)
+    start and end, and logs them so that the slow steps of the request can
+    be read.
+    """
+    def __init__(self, name: str):
+        self._name = name
+        self._start = time.perf_counter()
+        self._steps: List[Step] = []
+
+    @contextlib.contextmanager
+    def step(self, name: str):
+        start = time.perf_counter() - self._start
+        try:
+            yield
+        finally:
+            self._steps.append(Step(name, start,
+                                    time.perf_counter() - self._start))
+
+    def get_steps(self) -> List[Step]:
+        return list(self._steps)
+
+    def log(self):
+        logger.info('%s timeline (%.1f ms): %s', self._name,
+                    (time.perf_counter() - self._start) * 1000, ', '.join(
+                        f'{s.name} {s.start * 1000:.1f}-{s.end * 1000:.1f} ms'
+                        for s in self._steps))
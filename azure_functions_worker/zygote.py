@@ -0,0 +1,513 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+"""Zygote mode, for function apps running several worker processes.
+
+With FUNCTIONS_WORKER_PROCESS_COUNT > 1, each worker process started by the
+host would import the worker (grpc, protobuf), switch to the customer's
+dependencies and import the function app on its own. In zygote mode, the
+first worker process forks a zygote, which does all of this once, moves its
+objects out of reach of the garbage collector (gc.freeze) so that their pages
+stay shared, and waits for the worker processes started by the host to
+connect to it.
+
+The zygote listens on an abstract Unix socket, which has no file permissions:
+it only serves processes of the same user which were started by the same host
+process as the first worker process (checked with SO_PEERCRED), and the worker
+processes only connect to a zygote of the same user.
+
+For each of them, the zygote forks a process which runs the worker with the
+arguments (worker id, request id, ...), environment, working directory and
+standard streams of the worker process started by the host. The latter stays
+around as a lightweight launcher: it forwards SIGINT and SIGTERM to the forked
+process, and exits with its exit code. The forked process exits when its
+launcher does (e.g. when killed by the host).
+
+When the zygote cannot be reached, the worker runs in the process started by
+the host, as without zygote mode. This is also the case when the function app
+starts threads while it is preloaded, since they would not run in the forked
+processes. The zygote stops forking once the worker process which started it
+exits, or once a worker process it forked is specialized (its environment
+reloaded), since its preloaded function app no longer matches the settings.
+"""
+
+import array
+import gc
+import importlib
+import json
+import os
+import selectors
+import signal
+import socket
+import struct
+import sys
+import threading
+import traceback
+import zlib
+from typing import Dict, List, Optional, Tuple
+
+from .constants import (
+    AZURE_WEBJOBS_SCRIPT_ROOT,
+    FUNCTIONS_WORKER_PROCESS_COUNT,
+    PYTHON_ENABLE_WORKER_ZYGOTE,
+    PYTHON_SCRIPT_FILE_NAME,
+    PYTHON_SCRIPT_FILE_NAME_DEFAULT,
+)
+from .utils.common import get_app_setting, is_envvar_true
+from .version import VERSION
+
+_STANDARD_STREAMS = (0, 1, 2)
+_INT = struct.Struct('!i')
+_FORWARDED_SIGNALS = (signal.SIGINT, signal.SIGTERM)
+# Sent by a forked worker process to its zygote to stop forking
+_STOP_SIGNAL = signal.SIGUSR1
+_PEER_CREDENTIALS = struct.Struct('3i')  # struct ucred: pid, uid, gid
+
+# Whether the zygote switched to the customer's dependencies, which the worker
+# processes it forks must not do again
+_customer_dependencies_prioritized = False
+# The zygote the worker process was forked from, if any
+_zygote_pid: Optional[int] = None
+
+
+def is_enabled() -> bool:
+    if not is_envvar_true(PYTHON_ENABLE_WORKER_ZYGOTE) \
+            or not sys.platform.startswith('linux'):
+        return False
+    process_count = get_app_setting(setting=FUNCTIONS_WORKER_PROCESS_COUNT,
+                                    default_value='1',
+                                    validator=str.isdigit)
+    return int(process_count) > 1
+
+
+def is_customer_dependencies_prioritized() -> bool:
+    return _customer_dependencies_prioritized
+
+
+def stop_forking():
+    """Asks the zygote the worker process was forked from, if any, to stop
+    forking worker processes, e.g. when the function app is specialized.
+    """
+    if _zygote_pid is None:
+        return
+    try:
+        os.kill(_zygote_pid, _STOP_SIGNAL)
+    except ProcessLookupError:
+        pass
+
+
+def get_address(host: str, port: int) -> str:
+    """Returns the (abstract) socket address of the zygote of the given host
+    and function app.
+    """
+    # Not hashlib, which takes a few MB in each launcher
+    key = '\n'.join((sys.executable, VERSION,
+                     os.getenv(AZURE_WEBJOBS_SCRIPT_ROOT, '')))
+    return f'\0azure-functions-python-zygote-{host}-{port}-' \
+        f'{zlib.crc32(key.encode()):08x}'
+
+
+def run_worker(args) -> Optional[int]:
+    """Runs the worker in a process forked by the zygote, starting the zygote
+    if needed, and waits for it to exit.
+
+    Returns the exit code of the worker, or None if the zygote cannot fork it,
+    in which case the worker should run in this process.
+    """
+    address = get_address(args.host, args.port)
+    conn = _connect(address)
+    if conn is None:
+        _start_zygote(address, args)
+        conn = _connect(address)
+        if conn is None:
+            return None
+
+    with conn:
+        try:
+            pid = _request_worker(conn)
+        except (OSError, EOFError):
+            return None
+        if pid <= 0:
+            return None
+        return _wait_worker(conn, pid)
+
+
+def _connect(address: str) -> Optional[socket.socket]:
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        conn.connect(address)
+        _, uid, _ = _get_peer_credentials(conn)
+    except OSError:
+        conn.close()
+        return None
+    if uid != os.getuid():
+        # The address was taken by a process of another user, which must not
+        # get the standard streams and environment of the worker
+        conn.close()
+        return None
+    return conn
+
+
+def _get_peer_credentials(conn: socket.socket) -> Tuple[int, int, int]:
+    """Returns the pid, uid and gid of the process at the other end of the
+    given Unix socket connection.
+    """
+    return _PEER_CREDENTIALS.unpack(conn.getsockopt(
+        socket.SOL_SOCKET, socket.SO_PEERCRED, _PEER_CREDENTIALS.size))
+
+
+def _get_parent_pid(pid: int) -> Optional[int]:
+    try:
+        with open(f'/proc/{pid}/stat', 'rb') as f:
+            stat = f.read()
+    except OSError:
+        return None
+    # The command name, in parentheses, may contain spaces and parentheses
+    return int(stat[stat.rindex(b')') + 1:].split()[1])
+
+
+def _request_worker(conn: socket.socket) -> int:
+    request = json.dumps({'argv': sys.argv,
+                          'cwd': os.getcwd(),
+                          'env': dict(os.environ)}).encode()
+    conn.sendmsg([_INT.pack(len(request))],
+                 [(socket.SOL_SOCKET, socket.SCM_RIGHTS,
+                   array.array('i', _STANDARD_STREAMS))])
+    conn.sendall(request)
+    return _recv_int(conn)
+
+
+def _wait_worker(conn: socket.socket, pid: int) -> int:
+    def forward_signal(signum, frame):
+        try:
+            os.kill(pid, signum)
+        except ProcessLookupError:
+            pass
+
+    handlers = {signum: signal.signal(signum, forward_signal)
+                for signum in _FORWARDED_SIGNALS}
+    try:
+        return _recv_int(conn)
+    except (OSError, EOFError):
+        # The zygote exited without reporting the exit code of the worker
+        return 1
+    finally:
+        for signum, handler in handlers.items():
+            signal.signal(signum, handler)
+
+
+def _recv_exactly(conn: socket.socket, size: int) -> bytes:
+    data = b''
+    while len(data) < size:
+        chunk = conn.recv(size - len(data))
+        if not chunk:
+            raise EOFError
+        data += chunk
+    return data
+
+
+def _recv_int(conn: socket.socket) -> int:
+    return _INT.unpack(_recv_exactly(conn, _INT.size))[0]
+
+
+def _start_zygote(address: str, args):
+    """Forks the zygote, and waits for it to listen on the given address,
+    unless another worker process started one first.
+    """
+    ready_fd, ready_write_fd = os.pipe()
+    host_pid = os.getppid()
+    sys.stdout.flush()
+    sys.stderr.flush()
+    pid = os.fork()
+    if pid == 0:
+        os.close(ready_fd)
+        exit_code = 1
+        try:
+            exit_code = _Zygote(address, args, host_pid).run(ready_write_fd)
+        except BaseException:
+            traceback.print_exc()
+        finally:
+            os._exit(exit_code)
+
+    os.close(ready_write_fd)
+    with open(ready_fd, 'rb') as ready:
+        if not ready.read():
+            os.waitpid(pid, 0)
+
+
+class _Zygote:
+
+    def __init__(self, address: str, args, host_pid: int):
+        self._address = address
+        self._args = args
+        # Only the worker processes started by this process are served
+        self._host_pid = host_pid
+        self._uid = os.getuid()
+        self._stop_requested = False
+        # Imported here, as the launchers do not log
+        from .logging import logger
+        self._logger = logger
+        self._listener: Optional[socket.socket] = None
+        self._selector: Optional[selectors.BaseSelector] = None
+        self._wakeup_fds: Tuple[int, ...] = ()
+        # Connection to the launcher of each forked worker, by pid
+        self._workers: Dict[int, socket.socket] = {}
+
+    def run(self, ready_fd: int) -> int:
+        self._listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self._listener.bind(self._address)
+        except OSError:
+            # Another worker process started a zygote first
+            return 0
+        self._listener.listen()
+        os.write(ready_fd, b'1')
+        os.close(ready_fd)
+
+        # Leave the signals of the terminal (e.g. SIGINT) to the launchers
+        os.setpgid(0, 0)
+        creator_pid = os.getppid()
+        self._preload()
+        if threading.active_count() > 1:
+            # The threads would not run in the forked worker processes: let
+            # the launchers run the worker themselves
+            self._logger.warning('Threads were started while preloading the '
+                                 'function app, the zygote does not fork '
+                                 'worker processes')
+            self._listener.close()
+            self._listener = None
+            return 0
+        gc.collect()
+        gc.freeze()
+
+        self._serve(creator_pid)
+        return 0
+
+    def _preload(self):
+        global _customer_dependencies_prioritized
+
+        from . import logging
+        logging.setup(log_level=self._args.log_level,
+                      log_destination=self._args.log_to)
+
+        from .utils.dependency import DependencyManager
+        DependencyManager.initialize()
+        DependencyManager.use_worker_dependencies()
+
+        from . import dispatcher  # NoQA
+
+        if DependencyManager.should_load_cx_dependencies():
+            DependencyManager.prioritize_customer_dependencies()
+            _customer_dependencies_prioritized = True
+            self._preload_function_app(DependencyManager.cx_working_dir)
+        self._logger.info('Zygote started, pid %s', os.getpid())
+
+    def _preload_function_app(self, function_app_directory: str):
+        script_file_name = get_app_setting(
+            setting=PYTHON_SCRIPT_FILE_NAME,
+            default_value=f'{PYTHON_SCRIPT_FILE_NAME_DEFAULT}')
+        function_path = os.path.join(function_app_directory,
+                                     script_file_name)
+        if not function_app_directory or not os.path.exists(function_path):
+            return
+        try:
+            importlib.import_module(
+                os.path.splitext(script_file_name)[0])
+        except Exception as ex:
+            # The worker processes import it again, and report the error
+            self._logger.warning('Cannot preload function app %s - %s',
+                                 function_path, ex)
+
+    def _serve(self, creator_pid: int):
+        wakeup_fd, wakeup_write_fd = os.pipe()
+        self._wakeup_fds = (wakeup_fd, wakeup_write_fd)
+        os.set_blocking(wakeup_write_fd, False)
+        signal.set_wakeup_fd(wakeup_write_fd)
+        signal.signal(signal.SIGCHLD, lambda signum, frame: None)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(_STOP_SIGNAL, self._on_stop_signal)
+
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(self._listener, selectors.EVENT_READ)
+        self._selector.register(wakeup_fd, selectors.EVENT_READ)
+        while self._listener is not None or self._workers:
+            for key, _ in self._selector.select(timeout=1.0):
+                if key.fileobj is self._listener:
+                    self._fork_worker()
+                else:
+                    os.read(wakeup_fd, 512)
+            self._reap_workers()
+
+            if self._listener is not None and (
+                    self._stop_requested or os.getppid() != creator_pid):
+                # The worker process which started the zygote has exited, or
+                # a forked one was specialized: stop forking, and exit along
+                # with the last worker
+                self._logger.info('Zygote stopped forking worker processes')
+                self._selector.unregister(self._listener)
+                self._listener.close()
+                self._listener = None
+                self._redirect_standard_streams()
+
+    def _on_stop_signal(self, signum, frame):
+        self._stop_requested = True
+
+    def _is_allowed_peer(self, conn: socket.socket) -> bool:
+        try:
+            pid, uid, _ = _get_peer_credentials(conn)
+        except OSError:
+            return False
+        return uid == self._uid and _get_parent_pid(pid) == self._host_pid
+
+    def _fork_worker(self):
+        conn, _ = self._listener.accept()
+        if self._stop_requested:
+            conn.close()
+            return
+        if not self._is_allowed_peer(conn):
+            self._logger.warning('Refused connection to the zygote from a '
+                                 'process not started by the host')
+            conn.close()
+            return
+        try:
+            request, fds = self._recv_request(conn)
+        except (OSError, EOFError, ValueError) as ex:
+            self._logger.warning('Invalid request to the zygote - %s',
+                                 ex)
+            conn.close()
+            return
+
+        sys.stdout.flush()
+        sys.stderr.flush()
+        try:
+            pid = os.fork()
+        except OSError as ex:
+            self._logger.warning('Cannot fork worker process - %s', ex)
+            pid = -1
+        if pid == 0:
+            exit_code = 1
+            try:
+                self._close()
+                exit_code = _run_forked_worker(conn, request, fds)
+            except BaseException:
+                traceback.print_exc()
+            finally:
+                os._exit(exit_code)
+
+        for fd in fds:
+            os.close(fd)
+        try:
+            conn.sendall(_INT.pack(pid))
+        except OSError:
+            pass
+        if pid > 0:
+            self._workers[pid] = conn
+        else:
+            conn.close()
+
+    @staticmethod
+    def _recv_request(conn: socket.socket) -> Tuple[dict, List[int]]:
+        fds = array.array('i')
+        header, ancdata, _, _ = conn.recvmsg(
+            _INT.size, socket.CMSG_SPACE(
+                len(_STANDARD_STREAMS) * fds.itemsize))
+        for level, type_, data in ancdata:
+            if level == socket.SOL_SOCKET and type_ == socket.SCM_RIGHTS:
+                fds.frombytes(data[:len(data) - len(data) % fds.itemsize])
+        try:
+            if len(fds) != len(_STANDARD_STREAMS):
+                raise ValueError('expected the standard streams')
+            header += _recv_exactly(conn, _INT.size - len(header))
+            request = json.loads(_recv_exactly(conn, _INT.unpack(header)[0]))
+        except BaseException:
+            for fd in fds:
+                os.close(fd)
+            raise
+        return request, list(fds)
+
+    def _reap_workers(self):
+        while self._workers:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            conn = self._workers.pop(pid, None)
+            if conn is None:
+                continue
+            exit_code = os.WEXITSTATUS(status) if os.WIFEXITED(status) \
+                else 128 + os.WTERMSIG(status)
+            try:
+                conn.sendall(_INT.pack(exit_code))
+            except OSError:
+                pass
+            conn.close()
+
+    @staticmethod
+    def _redirect_standard_streams():
+        # Do not hold on to the output of the exited worker process
+        sys.stdout.flush()
+        sys.stderr.flush()
+        null_fd = os.open(os.devnull, os.O_RDWR)
+        for fd in _STANDARD_STREAMS:
+            os.dup2(null_fd, fd)
+        os.close(null_fd)
+
+    def _close(self):
+        """Releases the resources of the zygote in a forked worker process"""
+        signal.set_wakeup_fd(-1)
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        signal.signal(_STOP_SIGNAL, signal.SIG_DFL)
+        self._selector.close()
+        if self._listener is not None:
+            self._listener.close()
+        for fd in self._wakeup_fds:
+            os.close(fd)
+        for conn in self._workers.values():
+            conn.close()
+        self._workers.clear()
+
+
+def _run_forked_worker(conn: socket.socket, request: dict,
+                       fds: List[int]) -> int:
+    global _zygote_pid
+    _zygote_pid = os.getppid()
+    for target_fd, fd in zip(_STANDARD_STREAMS, fds):
+        os.dup2(fd, target_fd)
+        os.close(fd)
+    os.chdir(request['cwd'])
+    os.environ.clear()
+    os.environ.update(request['env'])
+    sys.argv = request['argv']
+
+    # The launcher never writes to the connection: exit once it is closed
+    threading.Thread(target=_exit_with_launcher, args=(conn,),
+                     daemon=True).start()
+
+    from . import logging, main
+    logging.logger.removeHandler(logging.handler)
+    logging.error_logger.removeHandler(logging.error_handler)
+    logging.handler = logging.error_handler = None
+
+    try:
+        main.run(main.parse_args())
+        return 0
+    except SystemExit as ex:
+        return ex.code if isinstance(ex.code, int) else 1
+    except Exception:
+        return 1
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+
+
+def _exit_with_launcher(conn: socket.socket):
+    try:
+        while conn.recv(1):
+            pass
+    except OSError:
+        pass
+    sys.stdout.flush()
+    sys.stderr.flush()
+    os._exit(1)
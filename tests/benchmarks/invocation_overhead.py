@@ -0,0 +1,68 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+"""Microbenchmark of the overhead the worker adds to every invocation.
+
+Measures the worker extension hooks (disabled) around a trivial function plus
+one shared memory check, minus the bare call of the function, in microseconds
+per invocation. Run it from the root of the repository:
+
+    python -m tests.benchmarks.invocation_overhead
+"""
+
+import argparse
+import os
+import timeit
+
+from azure_functions_worker.bindings.shared_memory_data_transfer import (
+    SharedMemoryManager,
+)
+from azure_functions_worker.constants import (
+    FUNCTIONS_WORKER_SHARED_MEMORY_DATA_TRANSFER_ENABLED,
+    PYTHON_ENABLE_WORKER_EXTENSIONS,
+)
+from azure_functions_worker.extension import ExtensionManager
+from azure_functions_worker.utils.app_setting_manager import reload_app_settings
+
+
+class _Context:
+    function_name = 'http_trigger'
+
+
+def _function(req):
+    return req
+
+
+def _main():
+    parser = argparse.ArgumentParser(
+        description='Measure the overhead of the worker per invocation.')
+    parser.add_argument('--number', type=int, default=200000,
+                        help='invocations per measurement')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='measurements, of which the best is kept')
+    args = parser.parse_args()
+
+    os.environ[PYTHON_ENABLE_WORKER_EXTENSIONS] = 'false'
+    os.environ[FUNCTIONS_WORKER_SHARED_MEMORY_DATA_TRANSFER_ENABLED] = 'false'
+    reload_app_settings()
+
+    ctx = _Context()
+    func_args = {'req': 'request'}
+    shmem_mgr = SharedMemoryManager()
+    wrapper = ExtensionManager.get_sync_invocation_wrapper(ctx, _function)
+
+    def invoke():
+        shmem_mgr.is_enabled()
+        return wrapper(func_args)
+
+    def call():
+        return _function(**func_args)
+
+    invoke_s = min(timeit.repeat(invoke, number=args.number,
+                                 repeat=args.repeat))
+    call_s = min(timeit.repeat(call, number=args.number,
+                               repeat=args.repeat))
+    print(f'{(invoke_s - call_s) / args.number * 1e6:.2f} us per invocation')
+
+
+if __name__ == '__main__':
+    _main()
@@ -7,11 +7,21 @@ from unittest.mock import patch
 from tests.utils import testutils
 
 from azure_functions_worker.constants import (
+    PYTHON_COALESCED_FUNCTIONS,
     PYTHON_ENABLE_DEBUG_LOGGING,
     PYTHON_ENABLE_INIT_INDEXING,
+    PYTHON_ENABLE_WORKER_EXTENSIONS,
+    PYTHON_FUNCTION_METADATA_CACHE_DIR,
+    PYTHON_GC_THRESHOLDS,
+    PYTHON_SCRIPT_FILE_NAME,
+    PYTHON_SCRIPT_FILE_NAME_DEFAULT,
     PYTHON_THREADPOOL_THREAD_COUNT,
 )
-from azure_functions_worker.utils.app_setting_manager import get_python_appsetting_state
+from azure_functions_worker.utils.app_setting_manager import (
+    get_app_settings,
+    get_python_appsetting_state,
+    reload_app_settings,
+)
 
 SysVersionInfo = col.namedtuple("VersionInfo", ["major", "minor", "micro",
                                                 "releaselevel", "serial"])
@@ -97,3 +107,75 @@ class TestNonDefaultAppSettingsLogs(testutils.AsyncTestCase):
                       app_setting_state)
         self.assertIn("PYTHON_ENABLE_DEBUG_LOGGING: 1 | ", app_setting_state)
         self.assertIn("PYTHON_ENABLE_WORKER_EXTENSIONS: ", app_setting_state)
+
+
+class TestAppSettingsSnapshot(testutils.AppSettingsTestCase):
+    """Tests for the snapshot of the app settings."""
+
+    @patch.dict(os.environ, {PYTHON_THREADPOOL_THREAD_COUNT: '20',
+                             PYTHON_ENABLE_DEBUG_LOGGING: 'True',
+                             PYTHON_ENABLE_INIT_INDEXING: 'no'})
+    def test_app_settings(self):
+        app_settings = reload_app_settings()
+        self.assertIs(get_app_settings(), app_settings)
+
+        self.assertEqual(app_settings.get(PYTHON_THREADPOOL_THREAD_COUNT),
+                         '20')
+        self.assertEqual(app_settings.get('UNSET_SETTING', 'default'),
+                         'default')
+        self.assertEqual(
+            app_settings.get(PYTHON_THREADPOOL_THREAD_COUNT, 'default',
+                             validator=lambda value: value == '10'),
+            'default')
+
+        self.assertTrue(app_settings.is_true(PYTHON_ENABLE_DEBUG_LOGGING))
+        self.assertFalse(app_settings.is_false(PYTHON_ENABLE_DEBUG_LOGGING))
+        self.assertTrue(app_settings.is_false(PYTHON_ENABLE_INIT_INDEXING))
+        self.assertFalse(app_settings.is_true('UNSET_SETTING'))
+        self.assertFalse(app_settings.is_false('UNSET_SETTING'))
+
+        with self.assertRaises(TypeError):
+            app_settings.settings[PYTHON_ENABLE_DEBUG_LOGGING] = 'false'
+
+    def test_snapshot_is_not_updated_until_reloaded(self):
+        with patch.dict(os.environ, {PYTHON_ENABLE_DEBUG_LOGGING: '1'}):
+            reload_app_settings()
+        self.assertTrue(get_app_settings().is_true(
+            PYTHON_ENABLE_DEBUG_LOGGING))
+
+        with patch.dict(os.environ, {PYTHON_ENABLE_DEBUG_LOGGING: '0'}):
+            self.assertTrue(get_app_settings().is_true(
+                PYTHON_ENABLE_DEBUG_LOGGING))
+            reload_app_settings()
+            self.assertTrue(get_app_settings().is_false(
+                PYTHON_ENABLE_DEBUG_LOGGING))
+
+    def test_typed_settings(self):
+        self.set_app_settings({PYTHON_SCRIPT_FILE_NAME: 'app.py',
+                               PYTHON_ENABLE_INIT_INDEXING: 'true',
+                               PYTHON_ENABLE_WORKER_EXTENSIONS: '0',
+                               PYTHON_FUNCTION_METADATA_CACHE_DIR: '/tmp/x',
+                               PYTHON_COALESCED_FUNCTIONS: ' f1, ,f2 ',
+                               PYTHON_GC_THRESHOLDS: '50000,20,100'})
+        app_settings = get_app_settings()
+        self.assertEqual(app_settings.script_file_name, 'app.py')
+        self.assertTrue(app_settings.enable_init_indexing)
+        self.assertFalse(app_settings.enable_worker_extensions)
+        self.assertEqual(app_settings.function_metadata_cache_dir, '/tmp/x')
+        self.assertEqual(app_settings.coalesced_functions,
+                         frozenset({'f1', 'f2'}))
+        self.assertEqual(app_settings.gc_thresholds, (50000, 20, 100))
+
+    def test_typed_settings_defaults(self):
+        self.set_app_settings({PYTHON_SCRIPT_FILE_NAME: None,
+                               PYTHON_ENABLE_INIT_INDEXING: None,
+                               PYTHON_FUNCTION_METADATA_CACHE_DIR: '',
+                               PYTHON_COALESCED_FUNCTIONS: None,
+                               PYTHON_GC_THRESHOLDS: '1,2,3,4'})
+        app_settings = get_app_settings()
+        self.assertEqual(app_settings.script_file_name,
+                         PYTHON_SCRIPT_FILE_NAME_DEFAULT)
+        self.assertFalse(app_settings.enable_init_indexing)
+        self.assertIsNone(app_settings.function_metadata_cache_dir)
+        self.assertEqual(app_settings.coalesced_functions, frozenset())
+        self.assertIsNone(app_settings.gc_thresholds)
@@ -3,21 +3,30 @@
 import asyncio
 import collections as col
 import contextvars
+import gc
+import logging
 import os
 import sys
+import tempfile
+import threading
+import time
 import unittest
 from typing import Optional, Tuple
-from unittest.mock import patch
+from unittest.mock import Mock, patch
 
 from tests.utils import testutils
 from tests.utils.testutils import UNIT_TESTS_ROOT
 
-from azure_functions_worker import protos
+from azure_functions_worker import metadata_cache, protos
 from azure_functions_worker.constants import (
     HTTP_URI,
     METADATA_PROPERTIES_WORKER_INDEXED,
+    PYTHON_COALESCED_FUNCTIONS,
     PYTHON_ENABLE_DEBUG_LOGGING,
+    PYTHON_ENABLE_GC_METRICS,
     PYTHON_ENABLE_INIT_INDEXING,
+    PYTHON_ENABLE_INVOCATION_METRICS,
+    PYTHON_FUNCTION_METADATA_CACHE_DIR,
     PYTHON_THREADPOOL_THREAD_COUNT,
     PYTHON_THREADPOOL_THREAD_COUNT_DEFAULT,
     PYTHON_THREADPOOL_THREAD_COUNT_MAX_37,
@@ -25,6 +34,8 @@ from azure_functions_worker.constants import (
     REQUIRES_ROUTE_PARAMETERS
 )
 from azure_functions_worker.dispatcher import Dispatcher, ContextEnabledTask
+from azure_functions_worker.logging import logger
+from azure_functions_worker.utils.timeline import StepTimeline
 from azure_functions_worker.version import VERSION
 
 SysVersionInfo = col.namedtuple("VersionInfo", ["major", "minor", "micro",
@@ -37,6 +48,8 @@ FUNCTION_APP_DIRECTORY = UNIT_TESTS_ROOT / 'dispatcher_functions' / \
     'dispatcher_functions_stein'
 HTTPV2_FUNCTION_APP_DIRECTORY = UNIT_TESTS_ROOT / 'dispatcher_functions' / \
     'http_v2' / 'fastapi'
+HTTP_STEIN_FUNCTION_APP_DIRECTORY = UNIT_TESTS_ROOT / 'http_functions' / \
+    'http_functions_stein'
 
 
 class TestThreadPoolSettingsPython37(testutils.AsyncTestCase):
@@ -630,6 +643,61 @@ class TestThreadPoolSettingsPython312(TestThreadPoolSettingsPython37):
         super(TestThreadPoolSettingsPython312, self).tearDown()
 
 
+class TestDispatcherCoalescing(testutils.AsyncTestCase):
+
+    def setUp(self):
+        self._pre_env = dict(os.environ)
+        os.environ.update({PYTHON_COALESCED_FUNCTIONS: 'show_context_async'})
+        self._ctrl = testutils.start_mockhost(
+            script_root=DISPATCHER_FUNCTIONS_DIR)
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self._pre_env)
+
+    async def test_dispatcher_coalesced_function(self):
+        async with self._ctrl as host:
+            await host.init_worker()
+            self.assertEqual(self._ctrl._worker._coalesced_functions,
+                             {'show_context_async'})
+            await host.load_function('show_context_async')
+            for _ in range(2):
+                _, r = await host.invoke_function(
+                    'show_context_async', [
+                        protos.ParameterBinding(
+                            name='req',
+                            data=protos.TypedData(
+                                http=protos.RpcHttp(method='GET')))
+                    ])
+                self.assertEqual(r.response.result.status,
+                                 protos.StatusResult.Success)
+                self.assertIn('show_context_async',
+                              r.response.return_value.http.body.bytes.decode())
+            # Invocations not overlapping in time are not coalesced
+            coalescer = self._ctrl._worker._invocation_coalescer
+            self.assertEqual(coalescer.leaders, 2)
+            self.assertEqual(coalescer.followers, 0)
+
+    def test_get_coalesce_key(self):
+        def invocation_request(method, metadata_value):
+            return protos.InvocationRequest(
+                invocation_id='invocation_id',
+                function_id='function_id',
+                input_data=[protos.ParameterBinding(
+                    name='req',
+                    data=protos.TypedData(http=protos.RpcHttp(
+                        method=method, headers={'a': '1', 'b': '2'})))],
+                trigger_metadata={
+                    'sys': protos.TypedData(string=metadata_value)})
+
+        key = Dispatcher._get_coalesce_key(invocation_request('GET', 'x'))
+        # Trigger metadata is not part of the key
+        self.assertEqual(
+            key, Dispatcher._get_coalesce_key(invocation_request('GET', 'y')))
+        self.assertNotEqual(
+            key, Dispatcher._get_coalesce_key(invocation_request('POST', 'x')))
+
+
 class TestDispatcherStein(testutils.AsyncTestCase):
 
     def setUp(self):
@@ -800,6 +868,19 @@ class TestDispatcherInitRequest(testutils.AsyncTestCase):
                 "working_directory: , Linux Consumption: True,"
                 " Placeholder: False", logs)
 
+    @patch('azure_functions_worker.zygote._customer_dependencies_prioritized',
+           True)
+    async def test_dispatcher_load_modules_forked_from_zygote(self):
+        """Test modules are not loaded again in worker processes forked from
+        a zygote, which already loaded them.
+        """
+        os.environ["PYTHON_ISOLATE_WORKER_DEPENDENCIES"] = "1"
+        async with self._ctrl as host:
+            r = await host.init_worker()
+            logs = [log.message for log in r.logs]
+            self.assertFalse([log for log in logs if log.startswith(
+                "Applying prioritize_customer_dependencies")])
+
 
 class TestDispatcherIndexingInInit(unittest.TestCase):
 
@@ -994,6 +1075,233 @@ class TestDispatcherIndexingInInit(unittest.TestCase):
 
         del sys.modules['function_app']
 
+    def test_functions_metadata_request_from_cache(self):
+        init_request = protos.StreamingMessage(
+            worker_init_request=protos.WorkerInitRequest(
+                host_version="2.3.4",
+                function_app_directory=str(FUNCTION_APP_DIRECTORY)
+            )
+        )
+        metadata_request = protos.StreamingMessage(
+            functions_metadata_request=protos.FunctionsMetadataRequest(
+                function_app_directory=str(FUNCTION_APP_DIRECTORY)
+            )
+        )
+
+        with tempfile.TemporaryDirectory() as cache_dir, \
+                patch.dict(os.environ, {
+                    PYTHON_ENABLE_INIT_INDEXING: 'false',
+                    PYTHON_FUNCTION_METADATA_CACHE_DIR: cache_dir}):
+            self.dispatcher._loop = self.loop
+            self.loop.run_until_complete(
+                self.dispatcher._handle__worker_init_request(init_request))
+            metadata_response = self.loop.run_until_complete(
+                self.dispatcher._handle__functions_metadata_request(
+                    metadata_request))
+            self.assertIsNone(self.dispatcher._deferred_indexing)
+            self.assertEqual(len(os.listdir(cache_dir)), 1)
+            del sys.modules['function_app']
+
+            dispatcher = testutils.create_dummy_dispatcher()
+            dispatcher._loop = self.loop
+            indexing_threads = []
+            load_function_metadata = dispatcher.load_function_metadata
+
+            def record_indexing_thread(*args, **kwargs):
+                indexing_threads.append(threading.current_thread())
+                return load_function_metadata(*args, **kwargs)
+
+            with patch.object(dispatcher, 'load_function_metadata',
+                              side_effect=record_indexing_thread):
+                cached_response = self.loop.run_until_complete(
+                    dispatcher._handle__functions_metadata_request(
+                        metadata_request))
+                self.assertIsNotNone(dispatcher._deferred_indexing)
+                self.loop.run_until_complete(
+                    dispatcher._await_deferred_indexing())
+            # The function app is imported on the event loop's thread
+            self.assertEqual(indexing_threads, [threading.main_thread()])
+            self.assertEqual(cached_response.function_metadata_response,
+                             metadata_response.function_metadata_response)
+
+            # The function is registered under the id of its cached metadata
+            function_metadata = cached_response.function_metadata_response \
+                .function_metadata_results[0]
+            load_request = protos.StreamingMessage(
+                function_load_request=protos.FunctionLoadRequest(
+                    function_id=function_metadata.function_id,
+                    metadata=protos.RpcFunctionMetadata(
+                        name=function_metadata.name,
+                        directory=str(FUNCTION_APP_DIRECTORY),
+                        properties={
+                            METADATA_PROPERTIES_WORKER_INDEXED: "True"}
+                    )))
+
+            load_response = self.loop.run_until_complete(
+                dispatcher._handle__function_load_request(load_request))
+            self.assertEqual(
+                load_response.function_load_response.result.status,
+                protos.StatusResult.Success)
+            self.assertIsNone(dispatcher._deferred_indexing)
+            self.assertIsNone(dispatcher._function_metadata_exception)
+
+        del sys.modules['function_app']
+
+    def test_stale_function_metadata_cache_is_replaced(self):
+        init_request = protos.StreamingMessage(
+            worker_init_request=protos.WorkerInitRequest(
+                host_version="2.3.4",
+                function_app_directory=str(FUNCTION_APP_DIRECTORY)
+            )
+        )
+        metadata_request = protos.StreamingMessage(
+            functions_metadata_request=protos.FunctionsMetadataRequest(
+                function_app_directory=str(FUNCTION_APP_DIRECTORY)
+            )
+        )
+        # The registrations changed without changing the cache key
+        stale_metadata = [protos.RpcFunctionMetadata(
+            name='renamed_function', function_id='renamed_function')]
+
+        with tempfile.TemporaryDirectory() as cache_dir, \
+                patch.dict(os.environ, {
+                    PYTHON_ENABLE_INIT_INDEXING: 'false',
+                    PYTHON_FUNCTION_METADATA_CACHE_DIR: cache_dir}), \
+                patch.object(metadata_cache, 'get_cache_key',
+                             return_value='cache_key'), \
+                patch.object(logger, 'error') as mock_error:
+            metadata_cache.save(cache_dir, 'cache_key', stale_metadata)
+            self.dispatcher._loop = self.loop
+            self.loop.run_until_complete(
+                self.dispatcher._handle__worker_init_request(init_request))
+            metadata_response = self.loop.run_until_complete(
+                self.dispatcher._handle__functions_metadata_request(
+                    metadata_request))
+            self.assertEqual(list(metadata_response.function_metadata_response
+                                  .function_metadata_results),
+                             stale_metadata)
+            self.loop.run_until_complete(
+                self.dispatcher._await_deferred_indexing())
+
+            mock_error.assert_called_once()
+            fresh_metadata = self.dispatcher._function_metadata_result
+            self.assertNotEqual(fresh_metadata, stale_metadata)
+            self.assertEqual(metadata_cache.load(cache_dir, 'cache_key'),
+                             fresh_metadata)
+
+        del sys.modules['function_app']
+
+    def _reload_environment(self, environment_variables=None):
+        reload_request = protos.StreamingMessage(
+            function_environment_reload_request=protos.
+            FunctionEnvironmentReloadRequest(
+                function_app_directory=str(FUNCTION_APP_DIRECTORY),
+                environment_variables={PYTHON_ENABLE_INIT_INDEXING: 'true',
+                                       **(environment_variables or {})}))
+
+        cwd = os.getcwd()
+        try:
+            with patch.dict(os.environ):
+                return self.loop.run_until_complete(
+                    self.dispatcher._handle__function_environment_reload_request(
+                        reload_request))
+        finally:
+            os.chdir(cwd)
+
+    def test_environment_reload_with_init_indexing(self):
+        with self.assertLogs(logger, 'INFO') as logs:
+            response = self._reload_environment()
+
+        self.assertEqual(
+            response.function_environment_reload_response.result.status,
+            protos.StatusResult.Success)
+        self.assertIsNotNone(self.dispatcher._function_metadata_result)
+        self.assertIsNone(self.dispatcher._function_metadata_exception)
+
+        timeline_log = [log for log in logs.output
+                        if 'Specialization timeline' in log]
+        self.assertEqual(len(timeline_log), 1)
+        step_indexes = [
+            timeline_log[0].index(f' {step} ')
+            for step in ('environment', 'customer_libraries',
+                         'binding_registry', 'function_app_import',
+                         'function_metadata')]
+        # The binding registry is loaded before the function app is imported
+        self.assertEqual(step_indexes, sorted(step_indexes))
+
+        del sys.modules['function_app']
+
+    def test_environment_reload_starts_and_stops_metrics(self):
+        self.dispatcher._loop = self.loop
+        self._reload_environment({PYTHON_ENABLE_GC_METRICS: 'true',
+                                  PYTHON_ENABLE_INVOCATION_METRICS: 'true'})
+        del sys.modules['function_app']
+        try:
+            self.assertTrue(self.dispatcher._invocation_metrics.enabled)
+            self.assertIn(self.dispatcher._gc_pause_metrics._on_collection,
+                          gc.callbacks)
+
+            self._reload_environment()
+            del sys.modules['function_app']
+            self.assertFalse(self.dispatcher._invocation_metrics.enabled)
+            self.assertNotIn(
+                self.dispatcher._gc_pause_metrics._on_collection,
+                gc.callbacks)
+        finally:
+            self.dispatcher._invocation_metrics.stop()
+            self.dispatcher._gc_pause_metrics.stop()
+
+    @patch('azure_functions_worker.dispatcher.bindings.load_binding_registry',
+           side_effect=AttributeError('BINDING_REGISTRY is None'))
+    def test_environment_reload_binding_registry_failure(
+            self, mock_load_binding_registry):
+        response = self._reload_environment()
+
+        mock_load_binding_registry.assert_called_once()
+        self.assertEqual(
+            response.function_environment_reload_response.result.status,
+            protos.StatusResult.Failure)
+        # The function app was not imported
+        self.assertIsNone(self.dispatcher._function_metadata_result)
+        self.assertIsNone(self.dispatcher._function_metadata_exception)
+        self.assertNotIn('function_app', sys.modules)
+
+    @patch.dict(os.environ, {PYTHON_ENABLE_INIT_INDEXING: 'false'})
+    def test_index_functions_logs_bindings_per_function(self):
+        init_request = protos.StreamingMessage(
+            worker_init_request=protos.WorkerInitRequest(
+                host_version="2.3.4",
+                function_app_directory=str(FUNCTION_APP_DIRECTORY)
+            )
+        )
+        self.loop.run_until_complete(
+            self.dispatcher._handle__worker_init_request(init_request))
+
+        app_dir = str(HTTP_STEIN_FUNCTION_APP_DIRECTORY)
+        sys.path.insert(0, app_dir)
+        try:
+            with self.assertLogs(logger, logging.INFO) as logs:
+                fx_metadata_results = self.dispatcher.index_functions(
+                    os.path.join(app_dir, 'function_app.py'), app_dir)
+        finally:
+            sys.path.remove(app_dir)
+            del sys.modules['function_app']
+
+        function_logs = [r.getMessage() for r in logs.records
+                         if r.getMessage().startswith('Function Name: ')]
+        self.assertGreater(len(fx_metadata_results), 1)
+        self.assertEqual(len(function_logs), len(fx_metadata_results))
+        for function_log, function_metadata in zip(function_logs,
+                                                   fx_metadata_results):
+            self.assertTrue(function_log.startswith(
+                f'Function Name: {function_metadata.name}, '))
+            # Each log only lists the bindings of its own function
+            self.assertEqual(function_log.count("'http'"), 1)
+        self.assertIn(
+            f'Successfully processed FunctionMetadataRequest for '
+            f'{len(fx_metadata_results)} functions.',
+            logs.records[-1].getMessage())
+
     @patch.dict(os.environ, {PYTHON_ENABLE_INIT_INDEXING: 'true'})
     @patch.object(Dispatcher, 'index_functions')
     def test_dispatcher_indexing_in_load_request_with_exception(
@@ -1090,6 +1398,106 @@ class TestDispatcherIndexingInInit(unittest.TestCase):
         self.assertIn(REQUIRES_ROUTE_PARAMETERS, capabilities)
         self.assertEqual(capabilities[REQUIRES_ROUTE_PARAMETERS], "true")
 
+    @patch("azure_functions_worker.http_v2.HttpV2Registry.http_v2_enabled",
+           return_value=True)
+    @patch("azure_functions_worker.dispatcher.initialize_http_server",
+           return_value="http://localhost:8080")
+    def test_dispatcher_http_v2_reload_not_started_on_failure(
+            self, mock_init_http_server, mock_http_v2_enabled):
+        capabilities = {}
+        with patch.object(self.dispatcher, '_get_function_path',
+                          return_value=str(HTTPV2_FUNCTION_APP_DIRECTORY)), \
+                patch.object(self.dispatcher, '_import_function_app',
+                             return_value=[]), \
+                patch.object(self.dispatcher, '_process_indexed_functions',
+                             side_effect=Exception("Mocked Exception")):
+            self.dispatcher._reload_function_metadata(
+                str(HTTPV2_FUNCTION_APP_DIRECTORY), capabilities,
+                StepTimeline('Specialization'))
+
+        # The HTTP server is not left running without being reported
+        mock_init_http_server.assert_not_called()
+        self.assertEqual(capabilities, {})
+        self.assertIsNotNone(self.dispatcher._function_metadata_exception)
+
+
+class TestDispatcherSyncThreadPoolSwap(testutils.AppSettingsTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.dispatcher = testutils.create_dummy_dispatcher()
+
+    def tearDown(self):
+        self.dispatcher._stop_sync_call_tp()
+        super().tearDown()
+
+    def test_swap_does_not_wait_for_running_calls(self):
+        self.set_app_settings({PYTHON_THREADPOOL_THREAD_COUNT: '3'})
+        old_tp = self.dispatcher._sync_call_tp
+        release_call = threading.Event()
+        running_call = old_tp.submit(release_call.wait, 10)
+
+        with self.assertLogs(logger, 'INFO') as logs:
+            self.dispatcher._swap_sync_call_tp()
+            self.assertIn('Swapped synchronous thread pool in',
+                          logs.output[0])
+
+            # New calls go to the new thread pool, the running call goes on
+            self.assertIsNot(self.dispatcher._sync_call_tp, old_tp)
+            self.assertEqual(self.dispatcher.get_sync_tp_workers_set(), 3)
+            self.assertEqual(
+                self.dispatcher._sync_call_tp.submit(lambda: 42).result(), 42)
+            self.assertFalse(running_call.done())
+
+            release_call.set()
+            self.assertTrue(running_call.result(timeout=10))
+            for _ in range(100):
+                if len(logs.output) > 1:
+                    break
+                time.sleep(0.1)
+        self.assertIn('Drained previous synchronous thread pool in',
+                      logs.output[1])
+        with self.assertRaises(RuntimeError):
+            old_tp.submit(lambda: None)
+
+
+class TestDispatcherHttpV2InvocationFailure(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.loop.set_task_factory(
+            lambda loop, coro, context=None: ContextEnabledTask(
+                coro, loop=loop, context=context))
+        self.dispatcher = testutils.create_dummy_dispatcher()
+        self.dispatcher._loop = self.loop
+
+    def tearDown(self):
+        self.loop.close()
+
+    @patch("azure_functions_worker.http_v2.HttpV2Registry.http_v2_enabled",
+           return_value=True)
+    def test_failure_without_http_context(self, mock_http_v2_enabled):
+        """An invocation failing once its HTTP context is gone (e.g. evicted
+        after a timeout) still gets a response for the host
+        """
+        function_info = Mock(is_http_func=True, input_types={})
+        function_info.name = 'http_trigger'
+        self.dispatcher._functions = Mock(
+            get_function=Mock(return_value=function_info))
+        request = protos.StreamingMessage(
+            invocation_request=protos.InvocationRequest(
+                invocation_id='evicted_invocation_id',
+                function_id='function_id',
+                input_data=[protos.ParameterBinding(name='req')]))
+
+        response = self.loop.run_until_complete(
+            self.dispatcher._handle__invocation_request(request))
+
+        self.assertEqual(response.invocation_response.invocation_id,
+                         'evicted_invocation_id')
+        self.assertEqual(response.invocation_response.result.status,
+                         protos.StatusResult.Failure)
+
 
 class TestContextEnabledTask(unittest.TestCase):
     def setUp(self):
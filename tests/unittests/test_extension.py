@@ -6,10 +6,12 @@ import logging
 import os
 import pathlib
 import sys
-import unittest
+import threading
 from importlib import import_module
 from unittest.mock import Mock, call, patch
 
+from tests.utils import testutils
+
 from azure_functions_worker.constants import (
     CUSTOMER_PACKAGES_PATH,
     PYTHON_ENABLE_WORKER_EXTENSIONS,
@@ -32,14 +34,13 @@ class MockContext:
         self.function_directory = function_directory
 
 
-class TestExtension(unittest.TestCase):
+class TestExtension(testutils.AppSettingsTestCase):
 
     def setUp(self):
+        super().setUp()
         # Patch sys.modules and sys.path to avoid pollution between tests
-        self.mock_environ = patch.dict('os.environ', os.environ.copy())
         self.mock_sys_module = patch.dict('sys.modules', sys.modules.copy())
         self.mock_sys_path = patch('sys.path', sys.path.copy())
-        self.mock_environ.start()
         self.mock_sys_module.start()
         self.mock_sys_path.start()
 
@@ -47,6 +48,8 @@ class TestExtension(unittest.TestCase):
         self._instance = ExtensionManager
         self._instance._is_sdk_detected = False
         self._instance._extension_enabled_sdk = None
+        self._instance._invocation_hooks.clear()
+        self._instance._hook_timings.clear()
 
         # Initialize Azure Functions SDK and clear cache
         self._sdk = import_module('azure.functions')
@@ -74,14 +77,12 @@ class TestExtension(unittest.TestCase):
         )
 
         # Set feature flag to on
-        os.environ[PYTHON_ENABLE_WORKER_EXTENSIONS] = 'true'
+        self.set_app_settings({PYTHON_ENABLE_WORKER_EXTENSIONS: 'true'})
 
     def tearDown(self) -> None:
-        os.environ.pop(PYTHON_ENABLE_WORKER_EXTENSIONS)
-
         self.mock_sys_path.stop()
         self.mock_sys_module.stop()
-        self.mock_environ.stop()
+        super().tearDown()
 
     def test_extension_is_supported_by_latest_sdk(self):
         """Test if extension interface supports check as expected on
@@ -141,7 +142,7 @@ class TestExtension(unittest.TestCase):
         """When turning off the feature flag PYTHON_ENABLE_WORKER_EXTENSIONS,
         the post_function_load extension should be disabled
         """
-        os.environ[PYTHON_ENABLE_WORKER_EXTENSIONS] = 'false'
+        self.set_app_settings({PYTHON_ENABLE_WORKER_EXTENSIONS: 'false'})
         self._instance.function_load_extension(
             func_name=self._mock_func_name,
             func_directory=self._mock_func_dir
@@ -193,41 +194,32 @@ class TestExtension(unittest.TestCase):
 
     @patch('azure_functions_worker.extension.get_sdk_from_sys_path',
            return_value=importlib.import_module('azure.functions'))
-    def test_invocation_extension_enable_when_feature_flag_is_on(
+    def test_invocation_hooks_enable_when_feature_flag_is_on(
         self,
         get_sdk_from_sys_path_mock: Mock
     ):
-        """When turning off the feature flag PYTHON_ENABLE_WORKER_EXTENSIONS,
-        the pre_invocation and post_invocation extension should be disabled
+        """When turning on the feature flag PYTHON_ENABLE_WORKER_EXTENSIONS,
+        the pre_invocation and post_invocation extensions should be looked up
         """
-        self._instance._invocation_extension(
-            ctx=self._mock_context,
-            hook_name=FUNC_EXT_PRE_INVOCATION,
-            func_args=[],
-            func_ret=None
-        )
+        self._instance.get_invocation_hooks(self._mock_func_name)
         get_sdk_from_sys_path_mock.assert_called_once()
 
     @patch('azure_functions_worker.extension.get_sdk_from_sys_path')
-    def test_invocation_extension_extension_disable_when_feature_flag_is_off(
+    def test_invocation_hooks_disable_when_feature_flag_is_off(
         self,
         get_sdk_from_sys_path_mock: Mock
     ):
         """When turning off the feature flag PYTHON_ENABLE_WORKER_EXTENSIONS,
         the pre_invocation and post_invocation extension should be disabled
         """
-        os.environ[PYTHON_ENABLE_WORKER_EXTENSIONS] = 'false'
-        self._instance._invocation_extension(
-            ctx=self._mock_context,
-            hook_name=FUNC_EXT_PRE_INVOCATION,
-            func_args=[],
-            func_ret=None
-        )
+        self.set_app_settings({PYTHON_ENABLE_WORKER_EXTENSIONS: 'false'})
+        self.assertIsNone(
+            self._instance.get_invocation_hooks(self._mock_func_name))
         get_sdk_from_sys_path_mock.assert_not_called()
 
     @patch('azure_functions_worker.extension.ExtensionManager.'
            '_warn_sdk_not_support_extension')
-    def test_invocation_extension_warns_when_sdk_does_not_support(
+    def test_invocation_hooks_warns_when_sdk_does_not_support(
         self,
         _warn_sdk_not_support_extension_mock: Mock
     ):
@@ -235,86 +227,67 @@ class TestExtension(unittest.TestCase):
         extension support and turning on the feature flag, we should warn them
         """
         sys.path.insert(0, self._dummy_sdk_sys_path)
-        self._instance._invocation_extension(
-            ctx=self._mock_context,
-            hook_name=FUNC_EXT_PRE_INVOCATION,
-            func_args=[],
-            func_ret=None
-        )
+        self.assertIsNone(
+            self._instance.get_invocation_hooks(self._mock_func_name))
         _warn_sdk_not_support_extension_mock.assert_called_once()
 
     @patch('azure_functions_worker.extension.ExtensionManager.'
-           '_safe_execute_invocation_hooks')
-    def test_invocation_extension_should_invoke_extension_call(
+           '_get_hook_chain', return_value=())
+    def test_invocation_hooks_should_look_up_extension_hooks(
         self,
-        safe_execute_invocation_hooks_mock: Mock
+        get_hook_chain_mock: Mock
     ):
-        """Should invoke extension if SDK suports extension interface
+        """Should look up every invocation hook if SDK suports extension
+        interface
         """
-        for hook_name in (APP_EXT_PRE_INVOCATION, FUNC_EXT_PRE_INVOCATION,
-                          APP_EXT_POST_INVOCATION, FUNC_EXT_POST_INVOCATION):
-            self._instance._invocation_extension(
-                ctx=self._mock_context,
-                hook_name=hook_name,
-                func_args=[],
-                func_ret=None
-            )
-
-            safe_execute_invocation_hooks_mock.assert_has_calls(
-                calls=[
-                    call(
-                        None, hook_name, self._mock_context,
-                        [], None
-                    )
-                ],
-                any_order=True
-            )
+        self.assertIsNone(
+            self._instance.get_invocation_hooks(self._mock_func_name))
+        get_hook_chain_mock.assert_has_calls(
+            calls=[
+                call(None, hook_name)
+                for hook_name in (APP_EXT_PRE_INVOCATION,
+                                  FUNC_EXT_PRE_INVOCATION,
+                                  FUNC_EXT_POST_INVOCATION,
+                                  APP_EXT_POST_INVOCATION)
+            ],
+            any_order=True
+        )
 
     @patch('azure_functions_worker.extension.ExtensionManager.'
-           '_is_pre_invocation_hook')
-    @patch('azure_functions_worker.extension.ExtensionManager.'
-           '_is_post_invocation_hook')
+           '_record_hook_timing')
     def test_empty_hooks_should_not_receive_any_invocation(
         self,
-        _is_post_invocation_hook_mock: Mock,
-        _is_pre_invocation_hook_mock: Mock
+        _record_hook_timing_mock: Mock
     ):
         """If there is no life-cycle hooks implemented under a function,
         then we should skip it
         """
         for hook_name in (APP_EXT_PRE_INVOCATION, FUNC_EXT_PRE_INVOCATION,
                           APP_EXT_POST_INVOCATION, FUNC_EXT_POST_INVOCATION):
-            self._instance._safe_execute_invocation_hooks(
-                hooks=[],
-                hook_name=hook_name,
-                ctx=self._mock_context,
-                fargs=[],
-                fret=None
+            hook_chain = self._instance._get_hook_chain([], hook_name)
+            self.assertEqual(hook_chain, ())
+            self._instance._execute_invocation_hooks(
+                hook_chain, None, self._mock_context, []
             )
-            _is_pre_invocation_hook_mock.assert_not_called()
-            _is_post_invocation_hook_mock.assert_not_called()
+        _record_hook_timing_mock.assert_not_called()
 
     def test_invocation_hooks_should_be_executed(self):
         """If there is an extension implemented the pre_invocation and
         post_invocation life-cycle hooks, it should be invoked in
-        safe_execute_invocation_hooks
+        _execute_invocation_hooks
         """
         FuncExtClass = self._generate_new_func_extension_class(
             base=self._sdk.FuncExtensionBase,
             trigger=self._mock_func_name
         )
         func_ext_instance = FuncExtClass()
-        hook_instances = (
-            self._sdk.ExtensionMeta.get_function_hooks(self._mock_func_name)
+        hooks = self._instance.get_invocation_hooks(self._mock_func_name)
+        self._instance._execute_invocation_hooks(
+            hooks.pre, None, self._mock_context, []
+        )
+        self._instance._execute_invocation_hooks(
+            hooks.post, None, self._mock_context, [], None
         )
-        for hook_name in (FUNC_EXT_PRE_INVOCATION, FUNC_EXT_POST_INVOCATION):
-            self._instance._safe_execute_invocation_hooks(
-                hooks=hook_instances,
-                hook_name=hook_name,
-                ctx=self._mock_context,
-                fargs=[],
-                fret=None
-            )
         self.assertFalse(func_ext_instance._post_function_load_executed)
         self.assertTrue(func_ext_instance._pre_invocation_executed)
         self.assertTrue(func_ext_instance._post_invocation_executed)
@@ -345,22 +318,18 @@ class TestExtension(unittest.TestCase):
     def test_invocation_hooks_app_level_should_be_executed(self):
         """If there is an extension implemented the pre_invocation and
         post_invocation life-cycle hooks, it should be invoked in
-        safe_execute_invocation_hooks
+        _execute_invocation_hooks
         """
         AppExtClass = self._generate_new_app_extension(
             base=self._sdk.AppExtensionBase
         )
-        hook_instances = (
-            self._sdk.ExtensionMeta.get_application_hooks()
+        hooks = self._instance.get_invocation_hooks(self._mock_func_name)
+        self._instance._execute_invocation_hooks(
+            hooks.pre, None, self._mock_context, []
+        )
+        self._instance._execute_invocation_hooks(
+            hooks.post, None, self._mock_context, [], None
         )
-        for hook_name in (APP_EXT_PRE_INVOCATION, APP_EXT_POST_INVOCATION):
-            self._instance._safe_execute_invocation_hooks(
-                hooks=hook_instances,
-                hook_name=hook_name,
-                ctx=self._mock_context,
-                fargs=[],
-                fret=None
-            )
         self.assertFalse(AppExtClass._post_function_load_app_level_executed)
         self.assertTrue(AppExtClass._pre_invocation_app_level_executed)
         self.assertTrue(AppExtClass._post_invocation_app_level_executed)
@@ -428,6 +397,62 @@ class TestExtension(unittest.TestCase):
         for current_return in comparisons:
             self.assertEqual(current_return, 'request_ok')
 
+    def test_invocation_hooks_resolved_once(self):
+        """The invocation hooks of a function should only be looked up on its
+        first invocation, until a function is loaded again
+        """
+        AppExtClass = self._generate_new_app_extension(
+            base=self._sdk.AppExtensionBase
+        )
+        FuncExtClass = self._generate_new_func_extension_class(
+            base=self._sdk.FuncExtensionBase,
+            trigger=self._mock_func_name
+        )
+        FuncExtClass()
+
+        with patch.object(self._sdk.ExtensionMeta, 'get_function_hooks',
+                          wraps=self._sdk.ExtensionMeta.get_function_hooks
+                          ) as get_function_hooks_mock:
+            for _ in range(3):
+                self._instance._raw_invocation_wrapper(
+                    self._mock_context, self._mock_function_main,
+                    self._mock_arguments
+                )
+            get_function_hooks_mock.assert_called_once_with(
+                self._mock_func_name)
+
+            hooks = self._instance.get_invocation_hooks(self._mock_func_name)
+            self.assertEqual(len(hooks.pre), 2)
+            self.assertEqual(len(hooks.post), 2)
+            # Application level pre_invocation hooks come first
+            self.assertEqual(
+                hooks.pre[0].ext_impl, AppExtClass.pre_invocation_app_level)
+            self.assertEqual(
+                hooks.pre[0].name,
+                f'{AppExtClass.__name__}.pre_invocation_app_level')
+            self.assertEqual(
+                hooks.pre[0].ext_logger.name,
+                f'azure_functions_worker.extension.{AppExtClass.__name__}')
+
+            self._instance.function_load_extension(
+                func_name=self._mock_func_name,
+                func_directory=self._mock_func_dir
+            )
+            self._instance.get_invocation_hooks(self._mock_func_name)
+            self.assertEqual(get_function_hooks_mock.call_count, 3)
+
+    def test_no_invocation_hooks(self):
+        """A function without any invocation hook has no hook chain, so that
+        it can be called directly
+        """
+        self.assertIsNone(
+            self._instance.get_invocation_hooks(self._mock_func_name))
+        self.assertEqual(
+            self._instance._raw_invocation_wrapper(
+                self._mock_context, self._mock_function_main,
+                self._mock_arguments
+            ), 'request_ok')
+
     @patch('azure_functions_worker.extension.logger.error')
     def test_exception_handling_in_post_function_load_app_level(
         self,
@@ -553,7 +578,7 @@ class TestExtension(unittest.TestCase):
         be executed, but not the extension
         """
         # Turn off feature flag
-        os.environ[PYTHON_ENABLE_WORKER_EXTENSIONS] = 'false'
+        self.set_app_settings({PYTHON_ENABLE_WORKER_EXTENSIONS: 'false'})
 
         # Register a function extension
         FuncExtClass = self._generate_new_func_extension_class(
@@ -626,7 +651,7 @@ class TestExtension(unittest.TestCase):
         should not execute the extension.
         """
         # Turn off feature flag
-        os.environ[PYTHON_ENABLE_WORKER_EXTENSIONS] = 'false'
+        self.set_app_settings({PYTHON_ENABLE_WORKER_EXTENSIONS: 'false'})
 
         # Register a function extension
         FuncExtClass = self._generate_new_func_extension_class(
@@ -650,31 +675,146 @@ class TestExtension(unittest.TestCase):
         # Ensure the customer's function is executed
         self.assertEqual(result, 'request_ok')
 
-    def test_is_pre_invocation_hook(self):
-        for name in (FUNC_EXT_PRE_INVOCATION, APP_EXT_PRE_INVOCATION):
-            self.assertTrue(
-                self._instance._is_pre_invocation_hook(name)
-            )
+    def test_get_async_invocation_wrapper_with_async_hooks(self):
+        """Async hooks should be awaited and blocking hooks should run in an
+        executor, not on the event loop
+        """
+        hook_threads = {}
 
-    def test_is_pre_invocation_hook_negative(self):
-        for name in (FUNC_EXT_POST_INVOCATION, APP_EXT_POST_INVOCATION,
-                     FUNC_EXT_POST_FUNCTION_LOAD, APP_EXT_POST_FUNCTION_LOAD):
-            self.assertFalse(
-                self._instance._is_pre_invocation_hook(name)
-            )
+        class AsyncFuncExtension(self._sdk.FuncExtensionBase):
+            def __init__(self, trigger):
+                self._trigger_name = trigger
+
+            async def pre_invocation(self, logger, context, fargs,
+                                     *args, **kwargs):
+                await asyncio.sleep(0)
+                hook_threads['pre'] = threading.current_thread()
+
+            def post_invocation(self, logger, context, fargs, fret,
+                                *args, **kwargs):
+                hook_threads['post'] = threading.current_thread()
+
+            post_invocation.blocking = True
 
-    def test_is_post_invocation_hook(self):
-        for name in (FUNC_EXT_POST_INVOCATION, APP_EXT_POST_INVOCATION):
-            self.assertTrue(
-                self._instance._is_post_invocation_hook(name)
+        AsyncFuncExtension(self._mock_func_name)
+
+        result = asyncio.run(
+            self._instance.get_async_invocation_wrapper(
+                self._mock_context,
+                self._mock_function_main_async,
+                self._mock_arguments
             )
+        )
 
-    def test_is_post_invocation_hook_negative(self):
-        for name in (FUNC_EXT_PRE_INVOCATION, APP_EXT_PRE_INVOCATION,
-                     FUNC_EXT_POST_FUNCTION_LOAD, APP_EXT_POST_FUNCTION_LOAD):
-            self.assertFalse(
-                self._instance._is_post_invocation_hook(name)
+        self.assertEqual(result, 'request_ok')
+        self.assertIs(hook_threads['pre'], threading.current_thread())
+        self.assertIsNot(hook_threads['post'], threading.current_thread())
+        self.assertEqual(
+            set(self._instance.get_hook_timings()),
+            {'AsyncFuncExtension.pre_invocation',
+             'AsyncFuncExtension.post_invocation'})
+
+    def test_get_sync_invocation_wrapper_with_async_hook(self):
+        """Async hooks of sync functions should run on the given event loop,
+        or on a new one when there is none
+        """
+        hook_loops = []
+
+        class AsyncFuncExtension(self._sdk.FuncExtensionBase):
+            def __init__(self, trigger):
+                self._trigger_name = trigger
+
+            async def pre_invocation(self, logger, context, fargs,
+                                     *args, **kwargs):
+                hook_loops.append(asyncio.get_running_loop())
+
+        AsyncFuncExtension(self._mock_func_name)
+
+        wrapped = self._instance.get_sync_invocation_wrapper(
+            self._mock_context, self._mock_function_main)
+        self.assertEqual(wrapped(self._mock_arguments), 'request_ok')
+        self.assertEqual(len(hook_loops), 1)
+
+        async def run_in_thread():
+            loop = asyncio.get_running_loop()
+            wrapped = self._instance.get_sync_invocation_wrapper(
+                self._mock_context, self._mock_function_main, loop)
+            await loop.run_in_executor(None, wrapped, self._mock_arguments)
+            return loop
+
+        loop = asyncio.run(run_in_thread())
+        self.assertIs(hook_loops[1], loop)
+
+    @patch('azure_functions_worker.extension.EXT_HOOK_SLOW_WARNING_SECONDS',
+           0)
+    def test_hook_timings(self):
+        """The duration of the hooks should be recorded, with a warning when
+        a hook is slower than ever before
+        """
+        FuncExtClass = self._generate_new_func_extension_class(
+            self._sdk.FuncExtensionBase,
+            self._mock_func_name
+        )
+        FuncExtClass()
+
+        hook_name = f'{FuncExtClass.__name__}.pre_invocation'
+        logger_name = \
+            f'azure_functions_worker.extension.{FuncExtClass.__name__}'
+        with self.assertLogs(logger_name, 'WARNING') as logs:
+            self._instance._raw_invocation_wrapper(
+                self._mock_context, self._mock_function_main,
+                self._mock_arguments
             )
+        self.assertTrue(logs.output[0].startswith(
+            f'WARNING:{logger_name}:Extension hook {hook_name} took'))
+
+        self._instance._raw_invocation_wrapper(
+            self._mock_context, self._mock_function_main,
+            self._mock_arguments
+        )
+        timings = self._instance.get_hook_timings()
+        self.assertEqual(timings[hook_name]['count'], 2)
+        self.assertGreaterEqual(timings[hook_name]['total_ms'],
+                                timings[hook_name]['max_ms'])
+        # Timings start over once reported
+        self.assertEqual(self._instance.get_hook_timings(), {})
+
+    @patch('azure_functions_worker.extension.EXT_HOOK_AWAIT_TIMEOUT_SECONDS',
+           0.1)
+    def test_get_sync_invocation_wrapper_async_hook_timeout(self):
+        """An async hook of a sync function which does not complete in time
+        should be cancelled, and the function still run
+        """
+        hook_cancelled = threading.Event()
+
+        class AsyncFuncExtension(self._sdk.FuncExtensionBase):
+            def __init__(self, trigger):
+                self._trigger_name = trigger
+
+            async def pre_invocation(self, logger, context, fargs,
+                                     *args, **kwargs):
+                try:
+                    await asyncio.sleep(10)
+                except asyncio.CancelledError:
+                    hook_cancelled.set()
+                    raise
+
+        AsyncFuncExtension(self._mock_func_name)
+        logger_name = \
+            f'azure_functions_worker.extension.{AsyncFuncExtension.__name__}'
+
+        async def run_in_thread():
+            loop = asyncio.get_running_loop()
+            wrapped = self._instance.get_sync_invocation_wrapper(
+                self._mock_context, self._mock_function_main, loop)
+            return await loop.run_in_executor(None, wrapped,
+                                              self._mock_arguments)
+
+        with self.assertLogs(logger_name, 'ERROR') as logs:
+            self.assertEqual(asyncio.run(run_in_thread()), 'request_ok')
+        self.assertIn('Extension hook did not complete in 0.1 s',
+                      logs.output[0])
+        self.assertTrue(hook_cancelled.wait(1))
 
     @patch('azure_functions_worker.extension.'
            'ExtensionManager._info_extension_is_enabled')
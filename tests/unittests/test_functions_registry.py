@@ -1,6 +1,9 @@
 # Copyright (c) Microsoft Corporation. All rights reserved.
 # Licensed under the MIT License.
+import typing
+import unittest
 
+import azure.functions as func
 from azure.functions import Function
 from azure.functions.decorators.blob import BlobInput
 from azure.functions.decorators.http import HttpTrigger
@@ -38,3 +41,45 @@ class TestFunctionsRegistry(testutils.AsyncTestCase):
         self.assertEqual(str(ex.exception),
                          'cannot load the dummy function: \"$return\" '
                          'binding must have direction set to \"out\"')
+
+
+class TestAnnotationInfo(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = functions.Registry()
+
+    def test_out_annotation(self):
+        info = self.registry._get_annotation_info(func.Out[str])
+        self.assertTrue(info.is_out)
+        self.assertIs(info.py_type, str)
+        self.assertTrue(info.is_type)
+
+        info = self.registry._get_annotation_info(func.Out[typing.List[str]])
+        self.assertTrue(info.is_out)
+        self.assertEqual(info.py_type, typing.List[str])
+        self.assertTrue(info.is_type)
+
+    def test_invalid_out_annotation(self):
+        info = self.registry._get_annotation_info(func.Out)
+        self.assertTrue(info.is_out)
+        self.assertIsNone(info.py_type)
+        self.assertFalse(info.is_type)
+
+    def test_annotation(self):
+        info = self.registry._get_annotation_info(func.HttpRequest)
+        self.assertFalse(info.is_out)
+        self.assertIs(info.py_type, func.HttpRequest)
+        self.assertTrue(info.is_type)
+
+        info = self.registry._get_annotation_info(123)
+        self.assertFalse(info.is_out)
+        self.assertFalse(info.is_type)
+
+    def test_annotation_info_cached(self):
+        annotation = func.Out[bytes]
+        self.assertIs(self.registry._get_annotation_info(annotation),
+                      self.registry._get_annotation_info(annotation))
+        # Cached per registry, which releases the annotations along with it
+        self.assertIn(id(annotation), self.registry._annotation_infos)
+        self.assertNotIn(id(annotation),
+                         functions.Registry()._annotation_infos)
@@ -0,0 +1,174 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+import asyncio
+import gc
+import os
+import unittest
+from unittest.mock import patch
+
+from tests.utils import testutils
+
+from azure_functions_worker import protos
+from azure_functions_worker.constants import (
+    PYTHON_GC_FREEZE_AFTER_LOAD,
+    PYTHON_GC_THRESHOLDS,
+)
+from azure_functions_worker.utils import gc_tuning
+
+
+class TestGcTuning(testutils.AppSettingsTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self._thresholds = gc.get_threshold()
+
+    def tearDown(self):
+        gc.unfreeze()
+        gc.set_threshold(*self._thresholds)
+        super().tearDown()
+
+    def test_get_thresholds(self):
+        self.set_app_settings({PYTHON_GC_THRESHOLDS: '50000,20,100'})
+        self.assertEqual(gc_tuning.get_thresholds(), (50000, 20, 100))
+        self.set_app_settings({PYTHON_GC_THRESHOLDS: '50000'})
+        self.assertEqual(gc_tuning.get_thresholds(), (50000,))
+        for invalid_value in ('', 'x', '1,2,3,4', '-1'):
+            self.set_app_settings({PYTHON_GC_THRESHOLDS: invalid_value})
+            self.assertIsNone(gc_tuning.get_thresholds())
+
+    def test_tuning_disabled(self):
+        self.set_app_settings({PYTHON_GC_FREEZE_AFTER_LOAD: None,
+                               PYTHON_GC_THRESHOLDS: None})
+        self.assertFalse(gc_tuning.is_tuning_enabled())
+        gc_tuning.apply_tuning()
+        self.assertEqual(gc.get_freeze_count(), 0)
+        self.assertEqual(gc.get_threshold(), self._thresholds)
+
+    def test_apply_tuning(self):
+        self.set_app_settings({PYTHON_GC_FREEZE_AFTER_LOAD: 'true',
+                               PYTHON_GC_THRESHOLDS: '50000,20,100'})
+        self.assertTrue(gc_tuning.is_tuning_enabled())
+        gc_tuning.apply_tuning()
+        self.assertGreater(gc.get_freeze_count(), 0)
+        self.assertEqual(gc.get_threshold(), (50000, 20, 100))
+
+    def test_settings_read_from_snapshot(self):
+        self.set_app_settings({PYTHON_GC_FREEZE_AFTER_LOAD: None,
+                               PYTHON_GC_THRESHOLDS: None})
+        # Not taken into account until the app settings are reloaded
+        os.environ[PYTHON_GC_FREEZE_AFTER_LOAD] = 'true'
+        os.environ[PYTHON_GC_THRESHOLDS] = '50000'
+        self.assertFalse(gc_tuning.is_tuning_enabled())
+
+
+class TestGcPauseMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.metrics = gc_tuning.GcPauseMetrics()
+
+    def tearDown(self):
+        self.metrics.stop()
+        self.loop.close()
+
+    def test_record_pauses(self):
+        self.metrics.start(self.loop, 60, lambda summary: None)
+        gc.collect()
+        gc.collect(0)
+        summary = self.metrics.get_summary()
+        self.assertGreaterEqual(summary[2]['count'], 1)
+        self.assertGreaterEqual(summary[0]['count'], 1)
+        self.assertGreaterEqual(summary[2]['max_ms'], summary[2]['p99_ms'])
+        self.assertGreaterEqual(summary[2]['total_ms'], summary[2]['max_ms'])
+
+        summaries = []
+        self.metrics.report(summaries.append)
+        self.assertGreaterEqual(summaries[0][2]['count'], 1)
+        self.assertEqual(self.metrics.get_summary()[2]['count'], 0)
+        # Nothing is emitted without collections
+        self.metrics.report(summaries.append)
+        self.assertEqual(len(summaries), 1)
+
+        self.metrics.stop()
+        gc.collect()
+        self.assertEqual(self.metrics.get_summary()[2]['count'], 0)
+
+    def test_start_twice(self):
+        self.metrics.start(self.loop, 60, lambda summary: None)
+        report_handle = self.metrics._report_handle
+        self.metrics.start(self.loop, 60, lambda summary: None)
+        self.assertEqual(gc.callbacks.count(self.metrics._on_collection), 1)
+        self.assertIs(self.metrics._report_handle, report_handle)
+
+    def test_periodic_report(self):
+        summaries = []
+        self.metrics.start(self.loop, 0.01, summaries.append)
+        gc.collect()
+        self.loop.run_until_complete(asyncio.sleep(0.05))
+        self.assertGreaterEqual(summaries[0][2]['count'], 1)
+
+    def test_emit_gc_pause_metrics(self):
+        disp = testutils.create_dummy_dispatcher()
+        disp._emit_gc_pause_metrics({
+            generation: {'count': 2, 'total_ms': 3.0, 'max_ms': 2.0,
+                         'p99_ms': 2.0}
+            for generation in range(3)})
+
+        logs = []
+        while not disp._grpc_resp_queue.empty():
+            logs.append(disp._grpc_resp_queue.get_nowait().rpc_log)
+        self.assertEqual(len(logs), 3)
+        self.assertEqual(logs[2].log_category,
+                         protos.RpcLog.RpcLogCategory.Value('CustomMetric'))
+        self.assertEqual(logs[2].propertiesMap['Name'].string,
+                         'PythonGcPause_gen2_ms')
+        self.assertEqual(logs[2].propertiesMap['Value'].double, 3.0)
+        self.assertEqual(logs[2].propertiesMap['Count'].int, 2)
+
+
+class TestGcTuningSchedule(testutils.AppSettingsTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.loop = asyncio.new_event_loop()
+        self.disp = testutils.create_dummy_dispatcher()
+        self.disp._loop = self.loop
+        self.set_app_settings({PYTHON_GC_FREEZE_AFTER_LOAD: 'true',
+                               PYTHON_GC_THRESHOLDS: '50000,20,100'})
+
+    def tearDown(self):
+        if self.disp._gc_tuning_handle is not None:
+            self.disp._gc_tuning_handle.cancel()
+        self.loop.close()
+        super().tearDown()
+
+    @patch('azure_functions_worker.dispatcher.'
+           'PYTHON_GC_TUNING_DELAY_SECONDS', 0.01)
+    def test_freeze_postponed_while_invocations_run(self):
+        with patch.object(gc_tuning, 'apply_thresholds') as thresholds_mock, \
+                patch.object(gc_tuning, 'freeze') as freeze_mock:
+            self.disp._active_invocations = 1
+            self.disp._schedule_gc_tuning()
+            self.loop.run_until_complete(asyncio.sleep(0.05))
+            # The thresholds are applied right away
+            thresholds_mock.assert_called_once()
+            freeze_mock.assert_not_called()
+
+            self.disp._active_invocations = 0
+            self.loop.run_until_complete(asyncio.sleep(0.05))
+            freeze_mock.assert_called_once()
+        self.assertIsNone(self.disp._gc_tuning_handle)
+
+    @patch('azure_functions_worker.dispatcher.'
+           'PYTHON_GC_TUNING_DELAY_SECONDS', 0.01)
+    @patch('azure_functions_worker.dispatcher.'
+           'PYTHON_GC_FREEZE_MAX_DELAY_SECONDS', 0.03)
+    def test_freeze_postponed_for_a_while_at_most(self):
+        with patch.object(gc_tuning, 'apply_thresholds'), \
+                patch.object(gc_tuning, 'freeze') as freeze_mock:
+            # The worker is never idle
+            self.disp._active_invocations = 1
+            self.disp._schedule_gc_tuning()
+            self.loop.run_until_complete(asyncio.sleep(0.1))
+            freeze_mock.assert_called_once()
+        self.assertIsNone(self.disp._gc_tuning_handle)
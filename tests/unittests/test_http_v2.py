@@ -1,14 +1,24 @@
 import asyncio
+import os
 import socket
 import sys
+import time
+import tracemalloc
+import types
 import unittest
 from unittest.mock import MagicMock, patch
 
+from azure_functions_worker import protos
 from azure_functions_worker.http_v2 import (
     AsyncContextReference,
+    HttpResponseCache,
+    HttpV2Registry,
     SingletonMeta,
+    get_http_route_params,
     get_unused_tcp_port,
     http_coordinator,
+    http_response_cache,
+    initialize_http_server,
 )
 
 
@@ -98,9 +108,8 @@ class TestHttpCoordinator(unittest.TestCase):
         response = self.loop.run_until_complete(
             http_coordinator.await_http_response_async(invoc_id))
         self.assertEqual(response, expected_response)
-        self.assertTrue(
-            http_coordinator._context_references.get(
-                invoc_id).http_response is None)
+        # The context reference is removed once the response is delivered
+        self.assertNotIn(invoc_id, http_coordinator._context_references)
 
     def test_await_http_response_async_invalid_invocation(self):
         # Test handling error when invoc_id is not found
@@ -128,6 +137,130 @@ class TestHttpCoordinator(unittest.TestCase):
         self.assertEqual(str(context.exception),
                          f"No http response found for invocation {invoc_id}")
 
+    def test_request_response_cycle_removes_context(self):
+        async def invocation():
+            request = await http_coordinator.get_http_request_async(
+                self.invoc_id)
+            self.assertEqual(request, self.http_request)
+            http_coordinator.set_http_response(self.invoc_id,
+                                               self.http_response)
+
+        async def http_server():
+            http_coordinator.set_http_request(self.invoc_id,
+                                              self.http_request)
+            return await http_coordinator.await_http_response_async(
+                self.invoc_id)
+
+        _, response = self.loop.run_until_complete(
+            asyncio.gather(invocation(), http_server()))
+        self.assertEqual(response, self.http_response)
+        self.assertEqual(http_coordinator.live_contexts, 0)
+
+    @patch.object(http_coordinator, '_timeout', 0.1)
+    def test_await_http_response_async_orphaned_request(self):
+        # An HTTP request that no invocation picks up times out
+        http_coordinator.set_http_request(self.invoc_id, self.http_request)
+        with self.assertRaises(TimeoutError):
+            self.loop.run_until_complete(
+                http_coordinator.await_http_response_async(self.invoc_id))
+        self.assertEqual(http_coordinator.live_contexts, 0)
+
+    @patch.object(http_coordinator, '_timeout', 0.1)
+    def test_await_http_response_async_long_running_function(self):
+        # The response of a function still executing is waited for past the
+        # timeout
+        async def invocation():
+            await http_coordinator.get_http_request_async(self.invoc_id)
+            await asyncio.sleep(0.3)
+            http_coordinator.set_http_response(self.invoc_id,
+                                               self.http_response)
+
+        http_coordinator.set_http_request(self.invoc_id, self.http_request)
+        _, response = self.loop.run_until_complete(asyncio.gather(
+            invocation(),
+            http_coordinator.await_http_response_async(self.invoc_id)))
+        self.assertEqual(response, self.http_response)
+        self.assertEqual(http_coordinator.live_contexts, 0)
+
+    @patch.object(http_coordinator, '_timeout', 0.1)
+    def test_get_http_request_async_orphaned_invocation(self):
+        # An invocation whose HTTP request never arrives times out
+        with self.assertRaises(TimeoutError):
+            self.loop.run_until_complete(
+                http_coordinator.get_http_request_async(self.invoc_id))
+        # The failure can still be set as the response
+        http_coordinator.set_http_response(self.invoc_id, TimeoutError())
+
+    @patch.object(http_coordinator, '_timeout', 0.1)
+    @patch.object(http_coordinator, '_last_eviction', 0)
+    def test_evict_expired_contexts(self):
+        in_flight_invoc_id = "in_flight_invocation"
+        orphaned_invoc_id = "orphaned_invocation"
+        undelivered_invoc_id = "undelivered_invocation"
+        for invoc_id in (in_flight_invoc_id, orphaned_invoc_id,
+                         undelivered_invoc_id):
+            http_coordinator.set_http_request(invoc_id, self.http_request)
+        for invoc_id in (in_flight_invoc_id, undelivered_invoc_id):
+            self.loop.run_until_complete(
+                http_coordinator.get_http_request_async(invoc_id))
+        http_coordinator.set_http_response(undelivered_invoc_id,
+                                           self.http_response)
+        self.loop.run_until_complete(asyncio.sleep(0.2))
+
+        http_coordinator.set_http_request(self.invoc_id, self.http_request)
+        self.assertIn(in_flight_invoc_id, http_coordinator._context_references)
+        self.assertNotIn(orphaned_invoc_id,
+                         http_coordinator._context_references)
+        self.assertNotIn(undelivered_invoc_id,
+                         http_coordinator._context_references)
+        self.assertEqual(http_coordinator.live_contexts, 2)
+
+    @patch.object(http_coordinator, '_timeout', 0.1)
+    @patch.object(http_coordinator, '_last_eviction', 0)
+    def test_evict_keeps_response_set_not_yet_popped(self):
+        # The invocation outlived the timeout and has just set its response
+        http_coordinator.set_http_request(self.invoc_id, self.http_request)
+        self.loop.run_until_complete(
+            http_coordinator.get_http_request_async(self.invoc_id))
+        self.loop.run_until_complete(asyncio.sleep(0.2))
+        http_coordinator.set_http_response(self.invoc_id, self.http_response)
+
+        http_coordinator.set_http_request("other_invocation",
+                                          self.http_request)
+        self.assertIn(self.invoc_id, http_coordinator._context_references)
+        response = self.loop.run_until_complete(
+            http_coordinator.await_http_response_async(self.invoc_id))
+        self.assertEqual(response, self.http_response)
+
+    def test_pop_evicted_context(self):
+        with self.assertRaises(ValueError):
+            http_coordinator._pop_http_request("evicted_invocation")
+        with self.assertRaises(ValueError):
+            http_coordinator._pop_http_response("evicted_invocation")
+
+    def test_memory_stays_flat(self):
+        async def request_cycle(invoc_id):
+            http_coordinator.set_http_request(invoc_id, MockHttpRequest())
+            await http_coordinator.get_http_request_async(invoc_id)
+            http_coordinator.set_http_response(invoc_id, MockHttpResponse())
+            await http_coordinator.await_http_response_async(invoc_id)
+
+        async def soak(start):
+            for i in range(start, start + 10000):
+                await request_cycle(str(i))
+
+        self.loop.run_until_complete(soak(0))
+        tracemalloc.start()
+        try:
+            self.loop.run_until_complete(soak(10000))
+            baseline, _ = tracemalloc.get_traced_memory()
+            self.loop.run_until_complete(soak(20000))
+            current, _ = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        self.assertEqual(http_coordinator.live_contexts, 0)
+        self.assertLess(current - baseline, 64 * 1024)
+
 
 @unittest.skipIf(sys.version_info <= (3, 7), "Skipping tests if <= Python 3.7")
 class TestAsyncContextReference(unittest.TestCase):
@@ -251,3 +384,332 @@ class TestGetUnusedTCPPort(unittest.TestCase):
 
         # Assert that the returned port matches the expected value
         self.assertEqual(port, 12345)
+
+
+class TestGetHttpRouteParams(unittest.TestCase):
+
+    def test_get_http_route_params(self):
+        pb = protos.ParameterBinding(
+            name='req',
+            data=protos.TypedData(http=protos.RpcHttp(
+                method='GET',
+                url='http://localhost/api/items/42',
+                headers={'accept': 'application/json'},
+                params={'id': '42', 'category': 'books'},
+                query={'q': 'python'},
+                body=protos.TypedData(bytes=b'body'))))
+        self.assertEqual(get_http_route_params(pb),
+                         {'id': '42', 'category': 'books'})
+
+    def test_get_http_route_params_no_params(self):
+        pb = protos.ParameterBinding(
+            name='req',
+            data=protos.TypedData(http=protos.RpcHttp(method='GET')))
+        self.assertEqual(get_http_route_params(pb), {})
+
+    def test_get_http_route_params_not_inline(self):
+        pb = protos.ParameterBinding(
+            name='req',
+            rpc_shared_memory=protos.RpcSharedMemory(
+                name='mem_map', offset=0, count=10,
+                type=protos.RpcDataType.http))
+        self.assertIsNone(get_http_route_params(pb))
+
+        pb = protos.ParameterBinding(
+            name='req', data=protos.TypedData(string='not http'))
+        self.assertIsNone(get_http_route_params(pb))
+
+
+class MockCacheHttpRequest:
+    def __init__(self, url='http://localhost/api/products?page=1',
+                 method='GET', headers=None):
+        self.url = url
+        self.method = method
+        self.headers = headers or {}
+
+
+class MockCacheHttpResponse:
+    def __init__(self, body=b'products', status_code=200, headers=None):
+        self.body = body
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.background = None
+
+
+class MockStandardResponse:
+    def __init__(self, content=None, status_code=200, headers=None):
+        self.body = content
+        self.status_code = status_code
+        self.headers = headers
+
+
+class TestHttpResponseCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = HttpResponseCache()
+        functions_setting = {
+            'PYTHON_HTTP_V2_RESPONSE_CACHE_FUNCTIONS':
+                'get_products:60, get_product'}
+        with patch.dict(os.environ, functions_setting):
+            self.cache.load_settings(MockStandardResponse)
+
+    def test_load_settings(self):
+        self.assertTrue(self.cache.enabled)
+        self.assertEqual(self.cache.function_ttls,
+                         {'get_products': 60.0, 'get_product': 60})
+        self.assertEqual(self.cache.vary_headers, ('accept',))
+
+        settings = {
+            'PYTHON_HTTP_V2_RESPONSE_CACHE_FUNCTIONS': 'f:abc,g:5',
+            'PYTHON_HTTP_V2_RESPONSE_CACHE_MAX_BYTES': '1024',
+            'PYTHON_HTTP_V2_RESPONSE_CACHE_VARY_HEADERS':
+                'Accept, Accept-Language'}
+        with patch.dict(os.environ, settings):
+            self.cache.load_settings()
+        self.assertEqual(self.cache.function_ttls, {'g': 5.0})
+        self.assertEqual(self.cache.max_bytes, 1024)
+        self.assertEqual(self.cache.vary_headers,
+                         ('accept', 'accept-language'))
+
+    def test_disabled(self):
+        cache = HttpResponseCache()
+        cache.load_settings()
+        self.assertFalse(cache.enabled)
+        request = MockCacheHttpRequest()
+        cache.put('get_products', request, MockCacheHttpResponse())
+        self.assertIsNone(cache.get(request))
+        self.assertEqual(len(cache), 0)
+
+    def test_put_get(self):
+        request = MockCacheHttpRequest()
+        response = MockCacheHttpResponse()
+        self.assertIsNone(self.cache.get(request))
+        self.cache.put('get_products', request, response)
+        # An ETag is added to the response
+        self.assertIn('etag', response.headers)
+        cached_responses = [self.cache.get(MockCacheHttpRequest())
+                            for _ in range(2)]
+        # Each hit gets its own response
+        self.assertIsNot(cached_responses[0], cached_responses[1])
+        for cached_response in cached_responses:
+            self.assertIsInstance(cached_response, MockStandardResponse)
+            self.assertEqual(cached_response.status_code, 200)
+            self.assertEqual(cached_response.body, b'products')
+            self.assertEqual(cached_response.headers, response.headers)
+        cached_responses[0].headers['x-custom'] = 'value'
+        self.assertNotIn('x-custom',
+                         self.cache.get(MockCacheHttpRequest()).headers)
+        self.assertEqual(self.cache.used_bytes, len(b'products'))
+        self.assertEqual((self.cache.hits, self.cache.misses), (3, 1))
+        self.assertEqual(self.cache.hit_ratio, 0.75)
+
+    def test_key(self):
+        self.cache.put('get_products', MockCacheHttpRequest(
+            headers={'accept': 'application/json'}), MockCacheHttpResponse())
+        self.assertIsNone(self.cache.get(MockCacheHttpRequest(
+            headers={'accept': 'text/html'})))
+        self.assertIsNone(self.cache.get(MockCacheHttpRequest(
+            url='http://localhost/api/products?page=2',
+            headers={'accept': 'application/json'})))
+        self.assertIsNotNone(self.cache.get(MockCacheHttpRequest(
+            headers={'accept': 'application/json'})))
+
+    def test_not_cached(self):
+        cases = [
+            ('get_orders', MockCacheHttpRequest(), MockCacheHttpResponse()),
+            ('get_products', MockCacheHttpRequest(method='POST'),
+             MockCacheHttpResponse()),
+            ('get_products',
+             MockCacheHttpRequest(headers={'authorization': 'Bearer token'}),
+             MockCacheHttpResponse()),
+            ('get_products', MockCacheHttpRequest(),
+             MockCacheHttpResponse(status_code=404)),
+            ('get_products', MockCacheHttpRequest(),
+             MockCacheHttpResponse(headers={'set-cookie': 'session=1'})),
+            ('get_products', MockCacheHttpRequest(),
+             MockCacheHttpResponse(headers={'cache-control': 'no-store'})),
+            ('get_products', MockCacheHttpRequest(), 'not a response'),
+        ]
+        repeated_headers_response = MockCacheHttpResponse()
+        repeated_headers_response.headers = MagicMock()
+        repeated_headers_response.headers.items.return_value = [
+            ('link', '</page/2>'), ('link', '</page/3>')]
+        cases.append(('get_products', MockCacheHttpRequest(),
+                      repeated_headers_response))
+        for function_name, request, response in cases:
+            self.cache.put(function_name, request, response)
+        self.assertEqual(len(self.cache), 0)
+
+    def test_app_service_authentication_not_cached(self):
+        """Responses to callers identified by App Service Authentication are
+        specific to them, they are neither cached nor served from the cache
+        """
+        self.cache.put('get_products', MockCacheHttpRequest(),
+                       MockCacheHttpResponse())
+        for header in ('x-ms-client-principal', 'x-ms-client-principal-id',
+                       'X-MS-CLIENT-PRINCIPAL-NAME',
+                       'x-ms-token-aad-access-token'):
+            request = MockCacheHttpRequest(headers={header: 'user'})
+            self.assertIsNone(self.cache.get(request), header)
+            self.cache.put('get_products', request, MockCacheHttpResponse(
+                body=b'user'))
+        self.assertEqual(len(self.cache), 1)
+        self.assertEqual(self.cache.get(MockCacheHttpRequest()).body,
+                         b'products')
+
+    def test_ttl(self):
+        request = MockCacheHttpRequest()
+        self.cache.function_ttls['get_products'] = 0.05
+        self.cache.put('get_products', request, MockCacheHttpResponse())
+        self.assertIsNotNone(self.cache.get(request))
+        time.sleep(0.1)
+        self.assertIsNone(self.cache.get(request))
+        self.assertEqual(len(self.cache), 0)
+        self.assertEqual(self.cache.used_bytes, 0)
+
+    def test_lru_eviction(self):
+        self.cache.max_bytes = 20
+        for page in range(3):
+            self.cache.put('get_products', MockCacheHttpRequest(
+                url=f'http://localhost/api/products?page={page}'),
+                MockCacheHttpResponse(body=b'0123456789'))
+            # Page 0 is the most recently used
+            self.cache.get(MockCacheHttpRequest(
+                url='http://localhost/api/products?page=0'))
+        self.assertEqual(len(self.cache), 2)
+        self.assertEqual(self.cache.used_bytes, 20)
+        self.assertEqual(self.cache.evictions, 1)
+        self.assertIsNone(self.cache.get(MockCacheHttpRequest(
+            url='http://localhost/api/products?page=1')))
+
+    def test_if_none_match(self):
+        response = MockCacheHttpResponse(headers={'etag': '"v1"'})
+        self.cache.put('get_products', MockCacheHttpRequest(), response)
+        not_modified = self.cache.get(MockCacheHttpRequest(
+            headers={'if-none-match': '"v0", "v1"'}))
+        self.assertIsInstance(not_modified, MockStandardResponse)
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified.headers, {'etag': '"v1"'})
+        self.assertEqual(self.cache.get(MockCacheHttpRequest(
+            headers={'if-none-match': '"v0"'})).status_code, 200)
+
+    def test_no_response_type(self):
+        self.cache.load_settings()
+        self.cache.put('get_products', MockCacheHttpRequest(),
+                       MockCacheHttpResponse())
+        self.assertEqual(len(self.cache), 0)
+
+
+class MockWebApp:
+    routes = []
+
+    def route(self, func):
+        self.routes.append(func)
+        return func
+
+
+class MockStreamingResponse:
+    def __init__(self, content):
+        self.body_iterator = content
+
+
+class MockWebServer:
+    instances = []
+
+    def __init__(self, hostname, port, web_app):
+        self.hostname = hostname
+        self.port = port
+        self.instances.append(self)
+
+    async def serve(self):
+        pass
+
+
+@unittest.skipIf(sys.version_info <= (3, 7), "Skipping tests if <= Python 3.7")
+class TestInitializeHttpServer(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        MockWebServer.instances.clear()
+        MockWebApp.routes.clear()
+
+    def tearDown(self):
+        self.loop.close()
+
+    def _initialize_http_server(self):
+        extension_module = types.SimpleNamespace(WebApp=MockWebApp,
+                                                 WebServer=MockWebServer)
+        ext_base = MagicMock()
+        ext_base.ResponseTrackerMeta.get_response_type.return_value = \
+            MockStreamingResponse
+        ext_base.ResponseTrackerMeta.get_standard_response_type.return_value \
+            = MockStandardResponse
+        with patch.object(HttpV2Registry, 'ext_base',
+                          return_value=ext_base), \
+                patch('importlib.import_module',
+                      return_value=extension_module):
+            address = initialize_http_server('127.0.0.1')
+        # Run the server task
+        self.loop.run_until_complete(asyncio.sleep(0))
+        return address
+
+    def test_initialize_http_server(self):
+        address = self._initialize_http_server()
+        web_server = MockWebServer.instances[0]
+        self.assertEqual(web_server.hostname, '127.0.0.1')
+        self.assertEqual(address, f'http://127.0.0.1:{web_server.port}')
+
+    def _serve_request(self, function_result):
+        self._initialize_http_server()
+        catch_all = MockWebApp.routes[0]
+        request = MagicMock(headers={'x-ms-invocation-id': 'invoc_id'})
+
+        async def invocation():
+            await http_coordinator.get_http_request_async('invoc_id')
+            http_coordinator.set_http_response('invoc_id', function_result)
+
+        response, _ = self.loop.run_until_complete(
+            asyncio.gather(catch_all(request), invocation()))
+        return response
+
+    def test_catch_all_streams_async_generator(self):
+        async def chunks():
+            yield b'hello '
+            yield b'world'
+
+        content = chunks()
+        response = self._serve_request(content)
+        self.assertIsInstance(response, MockStreamingResponse)
+        self.assertIs(response.body_iterator, content)
+
+    def test_catch_all_streams_generator(self):
+        content = (chunk for chunk in (b'hello ', b'world'))
+        response = self._serve_request(content)
+        self.assertIsInstance(response, MockStreamingResponse)
+        self.assertIs(response.body_iterator, content)
+
+    def test_catch_all_returns_response(self):
+        for result in ('hello', b'hello', ['hello'], {'hello': 'world'},
+                       MockHttpResponse()):
+            self.assertIs(self._serve_request(result), result)
+
+    def test_catch_all_serves_cached_response(self):
+        response = MockCacheHttpResponse()
+        with patch.dict(os.environ, {
+                'PYTHON_HTTP_V2_RESPONSE_CACHE_FUNCTIONS': 'get_products'}):
+            self._initialize_http_server()
+        self.addCleanup(http_response_cache.load_settings)
+        catch_all = MockWebApp.routes[0]
+        request = MockCacheHttpRequest(
+            headers={'x-ms-invocation-id': 'invoc_id'})
+        http_response_cache.put('get_products', request, response)
+
+        # The response is served without waiting for the invocation
+        cached_response = self.loop.run_until_complete(catch_all(request))
+        self.assertIsInstance(cached_response, MockStandardResponse)
+        self.assertEqual(cached_response.body, response.body)
+        self.loop.run_until_complete(
+            http_coordinator.get_http_request_async('invoc_id'))
+        self.assertTrue(http_coordinator.pop_served_from_cache('invoc_id'))
+        self.assertEqual(http_coordinator.live_contexts, 0)
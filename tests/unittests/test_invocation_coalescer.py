@@ -0,0 +1,69 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+import asyncio
+
+from tests.utils import testutils
+
+from azure_functions_worker.utils.coalescing import InvocationCoalescer
+
+
+class TestInvocationCoalescer(testutils.AsyncTestCase):
+
+    def setUp(self):
+        self.coalescer = InvocationCoalescer()
+        self.calls = 0
+
+    async def _expensive(self, result='result'):
+        self.calls += 1
+        await asyncio.sleep(0.05)
+        return result
+
+    async def _failing(self):
+        self.calls += 1
+        await asyncio.sleep(0.05)
+        raise ValueError('failed')
+
+    async def test_concurrent_invocations_coalesced(self):
+        results = await asyncio.gather(*(
+            self.coalescer.run('key', self._expensive) for _ in range(10)))
+        self.assertEqual(results, ['result'] * 10)
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(self.coalescer.leaders, 1)
+        self.assertEqual(self.coalescer.followers, 9)
+        self.assertEqual(self.coalescer.coalesce_ratio, 0.9)
+        self.assertEqual(len(self.coalescer), 0)
+
+    async def test_different_keys_not_coalesced(self):
+        results = await asyncio.gather(
+            self.coalescer.run('a', lambda: self._expensive('a')),
+            self.coalescer.run('b', lambda: self._expensive('b')))
+        self.assertEqual(results, ['a', 'b'])
+        self.assertEqual(self.calls, 2)
+        self.assertEqual(self.coalescer.coalesce_ratio, 0.0)
+
+    async def test_sequential_invocations_not_coalesced(self):
+        await self.coalescer.run('key', self._expensive)
+        self.assertFalse(self.coalescer.is_in_flight('key'))
+        await self.coalescer.run('key', self._expensive)
+        self.assertEqual(self.calls, 2)
+        self.assertEqual(self.coalescer.followers, 0)
+
+    async def test_exception_propagated_to_followers(self):
+        results = await asyncio.gather(
+            *(self.coalescer.run('key', self._failing) for _ in range(3)),
+            return_exceptions=True)
+        self.assertEqual(self.calls, 1)
+        for result in results:
+            self.assertIsInstance(result, ValueError)
+        self.assertEqual(len(self.coalescer), 0)
+
+    async def test_follower_cancellation_does_not_cancel_leader(self):
+        leader = asyncio.ensure_future(
+            self.coalescer.run('key', self._expensive))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(
+            self.coalescer.run('key', self._expensive))
+        await asyncio.sleep(0)
+        follower.cancel()
+        self.assertEqual(await leader, 'result')
+        self.assertTrue(follower.cancelled())
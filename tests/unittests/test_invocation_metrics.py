@@ -0,0 +1,198 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+import asyncio
+import contextvars
+import os
+import time
+import unittest
+from unittest.mock import patch
+
+from tests.utils import testutils
+
+from azure_functions_worker import protos
+from azure_functions_worker.constants import PYTHON_ENABLE_INVOCATION_METRICS
+from azure_functions_worker.extension import ExtensionManager
+from azure_functions_worker.utils import invocation_metrics
+
+
+class TestInvocationMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.metrics = invocation_metrics.InvocationMetrics()
+
+    def tearDown(self):
+        self.metrics.stop()
+        self.loop.close()
+
+    def _record_invocation(self, function_name: str, user_code: float):
+        def run_invocation():
+            timer = self.metrics.start_timer(time.perf_counter() - 0.001)
+            self.assertIs(invocation_metrics.get_current_timer(), timer)
+            timer.function_name = function_name
+            invocation_metrics.add_to_current_timer(
+                invocation_metrics.SHARED_MEMORY, 0.002)
+            timer.durations[invocation_metrics.USER_CODE] = user_code
+            self.metrics.record(timer)
+
+        # Each invocation runs in its own task, i.e. context
+        contextvars.copy_context().run(run_invocation)
+
+    def test_no_current_timer(self):
+        self.assertIsNone(invocation_metrics.get_current_timer())
+        invocation_metrics.add_to_current_timer(
+            invocation_metrics.SHARED_MEMORY, 1)
+
+    def test_timer_laps(self):
+        timer = invocation_metrics.InvocationTimer(time.perf_counter())
+        time.sleep(0.01)
+        timer.lap(invocation_metrics.QUEUED)
+        timer.mark()
+        timer.lap(invocation_metrics.INPUT_DECODE)
+        self.assertGreaterEqual(
+            timer.durations[invocation_metrics.QUEUED], 0.01)
+        self.assertLess(
+            timer.durations[invocation_metrics.INPUT_DECODE], 0.01)
+
+    def test_histogram(self):
+        histogram = invocation_metrics.Histogram()
+        for value_ms in range(1, 101):
+            histogram.add(value_ms)
+        self.assertEqual(histogram.count, 100)
+        self.assertEqual(histogram.max_ms, 100)
+        self.assertEqual(histogram.get_percentile(0.5), 50)
+        self.assertEqual(histogram.get_percentile(0.99), 100)
+
+        histogram.add(20000)
+        self.assertEqual(histogram.get_percentile(1), 20000)
+
+    def test_get_summary(self):
+        for user_code in (0.01, 0.02, 0.03):
+            self._record_invocation('http_trigger', user_code)
+        self._record_invocation('timer_trigger', 1)
+        # Failed before the function was found
+        self.metrics.record(invocation_metrics.InvocationTimer(0))
+
+        summary = self.metrics.get_summary()
+        self.assertEqual(set(summary), {'http_trigger', 'timer_trigger'})
+        self.assertEqual(set(summary['http_trigger']),
+                         set(invocation_metrics.PHASES))
+        user_code = summary['http_trigger']['user_code']
+        self.assertEqual(user_code['count'], 3)
+        self.assertAlmostEqual(user_code['mean_ms'], 20)
+        self.assertEqual(user_code['p50_ms'], 25)
+        self.assertAlmostEqual(user_code['max_ms'], 30)
+        self.assertAlmostEqual(
+            summary['http_trigger']['shared_memory']['mean_ms'], 2)
+        self.assertGreaterEqual(
+            summary['http_trigger']['queued']['mean_ms'], 1)
+
+        self.assertEqual(self.metrics.get_summary(), {})
+
+    def test_coalesced_invocation_not_recorded(self):
+        timer = invocation_metrics.InvocationTimer(0)
+        timer.function_name = 'http_trigger'
+        timer.coalesced = True
+        self.metrics.record(timer)
+        self.assertEqual(self.metrics.get_summary(), {})
+
+    def test_start_twice(self):
+        self.metrics.start(self.loop, 60, lambda summary: None)
+        report_handle = self.metrics._report_handle
+        self.metrics.start(self.loop, 60, lambda summary: None)
+        self.assertIs(self.metrics._report_handle, report_handle)
+
+    def test_periodic_report(self):
+        summaries = []
+        self.metrics.start(self.loop, 0.01, summaries.append)
+        self.assertTrue(self.metrics.enabled)
+        self._record_invocation('http_trigger', 0.01)
+        self.loop.run_until_complete(asyncio.sleep(0.05))
+        # Nothing is emitted without invocations
+        self.assertEqual(len(summaries), 1)
+        self.assertEqual(summaries[0]['http_trigger']['user_code']['count'],
+                         1)
+
+        self.metrics.stop()
+        self.assertFalse(self.metrics.enabled)
+
+    def test_emit_invocation_metrics(self):
+        self._record_invocation('http_trigger', 0.01)
+        disp = testutils.create_dummy_dispatcher()
+        disp._emit_invocation_metrics(self.metrics.get_summary())
+
+        logs = []
+        while not disp._grpc_resp_queue.empty():
+            logs.append(disp._grpc_resp_queue.get_nowait().rpc_log)
+        self.assertEqual(len(logs), len(invocation_metrics.PHASES))
+        user_code_log = next(
+            log for log in logs if log.propertiesMap['Name'].string
+            == 'PythonInvocation_user_code_ms')
+        self.assertEqual(user_code_log.log_category,
+                         protos.RpcLog.RpcLogCategory.Value('CustomMetric'))
+        self.assertEqual(user_code_log.propertiesMap['FunctionName'].string,
+                         'http_trigger')
+        self.assertAlmostEqual(user_code_log.propertiesMap['Value'].double,
+                               10)
+        self.assertEqual(user_code_log.propertiesMap['Count'].int, 1)
+
+    def test_report_invocation_metrics_with_hook_timings(self):
+        self._record_invocation('http_trigger', 0.01)
+        hook_timings = {
+            'MyExtension.pre_invocation': {
+                'count': 4, 'total_ms': 10.0, 'max_ms': 5.0
+            }
+        }
+        disp = testutils.create_dummy_dispatcher()
+        with patch.object(ExtensionManager, 'get_hook_timings',
+                          return_value=hook_timings):
+            disp._report_invocation_metrics(self.metrics.get_summary())
+
+        logs = []
+        while not disp._grpc_resp_queue.empty():
+            logs.append(disp._grpc_resp_queue.get_nowait().rpc_log)
+        self.assertEqual(len(logs), len(invocation_metrics.PHASES) + 1)
+        hook_log = logs[-1]
+        self.assertEqual(hook_log.propertiesMap['Name'].string,
+                         'PythonExtensionHook_ms')
+        self.assertEqual(hook_log.propertiesMap['HookName'].string,
+                         'MyExtension.pre_invocation')
+        self.assertAlmostEqual(hook_log.propertiesMap['Value'].double, 2.5)
+        self.assertEqual(hook_log.propertiesMap['Count'].int, 4)
+        self.assertAlmostEqual(hook_log.propertiesMap['Max'].double, 5)
+
+
+class TestInvocationMetricsMockHost(testutils.AsyncTestCase):
+
+    @patch.dict(os.environ, {PYTHON_ENABLE_INVOCATION_METRICS: 'true'})
+    async def test_invocation_phases(self):
+        mockhost = testutils.start_mockhost()
+        async with mockhost as host:
+            await host.init_worker()
+            await host.load_function('return_str')
+            for _ in range(2):
+                _, r = await host.invoke_function(
+                    'return_str', [
+                        protos.ParameterBinding(
+                            name='req',
+                            data=protos.TypedData(
+                                http=protos.RpcHttp(method='GET')))
+                    ])
+                self.assertEqual(r.response.result.status,
+                                 protos.StatusResult.Success)
+
+            # Recorded once the gRPC thread wrote the responses
+            metrics = mockhost._worker._invocation_metrics
+            for _ in range(50):
+                histograms = metrics._histograms.get('return_str')
+                if histograms is not None and histograms[0].count == 2:
+                    break
+                await asyncio.sleep(0.01)
+            summary = metrics.get_summary()
+
+        phases = summary['return_str']
+        self.assertEqual(phases['user_code']['count'], 2)
+        for phase in ('queued', 'input_decode', 'thread_pool_wait',
+                      'user_code', 'output_encode', 'response_write'):
+            self.assertGreater(phases[phase]['mean_ms'], 0, phase)
+        self.assertEqual(phases['shared_memory']['mean_ms'], 0)
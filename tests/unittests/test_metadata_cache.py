@@ -0,0 +1,100 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+import os
+import pathlib
+import sys
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from azure_functions_worker import metadata_cache, protos
+
+
+class TestMetadataCache(unittest.TestCase):
+
+    def setUp(self):
+        self._app_dir = tempfile.TemporaryDirectory()
+        self._cache_dir = tempfile.TemporaryDirectory()
+        self.app_dir = pathlib.Path(self._app_dir.name)
+        self.cache_dir = self._cache_dir.name
+        (self.app_dir / 'function_app.py').write_text('app = 1\n')
+        (self.app_dir / 'shared').mkdir()
+        (self.app_dir / 'shared' / 'util.py').write_text('x = 1\n')
+
+    def tearDown(self):
+        self._app_dir.cleanup()
+        self._cache_dir.cleanup()
+
+    def _get_cache_key(self):
+        return metadata_cache.get_cache_key(str(self.app_dir),
+                                            'function_app.py')
+
+    def _create_metadata(self, name):
+        return [protos.RpcFunctionMetadata(name=name, function_id=name,
+                                           directory=str(self.app_dir))]
+
+    def test_cache_key_is_stable(self):
+        self.assertEqual(self._get_cache_key(), self._get_cache_key())
+
+    def test_cache_key_changes_with_code(self):
+        key = self._get_cache_key()
+        (self.app_dir / 'shared' / 'util.py').write_text('x = 2\n')
+        self.assertNotEqual(self._get_cache_key(), key)
+
+    def test_cache_key_changes_with_script_file_name(self):
+        self.assertNotEqual(
+            metadata_cache.get_cache_key(str(self.app_dir), 'main.py'),
+            self._get_cache_key())
+
+    def test_cache_key_changes_with_packages(self):
+        site_packages = self.app_dir / '.python_packages'
+        (site_packages / 'pkg-1.0.dist-info').mkdir(parents=True)
+        with patch.object(sys, 'path', sys.path + [str(site_packages)]):
+            key = self._get_cache_key()
+            (site_packages / 'pkg-1.0.dist-info').rename(
+                site_packages / 'pkg-1.1.dist-info')
+            self.assertNotEqual(self._get_cache_key(), key)
+
+    def test_cache_key_ignores_non_code_files(self):
+        key = self._get_cache_key()
+        (self.app_dir / 'host.json').write_text('{}')
+        (self.app_dir / '.venv').mkdir()
+        (self.app_dir / '.venv' / 'site.py').write_text('y = 1\n')
+        (self.app_dir / '__pycache__').mkdir()
+        (self.app_dir / '__pycache__' / 'function_app.py').write_text('')
+        self.assertEqual(self._get_cache_key(), key)
+
+    def test_load_missing(self):
+        self.assertIsNone(metadata_cache.load(self.cache_dir, 'missing'))
+
+    def test_save_load(self):
+        metadata = self._create_metadata('http_trigger')
+        metadata_cache.save(self.cache_dir, 'key', metadata)
+        self.assertEqual(metadata_cache.load(self.cache_dir, 'key'),
+                         metadata)
+
+    def test_save_creates_cache_dir(self):
+        cache_dir = os.path.join(self.cache_dir, 'nested')
+        metadata_cache.save(cache_dir, 'key', self._create_metadata('a'))
+        self.assertIsNotNone(metadata_cache.load(cache_dir, 'key'))
+
+    def test_save_removes_other_keys(self):
+        metadata_cache.save(self.cache_dir, 'old', self._create_metadata('a'))
+        metadata_cache.save(self.cache_dir, 'new', self._create_metadata('b'))
+        self.assertIsNone(metadata_cache.load(self.cache_dir, 'old'))
+        self.assertEqual(os.listdir(self.cache_dir), ['new.metadata'])
+
+    def test_load_invalid(self):
+        cache_path = os.path.join(self.cache_dir, 'key.metadata')
+        with open(cache_path, 'wb') as f:
+            f.write(b'\xff\xff\xff')
+        self.assertIsNone(metadata_cache.load(self.cache_dir, 'key'))
+        self.assertFalse(os.path.exists(cache_path))
+
+    def test_remove(self):
+        metadata_cache.save(self.cache_dir, 'key', self._create_metadata('a'))
+        metadata_cache.remove(self.cache_dir, 'key')
+        self.assertIsNone(metadata_cache.load(self.cache_dir, 'key'))
+        # Removing a missing entry is a no-op
+        metadata_cache.remove(self.cache_dir, 'key')
@@ -0,0 +1,109 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+import os
+import pathlib
+import sys
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from azure_functions_worker.utils import packages_bundle
+from azure_functions_worker.utils.packages_bundle import PackagesBundleFinder
+
+
+class TestPackagesBundle(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp_dir = tempfile.TemporaryDirectory()
+        self.site_packages = pathlib.Path(self._tmp_dir.name, 'site-packages')
+        self._create_file('bundled_pkg/__init__.py', 'name = "pkg"\n')
+        self._create_file('bundled_pkg/sub/__init__.py', '')
+        self._create_file('bundled_pkg/sub/mod.py', 'def f():\n    return 1\n')
+        self._create_file('bundled_pkg/py.typed', '')
+        self._create_file('bundled_mod.py', 'name = "mod"\n')
+        self._create_file('data_pkg/__init__.py', 'name = "data"\n')
+        self._create_file('data_pkg/data.json', '{}')
+        self._create_file('namespace_pkg/mod.py', '')
+        self._create_file('bundled_pkg-1.0.dist-info/METADATA', '')
+
+        self._patch_sys_path = patch('sys.path',
+                                     [str(self.site_packages)] + sys.path)
+        self._patch_meta_path = patch('sys.meta_path', list(sys.meta_path))
+        self._patch_modules = patch.dict('sys.modules')
+        self._patch_sys_path.start()
+        self._patch_meta_path.start()
+        self._patch_modules.start()
+
+    def tearDown(self):
+        self._patch_modules.stop()
+        self._patch_meta_path.stop()
+        self._patch_sys_path.stop()
+        self._tmp_dir.cleanup()
+
+    def _create_file(self, path: str, content: str):
+        file_path = self.site_packages / path
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        file_path.write_text(content)
+
+    def _get_finders(self):
+        return [f for f in sys.meta_path
+                if isinstance(f, PackagesBundleFinder)]
+
+    def test_build(self):
+        names = packages_bundle.build(str(self.site_packages))
+        self.assertEqual(names, ['bundled_mod', 'bundled_pkg'])
+        self.assertTrue(os.path.isfile(
+            packages_bundle.get_bundle_path(str(self.site_packages))))
+
+    def test_install_finder_without_bundle(self):
+        self.assertIsNone(
+            packages_bundle.install_finder(str(self.site_packages)))
+        self.assertIsNone(packages_bundle.install_finder(''))
+        self.assertEqual(self._get_finders(), [])
+
+    def test_import_from_bundle(self):
+        packages_bundle.build(str(self.site_packages))
+        finder = packages_bundle.install_finder(str(self.site_packages))
+        self.assertEqual(self._get_finders(), [finder])
+
+        import bundled_mod
+        import bundled_pkg.sub.mod
+        import data_pkg
+
+        bundle_path = finder.bundle_path
+        self.assertEqual(bundled_mod.name, 'mod')
+        self.assertEqual(bundled_pkg.sub.mod.f(), 1)
+        self.assertEqual(bundled_pkg.sub.mod.__file__,
+                         os.path.join(bundle_path, 'bundled_pkg', 'sub',
+                                      'mod.py'))
+        self.assertEqual(bundled_pkg.__path__,
+                         [os.path.join(bundle_path, 'bundled_pkg')])
+        self.assertIn('return 1', finder.get_source('bundled_pkg.sub.mod'))
+        # Packages with data files are imported from site-packages
+        self.assertEqual(data_pkg.__file__,
+                         str(self.site_packages / 'data_pkg' / '__init__.py'))
+
+    def test_import_from_bundle_without_bytecode(self):
+        packages_bundle.build(str(self.site_packages))
+        finder = packages_bundle.install_finder(str(self.site_packages))
+        with patch('importlib.util.MAGIC_NUMBER', b'\0\0\0\0'):
+            code = finder.get_code('bundled_pkg.sub.mod')
+        self.assertEqual(code.co_filename,
+                         os.path.join(finder.bundle_path, 'bundled_pkg',
+                                      'sub', 'mod.py'))
+
+    def test_install_finder_ignores_outdated_bundle(self):
+        packages_bundle.build(str(self.site_packages))
+        self._create_file('new_mod.py', '')
+        self.assertIsNone(
+            packages_bundle.install_finder(str(self.site_packages)))
+        self.assertEqual(self._get_finders(), [])
+
+    def test_install_finder_replaces_finder(self):
+        packages_bundle.build(str(self.site_packages))
+        packages_bundle.install_finder(str(self.site_packages))
+        finder = packages_bundle.install_finder(str(self.site_packages))
+        self.assertEqual(self._get_finders(), [finder])
+
+        packages_bundle.remove_finders()
+        self.assertEqual(self._get_finders(), [])
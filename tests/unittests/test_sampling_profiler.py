@@ -0,0 +1,163 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+import os
+import tempfile
+import threading
+import time
+from unittest.mock import patch
+
+from tests.utils import testutils
+
+from azure_functions_worker.constants import (
+    PYTHON_PROFILER_DURATION_SECONDS,
+    PYTHON_PROFILER_OUTPUT_DIR,
+    PYTHON_PROFILER_SAMPLING_RATE,
+)
+from azure_functions_worker.utils import sampling_profiler
+
+
+class MockContext:
+    def __init__(self, function_name: str):
+        self.function_name = function_name
+        self.thread_local_storage = threading.local()
+
+
+class TestSamplingProfiler(testutils.AppSettingsTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self._tmp_dir = tempfile.TemporaryDirectory()
+        self._release = threading.Event()
+        self._threads = []
+
+    def tearDown(self):
+        self._release.set()
+        for thread in self._threads:
+            thread.join()
+        self._tmp_dir.cleanup()
+        super().tearDown()
+
+    def _start_thread(self, name: str, target, *args):
+        thread = threading.Thread(name=name, target=target, args=args)
+        thread.start()
+        self._threads.append(thread)
+
+    def _wait_for_release(self):
+        self._release.wait()
+
+    def _read_samples(self, path: str):
+        with open(path) as f:
+            return [line.rsplit(' ', 1) for line in f.read().splitlines()]
+
+    def test_sample(self):
+        disp = testutils.create_dummy_dispatcher()
+        self._start_thread('idle-thread', self._wait_for_release)
+        self._start_thread(
+            'invocation-thread', disp._run_sync_func, 'invocation-id',
+            MockContext('http_trigger'), self._wait_for_release, {})
+        # Let the threads reach their Event.wait
+        time.sleep(0.05)
+
+        profiler = sampling_profiler.SamplingProfiler(
+            self._tmp_dir.name, sampling_rate=100, duration=1)
+        for _ in range(3):
+            profiler.sample()
+        samples = self._read_samples(profiler.write())
+
+        idle_samples = [(stack, count) for stack, count in samples
+                        if stack.startswith('function:-;idle-thread;')]
+        self.assertEqual(len(idle_samples), 1)
+        self.assertEqual(idle_samples[0][1], '3')
+        self.assertIn('_wait_for_release (', idle_samples[0][0])
+
+        invocation_samples = [
+            stack for stack, _ in samples
+            if stack.startswith('function:http_trigger;invocation-thread;')]
+        self.assertEqual(len(invocation_samples), 1)
+        self.assertIn(';_run_sync_func (', invocation_samples[0])
+        # The sampling thread itself is not sampled
+        self.assertFalse(any(';test_sample (' in stack
+                             for stack, _ in samples))
+
+    def test_not_started_when_disabled(self):
+        self.set_app_settings({PYTHON_PROFILER_OUTPUT_DIR: None})
+        self.assertIsNone(sampling_profiler.start_from_app_settings())
+        self.assertNotIn('sampling-profiler',
+                         [t.name for t in threading.enumerate()])
+
+    def test_start_from_app_settings(self):
+        output_dir = os.path.join(self._tmp_dir.name, 'profiles')
+        self.set_app_settings({PYTHON_PROFILER_OUTPUT_DIR: output_dir,
+                               PYTHON_PROFILER_SAMPLING_RATE: '1000',
+                               PYTHON_PROFILER_DURATION_SECONDS: '0.1'})
+        self._start_thread('idle-thread', self._wait_for_release)
+        with self.assertLogs('azure_functions_worker', 'INFO') as logs:
+            profiler = sampling_profiler.start_from_app_settings()
+            self.assertTrue(profiler.is_running())
+            for _ in range(100):
+                if not profiler.is_running():
+                    break
+                time.sleep(0.01)
+        self.assertFalse(profiler.is_running())
+        self.assertEqual(os.path.dirname(profiler.output_path), output_dir)
+        self.assertTrue(any('function:-;idle-thread;' in stack
+                            for stack, _ in
+                            self._read_samples(profiler.output_path)))
+        self.assertIn('Sampling profiler took', logs.output[-1])
+
+    def test_stop(self):
+        profiler = sampling_profiler.SamplingProfiler(
+            self._tmp_dir.name, sampling_rate=100, duration=60)
+        profiler.start()
+        profiler.stop()
+        self.assertFalse(profiler.is_running())
+        self.assertTrue(os.path.exists(profiler.output_path))
+
+    def test_invalid_settings(self):
+        for sampling_rate, duration in (('0', 'x'), ('nan', 'inf')):
+            self.set_app_settings({
+                PYTHON_PROFILER_OUTPUT_DIR: self._tmp_dir.name,
+                PYTHON_PROFILER_SAMPLING_RATE: sampling_rate,
+                PYTHON_PROFILER_DURATION_SECONDS: duration})
+            with self.assertLogs('azure_functions_worker', 'WARNING') as logs:
+                profiler = sampling_profiler.start_from_app_settings()
+            profiler.stop()
+            self.assertEqual(profiler._interval, 0.01)
+            self.assertEqual(profiler._duration, 60)
+            self.assertEqual(len(logs.output), 2)
+
+    def test_capped_settings(self):
+        self.set_app_settings({PYTHON_PROFILER_OUTPUT_DIR: self._tmp_dir.name,
+                               PYTHON_PROFILER_SAMPLING_RATE: '100000',
+                               PYTHON_PROFILER_DURATION_SECONDS: '1e9'})
+        with self.assertLogs('azure_functions_worker', 'WARNING') as logs:
+            profiler = sampling_profiler.start_from_app_settings()
+        profiler.stop()
+        self.assertEqual(profiler._interval, 0.001)
+        self.assertEqual(profiler._duration, 3600)
+        self.assertIn('capped', logs.output[0])
+        self.assertEqual(len(logs.output), 2)
+
+    @patch.object(sampling_profiler, 'WRITE_INTERVAL_SECONDS', 0.05)
+    def test_periodic_write(self):
+        """The samples taken so far are written while sampling, in case the
+        worker is killed before the end
+        """
+        self._start_thread('idle-thread', self._wait_for_release)
+        profiler = sampling_profiler.SamplingProfiler(
+            self._tmp_dir.name, sampling_rate=100, duration=60)
+        profiler.start()
+        try:
+            for _ in range(100):
+                if profiler.output_path is not None \
+                        and os.path.exists(profiler.output_path):
+                    break
+                time.sleep(0.01)
+            self.assertTrue(profiler.is_running())
+            self.assertTrue(any('function:-;idle-thread;' in stack
+                                for stack, _ in
+                                self._read_samples(profiler.output_path)))
+        finally:
+            profiler.stop()
+        self.assertEqual(os.listdir(self._tmp_dir.name),
+                         [os.path.basename(profiler.output_path)])
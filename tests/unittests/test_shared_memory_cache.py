@@ -0,0 +1,215 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+import sys
+from unittest import skipIf
+from unittest.mock import patch
+
+from tests.utils import testutils
+
+from azure_functions_worker import protos
+
+from azure_functions_worker.bindings.shared_memory_data_transfer import (
+    SharedMemoryCache,
+    SharedMemoryManager,
+    SharedMemoryMap,
+)
+from azure_functions_worker.bindings.shared_memory_data_transfer import (
+    SharedMemoryConstants as consts,
+)
+
+
+@skipIf(sys.platform == 'darwin', 'MacOS M1 machines do not correctly test the'
+                                  'shared memory filesystems and thus skipping'
+                                  ' these tests for the time being')
+class TestSharedMemoryCache(testutils.SharedMemoryTestCase):
+    """
+    Tests for SharedMemoryCache.
+    """
+    def _create_shared_mem_map(self, content: bytes) -> SharedMemoryMap:
+        mem_map_name = self.get_new_mem_map_name()
+        mem_map_size = len(content) + consts.CONTENT_HEADER_TOTAL_BYTES
+        mem_map = self.file_accessor.create_mem_map(mem_map_name, mem_map_size)
+        shared_mem_map = SharedMemoryMap(self.file_accessor, mem_map_name,
+                                         mem_map)
+        shared_mem_map.put_bytes(content)
+        return shared_mem_map
+
+    def _delete_shared_mem_map(self, shared_mem_map: SharedMemoryMap):
+        mem_map = self.file_accessor.open_mem_map(
+            shared_mem_map.mem_map_name, 0)
+        self.file_accessor.delete_mem_map(shared_mem_map.mem_map_name, mem_map)
+
+    def test_put_and_get(self):
+        """
+        Verify that cached content is handed out as a view over the memory map
+        and that hits and misses are counted.
+        """
+        cache = SharedMemoryCache(max_bytes=1024)
+        content = bytes(self.get_random_bytes(100))
+        shared_mem_map = self._create_shared_mem_map(content)
+        mem_map_name = shared_mem_map.mem_map_name
+        self.assertIsNone(cache.get(mem_map_name, len(content)))
+        view = cache.put(shared_mem_map, len(content))
+        self.assertIsInstance(view, memoryview)
+        self.assertEqual(content, view.tobytes())
+        view.release()
+        with cache.get(mem_map_name, len(content)) as view:
+            self.assertEqual(content, view.tobytes())
+        self.assertEqual(1, cache.hits)
+        self.assertEqual(1, cache.misses)
+        self.assertEqual(0.5, cache.hit_ratio)
+        self.assertEqual(len(content), cache.used_bytes)
+        cache.clear()
+        self.assertEqual(0, len(cache))
+        self.assertEqual(0, cache.used_bytes)
+        self._delete_shared_mem_map(shared_mem_map)
+
+    def test_lru_eviction_by_bytes(self):
+        """
+        Verify that the least recently used memory maps are evicted once the
+        total content size exceeds the capacity.
+        """
+        cache = SharedMemoryCache(max_bytes=250)
+        shared_mem_maps = [
+            self._create_shared_mem_map(bytes(self.get_random_bytes(100)))
+            for _ in range(3)]
+        cache.put(shared_mem_maps[0], 100).release()
+        cache.put(shared_mem_maps[1], 100).release()
+        # Use the first memory map so the second one is the least recently used
+        cache.get(shared_mem_maps[0].mem_map_name, 100).release()
+        cache.put(shared_mem_maps[2], 100).release()
+        self.assertEqual(1, cache.evictions)
+        self.assertEqual(200, cache.used_bytes)
+        self.assertIn(shared_mem_maps[0].mem_map_name, cache)
+        self.assertNotIn(shared_mem_maps[1].mem_map_name, cache)
+        self.assertIn(shared_mem_maps[2].mem_map_name, cache)
+        self.assertTrue(shared_mem_maps[1].mem_map.closed)
+        cache.clear()
+        for shared_mem_map in shared_mem_maps:
+            self._delete_shared_mem_map(shared_mem_map)
+
+    def test_put_larger_than_capacity(self):
+        """
+        Verify that content larger than the capacity is not cached.
+        """
+        cache = SharedMemoryCache(max_bytes=10)
+        shared_mem_map = self._create_shared_mem_map(
+            bytes(self.get_random_bytes(100)))
+        self.assertIsNone(cache.put(shared_mem_map, 100))
+        self.assertEqual(0, len(cache))
+        shared_mem_map.dispose()
+
+    def test_manager_reuses_cached_mem_map(self):
+        """
+        Verify that SharedMemoryManager opens a memory map only once when the
+        cache is enabled and the same content is read repeatedly.
+        """
+        manager = SharedMemoryManager()
+        manager.enable_cache()
+        content_size = consts.MIN_BYTES_FOR_SHARED_MEM_TRANSFER + 10
+        content = bytes(self.get_random_bytes(content_size))
+        shared_mem_map = self._create_shared_mem_map(content)
+        mem_map_name = shared_mem_map.mem_map_name
+        shared_mem_map.dispose(is_delete_file=False)
+        with patch.object(manager, '_open', wraps=manager._open) as mock_open:
+            for _ in range(3):
+                read_content = manager.get_bytes(mem_map_name, offset=0,
+                                                 count=content_size)
+                self.assertEqual(content, read_content)
+            mock_open.assert_called_once()
+        self.assertEqual(2, manager.cache.hits)
+        self.assertEqual(1, manager.cache.misses)
+        manager.cache.clear()
+        mem_map = self.file_accessor.open_mem_map(mem_map_name, 0)
+        self.file_accessor.delete_mem_map(mem_map_name, mem_map)
+
+    def test_stale_content_length(self):
+        """
+        Verify that a cached memory map looked up with another content length
+        is dropped as stale.
+        """
+        cache = SharedMemoryCache(max_bytes=1024)
+        shared_mem_map = self._create_shared_mem_map(
+            bytes(self.get_random_bytes(100)))
+        mem_map_name = shared_mem_map.mem_map_name
+        cache.put(shared_mem_map, 100).release()
+        self.assertIsNone(cache.get(mem_map_name, 50))
+        self.assertNotIn(mem_map_name, cache)
+        self.assertEqual(0, cache.used_bytes)
+        self.assertTrue(shared_mem_map.mem_map.closed)
+        self._delete_shared_mem_map(shared_mem_map)
+
+    def test_manager_free_invalidates_cached_mem_map(self):
+        """
+        Verify that freeing a memory map of the host closes its cached mapping,
+        so a new memory map with the same name is read instead of stale
+        content.
+        """
+        manager = SharedMemoryManager()
+        manager.enable_cache()
+        content_size = consts.MIN_BYTES_FOR_SHARED_MEM_TRANSFER + 10
+        content = bytes(self.get_random_bytes(content_size))
+        shared_mem_map = self._create_shared_mem_map(content)
+        mem_map_name = shared_mem_map.mem_map_name
+        shared_mem_map.dispose(is_delete_file=False)
+        self.assertEqual(content, manager.get_bytes(mem_map_name, 0,
+                                                    content_size))
+        self.assertIn(mem_map_name, manager.cache)
+
+        self.assertEqual({mem_map_name: True},
+                         manager.free_mem_maps([mem_map_name], False))
+        self.assertNotIn(mem_map_name, manager.cache)
+        self.assertEqual(1, manager.cache.invalidations)
+
+        # The host deletes the memory map and reuses its name
+        mem_map = self.file_accessor.open_mem_map(mem_map_name, 0)
+        self.file_accessor.delete_mem_map(mem_map_name, mem_map)
+        new_content = bytes(self.get_random_bytes(content_size))
+        mem_map = self.file_accessor.create_mem_map(
+            mem_map_name, content_size + consts.CONTENT_HEADER_TOTAL_BYTES)
+        new_shared_mem_map = SharedMemoryMap(self.file_accessor, mem_map_name,
+                                             mem_map)
+        new_shared_mem_map.put_bytes(new_content)
+        new_shared_mem_map.dispose(is_delete_file=False)
+        self.assertEqual(new_content, manager.get_bytes(mem_map_name, 0,
+                                                        content_size))
+        manager.cache.clear()
+        mem_map = self.file_accessor.open_mem_map(mem_map_name, 0)
+        self.file_accessor.delete_mem_map(mem_map_name, mem_map)
+
+    def test_manager_reads_string_and_message_from_view(self):
+        """
+        Verify that strings and protobuf messages are read from a cached
+        memory map without copying its content to bytes first.
+        """
+        manager = SharedMemoryManager()
+        manager.enable_cache()
+        message = protos.CollectionString(string=['foo', 'bar'])
+        content = message.SerializeToString()
+        shared_mem_map = self._create_shared_mem_map(content)
+        mem_map_name = shared_mem_map.mem_map_name
+        shared_mem_map.dispose(is_delete_file=False)
+        with patch.object(SharedMemoryMap, 'get_bytes') as mock_get_bytes:
+            for _ in range(2):
+                self.assertEqual(message, manager.get_message(
+                    mem_map_name, 0, len(content), protos.CollectionString))
+            self.assertEqual(content.decode('utf-8'), manager.get_string(
+                mem_map_name, 0, len(content)))
+            mock_get_bytes.assert_not_called()
+        self.assertEqual(2, manager.cache.hits)
+        manager.cache.clear()
+        mem_map = self.file_accessor.open_mem_map(mem_map_name, 0)
+        self.file_accessor.delete_mem_map(mem_map_name, mem_map)
+
+    def test_stats_logged(self):
+        """
+        Verify that the statistics of the cache are logged at info level at
+        most once per interval.
+        """
+        cache = SharedMemoryCache(max_bytes=1024, stats_interval=0)
+        with self.assertLogs('azure_functions_worker', 'INFO') as logs:
+            cache.get('missing', 100)
+        self.assertEqual(1, len(logs.output))
+        self.assertIn("'misses': 1", logs.output[0])
+        self.assertEqual(1, cache.get_stats()['misses'])
@@ -5,12 +5,15 @@ import json
 import math
 import os
 import sys
+import tracemalloc
 from unittest import skipIf
 from unittest.mock import patch
 
 from azure.functions import meta as bind_meta
 from tests.utils import testutils
 
+from azure_functions_worker import protos
+from azure_functions_worker.bindings.datumdef import Datum
 from azure_functions_worker.bindings.shared_memory_data_transfer import (
     SharedMemoryConstants as consts,
 )
@@ -20,7 +23,6 @@ from azure_functions_worker.bindings.shared_memory_data_transfer import (
 from azure_functions_worker.constants import (
     FUNCTIONS_WORKER_SHARED_MEMORY_DATA_TRANSFER_ENABLED,
 )
-from azure_functions_worker.utils.common import is_envvar_true
 
 
 @skipIf(sys.platform == 'darwin', 'MacOS M1 machines do not correctly test the'
@@ -31,19 +33,16 @@ class TestSharedMemoryManager(testutils.SharedMemoryTestCase):
     Tests for SharedMemoryManager.
     """
     def setUp(self):
-        env = os.environ.copy()
-        env['FUNCTIONS_WORKER_SHARED_MEMORY_DATA_TRANSFER_ENABLED'] = "true"
-        self.mock_environ = patch.dict('os.environ', env)
+        super().setUp()
         self.mock_sys_module = patch.dict('sys.modules', sys.modules.copy())
         self.mock_sys_path = patch('sys.path', sys.path.copy())
-        self.mock_environ.start()
         self.mock_sys_module.start()
         self.mock_sys_path.start()
 
     def tearDown(self):
         self.mock_sys_path.stop()
         self.mock_sys_module.stop()
-        self.mock_environ.stop()
+        super().tearDown()
 
     def test_is_enabled(self):
         """
@@ -52,16 +51,10 @@ class TestSharedMemoryManager(testutils.SharedMemoryTestCase):
         """
 
         # Make sure shared memory data transfer is enabled
-        was_shmem_env_true = is_envvar_true(
-            FUNCTIONS_WORKER_SHARED_MEMORY_DATA_TRANSFER_ENABLED)
-        os.environ.update(
+        self.set_app_settings(
             {FUNCTIONS_WORKER_SHARED_MEMORY_DATA_TRANSFER_ENABLED: '1'})
         manager = SharedMemoryManager()
         self.assertTrue(manager.is_enabled())
-        # Restore the env variable to original value
-        if not was_shmem_env_true:
-            os.environ.update(
-                {FUNCTIONS_WORKER_SHARED_MEMORY_DATA_TRANSFER_ENABLED: '0'})
 
     def test_is_disabled(self):
         """
@@ -69,16 +62,10 @@ class TestSharedMemoryManager(testutils.SharedMemoryTestCase):
         disabled.
         """
         # Make sure shared memory data transfer is disabled
-        was_shmem_env_true = is_envvar_true(
-            FUNCTIONS_WORKER_SHARED_MEMORY_DATA_TRANSFER_ENABLED)
-        os.environ.update(
+        self.set_app_settings(
             {FUNCTIONS_WORKER_SHARED_MEMORY_DATA_TRANSFER_ENABLED: '0'})
         manager = SharedMemoryManager()
         self.assertFalse(manager.is_enabled())
-        # Restore the env variable to original value
-        if was_shmem_env_true:
-            os.environ.update(
-                {FUNCTIONS_WORKER_SHARED_MEMORY_DATA_TRANSFER_ENABLED: '1'})
 
     def test_bytes_input_support(self):
         """
@@ -185,6 +172,119 @@ class TestSharedMemoryManager(testutils.SharedMemoryTestCase):
         is_supported = manager.is_supported(datum)
         self.assertFalse(is_supported)
 
+    def test_json_input_support_extended_types(self):
+        """
+        Verify that large json is supported by SharedMemoryManager once the
+        host has enabled extended types.
+        """
+        manager = SharedMemoryManager()
+        content_size = consts.MIN_BYTES_FOR_SHARED_MEM_TRANSFER + 10
+        num_chars = math.floor(content_size / consts.SIZE_OF_CHAR_BYTES)
+        content = json.dumps({'val': self.get_random_string(num_chars)})
+        datum = bind_meta.Datum(type='json', value=content)
+        self.assertFalse(manager.is_supported(datum))
+        manager.extended_types_enabled = True
+        self.assertTrue(manager.is_supported(datum))
+
+    def test_collection_bytes_support_extended_types(self):
+        """
+        Verify that a large collection_bytes is supported by
+        SharedMemoryManager once the host has enabled extended types.
+        """
+        manager = SharedMemoryManager()
+        content_size = consts.MIN_BYTES_FOR_SHARED_MEM_TRANSFER + 10
+        content = protos.CollectionBytes(
+            bytes=[bytes(self.get_random_bytes(content_size // 2))
+                   for _ in range(2)])
+        datum = bind_meta.Datum(type='collection_bytes', value=content)
+        self.assertFalse(manager.is_supported(datum))
+        manager.extended_types_enabled = True
+        self.assertTrue(manager.is_supported(datum))
+
+    def test_extended_types_round_trip(self):
+        """
+        Verify that json, collection and http data written into shared memory
+        are read back as the same Datum.
+        """
+        manager = SharedMemoryManager()
+        manager.extended_types_enabled = True
+        content_size = consts.MIN_BYTES_FOR_SHARED_MEM_TRANSFER + 10
+        datums = [
+            Datum(json.dumps({'val': self.get_random_string(content_size)}),
+                  'json'),
+            Datum(protos.CollectionBytes(
+                bytes=[bytes(self.get_random_bytes(content_size // 2))
+                       for _ in range(2)]), 'collection_bytes'),
+            Datum(protos.CollectionString(
+                string=[self.get_random_string(content_size // 2)
+                        for _ in range(2)]), 'collection_string'),
+            Datum(protos.CollectionDouble(
+                double=[float(i) for i in range(content_size // 8)]),
+                'collection_double'),
+            Datum(protos.CollectionSInt64(
+                sint64=[-i for i in range(content_size // 4)]),
+                'collection_sint64'),
+        ]
+        for datum in datums:
+            shmem = Datum.to_rpc_shared_memory(datum, manager)
+            self.assertIsNotNone(shmem)
+            self.assertEqual(protos.RpcDataType.Value(datum.type), shmem.type)
+            read_datum = Datum.from_rpc_shared_memory(shmem, manager)
+            self.assertEqual(datum, read_datum)
+            self.assertEqual(datum.python_value, read_datum.python_value)
+            free_success = manager.free_mem_map(shmem.name)
+            self.assertTrue(free_success)
+
+    def test_extended_types_converted_once(self):
+        """
+        Verify that a collection sized and written into shared memory from
+        an already converted TypedData is not converted again.
+        """
+        manager = SharedMemoryManager()
+        manager.extended_types_enabled = True
+        content_size = consts.MIN_BYTES_FOR_SHARED_MEM_TRANSFER + 10
+        datum = Datum(protos.CollectionBytes(
+            bytes=[bytes(self.get_random_bytes(content_size // 2))
+                   for _ in range(2)]), 'collection_bytes')
+        typed_data = protos.TypedData(collection_bytes=datum.value)
+        with patch('azure_functions_worker.bindings.datumdef.datum_as_proto')\
+                as datumdef_as_proto, \
+                patch('azure_functions_worker.bindings.'
+                      'shared_memory_data_transfer.shared_memory_manager.'
+                      'datum_as_proto') as manager_as_proto:
+            self.assertTrue(manager.is_supported(datum, typed_data))
+            shmem = Datum.to_rpc_shared_memory(datum, manager, typed_data)
+        datumdef_as_proto.assert_not_called()
+        manager_as_proto.assert_not_called()
+        self.assertEqual(datum, Datum.from_rpc_shared_memory(shmem, manager))
+        self.assertTrue(manager.free_mem_map(shmem.name))
+
+    def test_http_round_trip(self):
+        """
+        Verify that an http response written into shared memory is read back
+        with the same status, headers and body.
+        """
+        manager = SharedMemoryManager()
+        manager.extended_types_enabled = True
+        content_size = consts.MIN_BYTES_FOR_SHARED_MEM_TRANSFER + 10
+        body = bytes(self.get_random_bytes(content_size))
+        datum = Datum({
+            'status_code': Datum('200', 'string'),
+            'headers': {'content-type': Datum('text/plain', 'string')},
+            'body': Datum(body, 'bytes'),
+        }, 'http')
+        self.assertTrue(manager.is_supported(datum))
+        shmem = Datum.to_rpc_shared_memory(datum, manager)
+        self.assertIsNotNone(shmem)
+        self.assertEqual(protos.RpcDataType.http, shmem.type)
+        read_datum = Datum.from_rpc_shared_memory(shmem, manager)
+        self.assertEqual('http', read_datum.type)
+        self.assertEqual(Datum(body, 'bytes'), read_datum.value['body'])
+        self.assertEqual(Datum('text/plain', 'string'),
+                         read_datum.value['headers']['content-type'])
+        free_success = manager.free_mem_map(shmem.name)
+        self.assertTrue(free_success)
+
     def test_large_invalid_bytes_input_support(self):
         """
         Verify that the given input is NOT supported by SharedMemoryManager to
@@ -301,6 +401,47 @@ class TestSharedMemoryManager(testutils.SharedMemoryTestCase):
         free_success = manager.free_mem_map(shared_mem_meta.mem_map_name)
         self.assertTrue(free_success)
 
+    def test_put_string_multi_byte_chars(self):
+        """
+        Verify that a string with multi-byte UTF-8 characters spanning the
+        chunk boundaries used while encoding is put into shared memory with the
+        exact encoded size and can be read back.
+        """
+        manager = SharedMemoryManager()
+        num_chars = consts.STRING_ENCODE_CHUNK_NUM_CHARS + 10
+        content = ('a\u00e9\u4e2d\U0001f600' * num_chars)[:num_chars]
+        expected_size = len(content.encode('utf-8'))
+        shared_mem_meta = manager.put_string(content)
+        self.assertIsNotNone(shared_mem_meta)
+        self.assertEqual(expected_size, shared_mem_meta.count_bytes)
+        read_content = manager.get_string(shared_mem_meta.mem_map_name,
+                                          offset=0,
+                                          count=shared_mem_meta.count_bytes)
+        self.assertEqual(content, read_content)
+        free_success = manager.free_mem_map(shared_mem_meta.mem_map_name)
+        self.assertTrue(free_success)
+
+    def test_put_string_does_not_copy_content(self):
+        """
+        Verify that putting a large string into shared memory does not
+        allocate a full encoded copy of it.
+        """
+        manager = SharedMemoryManager()
+        content_size = 16 * consts.STRING_ENCODE_CHUNK_NUM_CHARS
+        content = 'a' * content_size
+        tracemalloc.start()
+        try:
+            shared_mem_meta = manager.put_string(content)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        self.assertIsNotNone(shared_mem_meta)
+        self.assertEqual(content_size, shared_mem_meta.count_bytes)
+        # Only a few chunks are alive at a time while encoding
+        self.assertLess(peak, 4 * consts.STRING_ENCODE_CHUNK_NUM_CHARS)
+        free_success = manager.free_mem_map(shared_mem_meta.mem_map_name)
+        self.assertTrue(free_success)
+
     def test_invalid_put_string(self):
         """
         Attempt to put a string using an invalid input and verify that it fails.
@@ -383,6 +524,28 @@ class TestSharedMemoryManager(testutils.SharedMemoryTestCase):
         self.assertIsNone(shared_mem_meta)
         self.assertEqual(0, len(manager.allocated_mem_maps.keys()))
 
+    def test_free_mem_maps(self):
+        """
+        Verify that a batch of memory maps is freed and that the result is
+        reported for each of them, including those that are not tracked.
+        """
+        manager = SharedMemoryManager()
+        content = self.get_random_bytes(consts.MIN_BYTES_FOR_SHARED_MEM_TRANSFER)
+        mem_map_names = [manager.put_bytes(content).mem_map_name
+                         for _ in range(10)]
+        unknown_mem_map_name = self.get_new_mem_map_name()
+        results = manager.free_mem_maps(
+            mem_map_names + [unknown_mem_map_name])
+        self.assertEqual(
+            {**{name: True for name in mem_map_names},
+             unknown_mem_map_name: False},
+            results)
+        self.assertEqual(0, len(manager.allocated_mem_maps.keys()))
+        for mem_map_name in mem_map_names:
+            for mem_map_dir in manager.file_accessor.valid_dirs:
+                self.assertFalse(os.path.exists(
+                    os.path.join(mem_map_dir, mem_map_name)))
+
     def test_invalid_free_mem_map(self):
         """
         Attempt to free a shared memory map that does not exist in the list of
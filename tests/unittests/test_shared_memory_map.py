@@ -92,6 +92,30 @@ class TestSharedMemoryMap(testutils.SharedMemoryTestCase):
             dispose_status = shared_mem_map.dispose()
             self.assertTrue(dispose_status)
 
+    def test_put_chunks(self):
+        """
+        Create a SharedMemoryMap, write multiple chunks of bytes to it and then
+        read them back.
+        Verify that the chunks were written contiguously.
+        """
+        chunks = [self.get_random_bytes(content_size)
+                  for content_size in [1, 10, 1024, 2 * 1024 * 1024]]
+        content = b''.join(chunks)
+        content_size = len(content)
+        mem_map_name = self.get_new_mem_map_name()
+        mem_map_size = content_size + consts.CONTENT_HEADER_TOTAL_BYTES
+        mem_map = self.file_accessor.create_mem_map(mem_map_name,
+                                                    mem_map_size)
+        shared_mem_map = SharedMemoryMap(self.file_accessor, mem_map_name,
+                                         mem_map)
+        num_bytes_written = shared_mem_map.put_chunks(iter(chunks),
+                                                      content_size)
+        self.assertEqual(content_size, num_bytes_written)
+        read_content = shared_mem_map.get_bytes()
+        self.assertEqual(content, read_content)
+        dispose_status = shared_mem_map.dispose()
+        self.assertTrue(dispose_status)
+
     def test_put_bytes_more_than_capacity(self):
         """
         Attempt to put more bytes into the created SharedMemoryMap than the
@@ -0,0 +1,36 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+import unittest
+
+from azure_functions_worker.utils.timeline import StepTimeline
+
+
+class TestStepTimeline(unittest.TestCase):
+
+    def test_steps(self):
+        timeline = StepTimeline('Test')
+        with timeline.step('first'):
+            pass
+        with self.assertRaises(ValueError):
+            with timeline.step('failing'):
+                raise ValueError()
+
+        steps = timeline.get_steps()
+        self.assertEqual([s.name for s in steps], ['first', 'failing'])
+        for s in steps:
+            self.assertLessEqual(s.start, s.end)
+        self.assertLessEqual(steps[0].end, steps[1].start)
+
+    def test_log(self):
+        timeline = StepTimeline('Test')
+        with timeline.step('first'):
+            pass
+        with timeline.step('second'):
+            pass
+
+        with self.assertLogs('azure_functions_worker', 'INFO') as logs:
+            timeline.log()
+        self.assertRegex(
+            logs.output[0],
+            r'Test timeline \(\d+\.\d ms\): first \d+\.\d-\d+\.\d ms, '
+            r'second \d+\.\d-\d+\.\d ms$')
@@ -3,12 +3,16 @@
 import importlib.util
 import os
 import sys
+import types
 import unittest
 from unittest.mock import patch
 
 from tests.utils import testutils
 
-from azure_functions_worker.utils.dependency import DependencyManager
+from azure_functions_worker.utils.dependency import (
+    DependencyManager,
+    ModuleLocationIndex,
+)
 
 
 class TestDependencyManager(unittest.TestCase):
@@ -558,6 +562,21 @@ class TestDependencyManager(unittest.TestCase):
         with self.assertRaises(ImportError):
             import common_module  # NoQA
 
+    @patch('azure_functions_worker.utils.dependency.packages_bundle')
+    def test_prioritize_customer_dependencies_packages_bundle(
+            self, mock_packages_bundle):
+        os.environ['PYTHON_ISOLATE_WORKER_DEPENDENCIES'] = 'true'
+        DependencyManager.worker_deps_path = self._worker_deps_path
+        DependencyManager.cx_deps_path = self._customer_deps_path
+        DependencyManager.cx_working_dir = self._customer_func_path
+
+        DependencyManager.prioritize_customer_dependencies()
+        mock_packages_bundle.install_finder.assert_called_once_with(
+            self._customer_deps_path)
+
+        DependencyManager.use_worker_dependencies()
+        mock_packages_bundle.remove_finders.assert_called_once_with()
+
     def test_prioritize_customer_dependencies(self):
         # Setup app settings
         os.environ['PYTHON_ISOLATE_WORKER_DEPENDENCIES'] = 'true'
@@ -782,3 +801,64 @@ class TestDependencyManager(unittest.TestCase):
             next_check, len(expected_order),
             'The order in sys_paths does not match the expected_order paths'
         )
+
+
+class TestModuleLocationIndex(unittest.TestCase):
+
+    def setUp(self):
+        self._patch_modules = patch.dict('sys.modules', {})
+        self._patch_modules.start()
+        self.index = ModuleLocationIndex()
+
+    def tearDown(self):
+        self._patch_modules.stop()
+
+    def _add_module(self, name, file=None, path=None):
+        module = types.ModuleType(name)
+        module.__file__ = file
+        if path is not None:
+            module.__path__ = path
+        sys.modules[name] = module
+        return module
+
+    def test_get_module_names(self):
+        self._add_module('cx_pkg', '/cx/cx_pkg/__init__.py', ['/cx/cx_pkg'])
+        self._add_module('cx_pkg.mod', '/cx/cx_pkg/mod.py')
+        self._add_module('worker_mod', '/worker/worker_mod.py')
+        self._add_module('azure_functions_worker.mod', '/cx/mod.py')
+        sys.modules['not_a_module'] = object()
+
+        self.assertEqual(self.index.get_module_names('/cx'),
+                         {'cx_pkg', 'cx_pkg.mod'})
+        self.assertEqual(self.index.get_module_names('/worker'),
+                         {'worker_mod'})
+        self.assertEqual(self.index.get_module_names('/other'), set())
+
+    def test_get_module_names_after_imports(self):
+        self._add_module('cx_mod', '/cx/cx_mod.py')
+        self.assertEqual(self.index.get_module_names('/cx'), {'cx_mod'})
+
+        # Removed, added and replaced modules
+        del sys.modules['cx_mod']
+        self._add_module('cx_mod2', '/cx/cx_mod2.py')
+        self._add_module('worker_mod', '/cx/worker_mod.py')
+        self.assertEqual(self.index.get_module_names('/cx'),
+                         {'cx_mod2', 'worker_mod'})
+        self._add_module('worker_mod', '/worker/worker_mod.py')
+        self.assertEqual(self.index.get_module_names('/cx'), {'cx_mod2'})
+
+    def test_get_module_names_namespace_package(self):
+        class NamespacePath:
+            def __init__(self, paths):
+                self.paths = paths
+
+            def __iter__(self):
+                return iter(self.paths)
+
+        namespace_path = NamespacePath(['/worker/namespace'])
+        self._add_module('namespace', path=namespace_path)
+        self.assertEqual(self.index.get_module_names('/cx'), set())
+
+        # The __path__ of a namespace package changes with sys.path
+        namespace_path.paths.append('/cx/namespace')
+        self.assertEqual(self.index.get_module_names('/cx'), {'namespace'})
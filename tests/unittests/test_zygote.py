@@ -0,0 +1,173 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+import argparse
+import json
+import os
+import signal
+import sys
+import tempfile
+import threading
+import unittest
+from unittest.mock import patch
+
+from azure_functions_worker import main, zygote
+from azure_functions_worker.constants import (
+    FUNCTIONS_WORKER_PROCESS_COUNT,
+    PYTHON_ENABLE_WORKER_ZYGOTE,
+)
+
+
+def _run_worker_process(args):
+    # Runs in the worker processes forked by the zygote
+    with open(os.environ['ZYGOTE_TEST_OUTPUT'], 'w') as f:
+        json.dump({'worker_id': args.worker_id,
+                   'zygote_pid': os.getppid(),
+                   'cwd': os.getcwd()}, f)
+    if args.worker_id == 'failing-worker':
+        sys.exit(3)
+
+
+@unittest.skipIf(not sys.platform.startswith('linux'),
+                 'Zygote mode is only available on Linux')
+class TestZygote(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp_dir = tempfile.TemporaryDirectory()
+        self._zygote_pid = None
+        self._patch_preload = patch.object(zygote._Zygote, '_preload')
+        self._patch_run = patch.object(main, 'run', _run_worker_process)
+        self._patch_preload.start()
+        self._patch_run.start()
+
+    def tearDown(self):
+        self._patch_run.stop()
+        self._patch_preload.stop()
+        if self._zygote_pid is not None:
+            os.kill(self._zygote_pid, signal.SIGTERM)
+            os.waitpid(self._zygote_pid, 0)
+        self._tmp_dir.cleanup()
+
+    def _run_worker(self, worker_id: str):
+        output_path = os.path.join(self._tmp_dir.name, worker_id)
+        argv = ['worker.py', '--host', '127.0.0.1', '--port', '1',
+                '--workerId', worker_id, '--requestId', 'request-id']
+        with patch.object(sys, 'argv', argv), \
+                patch.dict(os.environ, {'ZYGOTE_TEST_OUTPUT': output_path}):
+            exit_code = zygote.run_worker(main.parse_args())
+
+        with open(output_path) as f:
+            output = json.load(f)
+        self.assertEqual(output['worker_id'], worker_id)
+        self.assertEqual(output['cwd'], os.getcwd())
+        self._zygote_pid = output['zygote_pid']
+        return exit_code, output
+
+    def test_run_worker(self):
+        exit_code, output = self._run_worker('worker-1')
+        self.assertEqual(exit_code, 0)
+        self.assertNotEqual(output['zygote_pid'], os.getpid())
+
+        # Forked by the same zygote
+        exit_code, failing_output = self._run_worker('failing-worker')
+        self.assertEqual(exit_code, 3)
+        self.assertEqual(failing_output['zygote_pid'], output['zygote_pid'])
+
+    def test_refuses_process_not_started_by_host(self):
+        _, output = self._run_worker('worker-1')
+        address = zygote.get_address('127.0.0.1', 1)
+
+        # A child of this process is not started by the same host process
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = os.fork()
+        if pid == 0:
+            exit_code = 1
+            try:
+                conn = zygote._connect(address)
+                try:
+                    zygote._request_worker(conn)
+                except (OSError, EOFError):
+                    exit_code = 0
+            finally:
+                os._exit(exit_code)
+        _, status = os.waitpid(pid, 0)
+        self.assertEqual(os.WEXITSTATUS(status), 0)
+
+        # Processes started by the host are still served
+        exit_code, next_output = self._run_worker('worker-2')
+        self.assertEqual(exit_code, 0)
+        self.assertEqual(next_output['zygote_pid'], output['zygote_pid'])
+
+    def test_threads_started_while_preloading(self):
+        forked_pids = []
+        fork = os.fork
+
+        def record_fork():
+            pid = fork()
+            if pid > 0:
+                forked_pids.append(pid)
+            return pid
+
+        def preload(_):
+            threading.Thread(target=threading.Event().wait,
+                             daemon=True).start()
+
+        args = argparse.Namespace(host='127.0.0.1', port=3)
+        with patch.object(zygote._Zygote, '_preload', preload), \
+                patch.object(os, 'fork', record_fork):
+            # The worker runs in the process started by the host
+            self.assertIsNone(zygote.run_worker(args))
+
+        self.assertEqual(len(forked_pids), 1)
+        _, status = os.waitpid(forked_pids[0], 0)
+        self.assertEqual(os.WEXITSTATUS(status), 0)
+        self.assertIsNone(
+            zygote._connect(zygote.get_address('127.0.0.1', 3)))
+
+    def test_connect_refuses_other_user(self):
+        self._run_worker('worker-1')
+        address = zygote.get_address('127.0.0.1', 1)
+        with patch.object(os, 'getuid', return_value=os.getuid() + 1):
+            self.assertIsNone(zygote._connect(address))
+
+    def test_stop_forking(self):
+        _, output = self._run_worker('worker-1')
+        with patch.object(zygote, '_zygote_pid', output['zygote_pid']):
+            zygote.stop_forking()
+        # The zygote exits, as it has no worker left
+        _, status = os.waitpid(output['zygote_pid'], 0)
+        self._zygote_pid = None
+        self.assertEqual(os.WEXITSTATUS(status), 0)
+        self.assertIsNone(
+            zygote._connect(zygote.get_address('127.0.0.1', 1)))
+
+    def test_stop_forking_not_forked(self):
+        with patch.object(os, 'kill') as kill_mock:
+            zygote.stop_forking()
+        kill_mock.assert_not_called()
+
+    def test_run_worker_without_zygote(self):
+        args = argparse.Namespace(host='127.0.0.1', port=2)
+        with patch.object(zygote, '_start_zygote') as start_zygote_mock:
+            self.assertIsNone(zygote.run_worker(args))
+        start_zygote_mock.assert_called_once()
+
+    def test_get_address(self):
+        self.assertEqual(zygote.get_address('127.0.0.1', 1),
+                         zygote.get_address('127.0.0.1', 1))
+        self.assertNotEqual(zygote.get_address('127.0.0.1', 1),
+                            zygote.get_address('127.0.0.1', 2))
+
+    def test_is_enabled(self):
+        with patch.dict(os.environ, {PYTHON_ENABLE_WORKER_ZYGOTE: 'true',
+                                     FUNCTIONS_WORKER_PROCESS_COUNT: '2'}):
+            self.assertTrue(zygote.is_enabled())
+        with patch.dict(os.environ, {PYTHON_ENABLE_WORKER_ZYGOTE: 'true',
+                                     FUNCTIONS_WORKER_PROCESS_COUNT: '1'}):
+            self.assertFalse(zygote.is_enabled())
+        with patch.dict(os.environ, {PYTHON_ENABLE_WORKER_ZYGOTE: 'true',
+                                     FUNCTIONS_WORKER_PROCESS_COUNT: 'x'}):
+            self.assertFalse(zygote.is_enabled())
+        with patch.dict(os.environ, {FUNCTIONS_WORKER_PROCESS_COUNT: '2'}):
+            os.environ.pop(PYTHON_ENABLE_WORKER_ZYGOTE, None)
+            self.assertFalse(zygote.is_enabled())
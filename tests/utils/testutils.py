@@ -30,6 +30,7 @@ import time
 import typing
 import unittest
 import uuid
+from unittest.mock import patch
 
 import grpc
 import requests
@@ -61,6 +62,7 @@ from azure_functions_worker.constants import (
     FUNCTIONS_WORKER_SHARED_MEMORY_DATA_TRANSFER_ENABLED,
     UNIX_SHARED_MEMORY_DIRECTORIES,
 )
+from azure_functions_worker.utils.app_setting_manager import reload_app_settings
 from azure_functions_worker.utils.common import get_app_setting, is_envvar_true
 
 TESTS_ROOT = PROJECT_ROOT / 'tests'
@@ -138,6 +140,36 @@ class AsyncTestCase(unittest.TestCase, metaclass=AsyncTestCaseMeta):
     pass
 
 
+class AppSettingsTestCase(unittest.TestCase):
+    """
+    For tests of code reading the app settings, which the worker reads from
+    a snapshot of the environment. The environment is restored and the
+    snapshot retaken after each test; tests change the app settings with
+    set_app_settings.
+    """
+
+    def setUp(self):
+        self._mock_app_settings = patch.dict(os.environ)
+        self._mock_app_settings.start()
+        reload_app_settings()
+
+    def tearDown(self):
+        self._mock_app_settings.stop()
+        reload_app_settings()
+
+    def set_app_settings(self,
+                         settings: typing.Dict[str, typing.Optional[str]]):
+        """Sets the app settings, or removes those set to None, until the end
+        of the test.
+        """
+        for setting, value in settings.items():
+            if value is None:
+                os.environ.pop(setting, None)
+            else:
+                os.environ[setting] = value
+        reload_app_settings()
+
+
 class WebHostTestCaseMeta(type(unittest.TestCase)):
 
     def __new__(mcls, name, bases, dct):
@@ -320,15 +352,14 @@ class WebHostTestCase(unittest.TestCase, metaclass=WebHostTestCaseMeta):
                         raise test_exception
 
 
-class SharedMemoryTestCase(unittest.TestCase):
+class SharedMemoryTestCase(AppSettingsTestCase):
     """
     For tests involving shared memory data transfer usage.
     """
 
     def setUp(self):
-        self.was_shmem_env_true = is_envvar_true(
-            FUNCTIONS_WORKER_SHARED_MEMORY_DATA_TRANSFER_ENABLED)
-        os.environ.update(
+        super().setUp()
+        self.set_app_settings(
             {FUNCTIONS_WORKER_SHARED_MEMORY_DATA_TRANSFER_ENABLED: '1'})
 
         os_name = platform.system()
@@ -353,10 +384,7 @@ class SharedMemoryTestCase(unittest.TestCase):
                     {UNIX_SHARED_MEMORY_DIRECTORIES: self.was_shmem_dirs})
         elif os_name == 'Linux':
             self._tearDownLinux()
-
-        if not self.was_shmem_env_true:
-            os.environ.update(
-                {FUNCTIONS_WORKER_SHARED_MEMORY_DATA_TRANSFER_ENABLED: '0'})
+        super().tearDown()
 
     def get_new_mem_map_name(self):
         return str(uuid.uuid4())